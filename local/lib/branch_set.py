@@ -0,0 +1,265 @@
+'''
+branch_set - main branch catalogues (one row per branch point, as written by
+branch_tabulate) held as contiguous column arrays grouped by branch, for per-branch
+operations without groupby or python loops.
+
+Rows are sorted by root and, within a branch, by increasing snapshot (forward in time).
+offsets[i]:offsets[i+1] are the rows of branch i, so per-branch reductions are
+np.ufunc.reduceat over offsets and per-branch cumulative sums are one cumsum over the
+branches laid out as rows of a zero-padded (n_branches, longest branch) array.
+
+    branches = branch_set.BranchSet.from_dataframe(tree_tab)
+    z0_lum = branches.at_snapshot('log10_Lbh_bol', 99)
+    dE = branches.diff('BH_CumEgyInjection_RM')
+    half = branches.half_point(np.nan_to_num(dE))
+    t_since_half = branches.relative_to('branch_lookback_time', half)
+'''
+
+import numpy as np
+import pandas as pd
+
+
+class BranchSet(object):
+    '''
+    Parameters
+    ----------
+    columns : dict of ndarray
+        Column arrays, sorted by branch and increasing snapshot.
+    offsets : ndarray (n_branches + 1)
+        First row of every branch, and the number of rows.
+    root : str
+        Column identifying the branch (root subfind id).
+    snap : str
+        Snapshot column.
+    '''
+    def __init__(self, columns, offsets, root='root_subfind', snap='branch_snapnum'):
+        self.columns = columns
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.root = root
+        self.snap = snap
+
+    @classmethod
+    def from_dataframe(cls, tab, root='root_subfind', snap='branch_snapnum', columns=None):
+        '''
+        BranchSet of a long-format branch table. Columns are taken without a copy when the
+        table is already sorted by root and increasing snapshot.
+        '''
+        columns = list(tab.columns) if columns is None else list(set([root, snap]) | set(columns))
+        roots = tab[root].to_numpy()
+        snaps = tab[snap].to_numpy()
+        ordered = roots.shape[0] < 2 or np.all((roots[1:] > roots[:-1]) | ((roots[1:] == roots[:-1]) & (snaps[1:] > snaps[:-1])))
+        if ordered:
+            data = {name: tab[name].to_numpy(copy=False) for name in columns}
+        else:
+            order = np.lexsort((snaps, roots))
+            data = {name: tab[name].to_numpy()[order] for name in columns}
+        starts = np.flatnonzero(np.concatenate([[True], data[root][1:] != data[root][:-1]])) if roots.shape[0] > 0 else np.zeros(0, dtype=np.int64)
+        return cls(data, np.concatenate([starts, [roots.shape[0]]]), root, snap)
+
+    def to_dataframe(self, columns=None):
+        columns = list(self.columns) if columns is None else columns
+        return pd.DataFrame({name: self.columns[name] for name in columns}, copy=False)
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __setitem__(self, name, values):
+        values = np.asarray(values)
+        if values.shape[0] != self.n_points:
+            raise ValueError('column '+str(name)+' has '+str(values.shape[0])+' rows, expected '+str(self.n_points))
+        self.columns[name] = values
+
+    @property
+    def n_points(self):
+        return int(self.offsets[-1])
+
+    @property
+    def starts(self):
+        return self.offsets[:-1]
+
+    @property
+    def ends(self):
+        return self.offsets[1:]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def roots(self):
+        '''
+        Root id of every branch.
+        '''
+        return self.columns[self.root][self.starts]
+
+    def branch_index(self):
+        '''
+        Branch number of every row.
+        '''
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def broadcast(self, values):
+        '''
+        Per-branch values repeated onto every row of the branch.
+        '''
+        return np.repeat(np.asarray(values), self.lengths, axis=0)
+
+    def _values(self, name):
+        return self.columns[name] if isinstance(name, str) else np.asarray(name)
+
+    # per-branch reductions ------------------------------------------------------------
+
+    def reduce(self, name, ufunc=np.add):
+        '''
+        ufunc.reduceat of a column (or row array) over every branch.
+        '''
+        return ufunc.reduceat(self._values(name), self.starts, axis=0)
+
+    def sum(self, name):
+        return self.reduce(name, np.add)
+
+    def max(self, name):
+        return self.reduce(name, np.maximum)
+
+    def min(self, name):
+        return self.reduce(name, np.minimum)
+
+    def mean(self, name):
+        return self.sum(name) / self.lengths
+
+    def nansum(self, name):
+        return self.reduce(np.nan_to_num(self._values(name), nan=0., posinf=0., neginf=0.), np.add)
+
+    def first(self, name):
+        return self._values(name)[self.starts]
+
+    def last(self, name):
+        return self._values(name)[self.ends - 1]
+
+    def first_where(self, mask):
+        '''
+        Row of the first True in mask on every branch, -1 where there is none.
+        '''
+        rows = np.flatnonzero(mask)
+        out = np.full(len(self), -1, dtype=np.int64)
+        branches, first = np.unique(self.branch_index()[rows], return_index=True)
+        out[branches] = rows[first]
+        return out
+
+    def last_where(self, mask):
+        '''
+        Row of the last True in mask on every branch, -1 where there is none.
+        '''
+        rows = np.flatnonzero(mask)[::-1]
+        out = np.full(len(self), -1, dtype=np.int64)
+        branches, last = np.unique(self.branch_index()[rows], return_index=True)
+        out[branches] = rows[last]
+        return out
+
+    def argmax(self, name):
+        '''
+        Row of the (first) maximum of every branch. nan only wins on an all-nan branch.
+        '''
+        values = np.where(np.isnan(self._values(name)), -np.inf, self._values(name))
+        return self.first_where(values == self.broadcast(np.maximum.reduceat(values, self.starts)))
+
+    def argmin(self, name):
+        values = np.where(np.isnan(self._values(name)), np.inf, self._values(name))
+        return self.first_where(values == self.broadcast(np.minimum.reduceat(values, self.starts)))
+
+    # per-branch running quantities ----------------------------------------------------
+
+    def cumsum(self, name):
+        '''
+        Cumulative sum along every branch (forward in time), the same as np.cumsum of each
+        branch on its own: a nan or inf stays in its branch and small values are not lost
+        against the running total of earlier branches.
+        '''
+        values = self._values(name)
+        if self.n_points == 0:
+            return np.cumsum(values, axis=0)
+        branch = self.branch_index()
+        position = np.arange(self.n_points) - self.broadcast(self.starts)
+        grid = np.zeros((len(self), np.max(self.lengths)) + values.shape[1:], dtype=values.dtype)
+        grid[branch, position] = values
+        return np.cumsum(grid, axis=1)[branch, position]
+
+    def diff(self, name):
+        '''
+        Change since the previous point of the branch (nan at the first point).
+        '''
+        values = self._values(name).astype(float)
+        out = np.empty_like(values)
+        out[1:] = values[1:] - values[:-1]
+        out[self.starts] = np.nan
+        return out
+
+    def half_point(self, name):
+        '''
+        Row where the cumulative sum of every branch first exceeds half of its total, e.g.
+        the energy injection midpoint. -1 for branches with no positive total.
+        '''
+        cumulative = self.cumsum(name)
+        total = self.broadcast(self.last(cumulative))
+        return self.first_where((cumulative > total / 2) & (total > 0))
+
+    # time alignment -------------------------------------------------------------------
+
+    def at_snapshot(self, name, snapnum, fill=np.nan):
+        '''
+        Value of every branch at snapnum (fill where the branch has no point there), e.g. the
+        z=0 value.
+        '''
+        return self.at_rows(name, self.first_where(self.columns[self.snap] == snapnum), fill)
+
+    def at_rows(self, name, rows, fill=np.nan):
+        '''
+        Value at one row per branch (e.g. from argmax or first_where), fill where it is -1.
+        '''
+        values = self._values(name)
+        out = np.full(len(self), fill, dtype=np.result_type(values.dtype, np.asarray(fill).dtype))
+        found = rows >= 0
+        out[found] = values[rows[found]]
+        return out
+
+    def relative_to(self, name, rows):
+        '''
+        Column minus its value at one row per branch (e.g. time since the peak), nan for
+        branches where the row is -1.
+        '''
+        return self._values(name) - self.broadcast(self.at_rows(name, rows))
+
+    def to_grid(self, name, snapnums=None, fill=np.nan):
+        '''
+        (n_branches, n_snapnums) array of a column on a common snapshot grid, fill where a
+        branch has no point.
+        '''
+        snaps = self.columns[self.snap]
+        snapnums = np.unique(snaps) if snapnums is None else np.asarray(snapnums)
+        values = self._values(name)
+        grid = np.full((len(self), snapnums.shape[0]), fill, dtype=np.result_type(values.dtype, np.asarray(fill).dtype))
+        column = np.searchsorted(snapnums, snaps)
+        valid = (column < snapnums.shape[0]) & (snapnums[np.minimum(column, snapnums.shape[0] - 1)] == snaps)
+        grid[self.branch_index()[valid], column[valid]] = values[valid]
+        return grid
+
+    # subsets --------------------------------------------------------------------------
+
+    def select(self, branches):
+        '''
+        BranchSet of a subset of branches (boolean mask or branch numbers).
+        '''
+        branches = np.flatnonzero(branches) if np.asarray(branches).dtype == bool else np.asarray(branches)
+        lengths = self.lengths[branches]
+        rows = np.repeat(self.starts[branches] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) + np.arange(np.sum(lengths))
+        columns = {name: values[rows] for name, values in self.columns.items()}
+        return BranchSet(columns, np.concatenate([[0], np.cumsum(lengths)]), self.root, self.snap)
+
+    def select_roots(self, roots):
+        '''
+        BranchSet of the branches whose root is in roots.
+        '''
+        return self.select(np.isin(self.roots, roots))
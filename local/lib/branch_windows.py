@@ -0,0 +1,146 @@
+'''
+branch_windows - rolling lookback-time windows along main branches (see branch_set), e.g.
+kinetic energy injected in the last Gyr or the peak L_bol over the preceding 2 Gyr, at
+every branch point of every branch at once.
+
+The window of a point at time t holds the points of the same branch with t - window < t_i
+<= t. Snapshots are not evenly spaced, so windows are found in time rather than counted
+in rows: one searchsorted over (branch, time) gives the first row of every window. Sums
+and means are then differences of a cumulative sum taken along each branch, maxima come from a sparse table of
+power-of-two block maxima, and changes of cumulative quantities (BH_CumEgyInjection_RM)
+are interpolated in time at the window start.
+
+    branches = branch_set.BranchSet.from_dataframe(tree_tab)
+    last_Gyr = branch_windows.TimeWindow(branches, 1.)
+    tree_tab = branches.to_dataframe()
+    tree_tab['E_RM_1Gyr'] = last_Gyr.change('BH_CumEgyInjection_RM')
+    tree_tab['Lbol_max_2Gyr'] = branch_windows.TimeWindow(branches, 2.).max('log10_Lbh_bol')
+'''
+
+import numpy as np
+
+
+class TimeWindow(object):
+    '''
+    Parameters
+    ----------
+    branches : branch_set.BranchSet
+    window : float
+        Window length (Gyr).
+    time : str or ndarray
+        Lookback time (Gyr) column of branches, or an array of it per row.
+    partial : bool
+        If False, points whose window reaches back past the first point of their branch
+        get nan rather than a value over the shorter span.
+    '''
+    def __init__(self, branches, window, time='branch_lookback_time', partial=True):
+        self.branches = branches
+        self.window = float(window)
+        self.partial = partial
+        # forward (cosmic) time, increasing along each branch.
+        self.t = -np.asarray(branches._values(time), dtype=float)
+        n = self.t.shape[0]
+        self.rows = np.arange(n)
+        self.branch_start = branches.broadcast(branches.starts)
+        if n == 0:
+            self.start = self.rows.copy()
+        else:
+            t0 = np.min(self.t)
+            span = np.max(self.t) - t0 + self.window + 1.
+            offset = branches.branch_index() * span
+            self.start = np.searchsorted(offset + (self.t - t0), offset + (self.t - self.window - t0), side='right')
+        # the window starts before the branch does.
+        self.truncated = self.t[self.branch_start] > self.t - self.window
+        self.complete = ~self.truncated | (self.t[self.branch_start] == self.t - self.window)
+
+    def _finish(self, values):
+        if not self.partial:
+            values = np.where(self.complete, values, np.nan)
+        return values
+
+    def _total(self, values):
+        '''
+        Sum of values over every window, from prefix sums which restart at every branch
+        (so a large or infinite value only reaches the windows of its own branch).
+        '''
+        total = self.branches.cumsum(values)
+        inside = self.start > self.branch_start
+        before = np.where(inside, total[np.maximum(self.start - 1, 0)], 0)
+        return total - before
+
+    def count(self, name=None):
+        '''
+        Number of points (with non-nan values of name, if given) in every window.
+        '''
+        if name is None:
+            return self._finish((self.rows - self.start + 1).astype(float))
+        finite = ~np.isnan(np.asarray(self.branches._values(name), dtype=float))
+        return self._finish(self._total(finite.astype(np.int64)).astype(float))
+
+    def sum(self, name):
+        '''
+        Sum over the points in every window (nan values are skipped).
+        '''
+        values = np.nan_to_num(np.asarray(self.branches._values(name), dtype=float), nan=0.)
+        return self._finish(self._total(values))
+
+    def mean(self, name):
+        '''
+        Mean over the points in every window (nan values are skipped).
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum(name) / self.count(name)
+
+    def max(self, name):
+        '''
+        Maximum over the points in every window (nan values are skipped).
+        '''
+        values = np.asarray(self.branches._values(name), dtype=float)
+        table = _block_maxima(np.where(np.isnan(values), -np.inf, values))
+        length = self.rows - self.start + 1
+        level = np.floor(np.log2(length)).astype(np.int64)
+        out = np.maximum(table[level, self.start], table[level, self.rows - (1 << level) + 1])
+        finite = np.concatenate([[0], np.cumsum(~np.isnan(values))])
+        return self._finish(np.where(finite[self.rows + 1] > finite[self.start], out, np.nan))
+
+    def change(self, name):
+        '''
+        Increase of a cumulative quantity over every window, with its value at the window
+        start interpolated linearly in time between the snapshots either side.
+        '''
+        values = np.asarray(self.branches._values(name), dtype=float)
+        before = np.maximum(self.start - 1, self.branch_start)
+        t_start = self.t - self.window
+        dt = self.t[self.start] - self.t[before]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = np.where(dt > 0, (t_start - self.t[before]) / dt, 0.)
+        at_start = values[before] + np.clip(fraction, 0., 1.) * (values[self.start] - values[before])
+        return self._finish(values - at_start)
+
+    def duration(self):
+        '''
+        Time covered by every window (shorter than window where it is truncated).
+        '''
+        return self.t - np.maximum(self.t - self.window, self.t[self.branch_start])
+
+    def rate(self, name):
+        '''
+        Mean rate of increase (per Gyr) of a cumulative quantity over every window.
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.change(name) / self.duration()
+
+
+def _block_maxima(values):
+    '''
+    Sparse table: row k holds the maximum of values[i:i+2**k] (clipped at the end).
+    '''
+    n = values.shape[0]
+    levels = max(int(np.floor(np.log2(n))) + 1, 1) if n > 0 else 1
+    table = np.empty((levels, n))
+    table[0] = values
+    for k in range(1, levels):
+        shift = 1 << (k - 1)
+        table[k] = table[k - 1]
+        table[k, :n - shift] = np.maximum(table[k - 1, :n - shift], table[k - 1, shift:])
+    return table
@@ -0,0 +1,192 @@
+'''
+control_sample - nearest-neighbour control samples, e.g. the aligned galaxies closest to
+each misaligned one in (stellar mass, SFR, halo mass, BH mass), so that a comparison of
+their histories is not just a mass trend.
+
+Features are log10 scaled (non-positive values are set to the smallest positive value of
+the feature) and divided by their standard deviation over the controls and treatments
+together. The controls go in a scipy cKDTree, built once and reused for every match, so
+re-matching at every snapshot or for every bootstrap draw of the treatments is one tree
+query each. Matching without replacement is greedy: at every neighbour rank each open
+treatment bids for its next nearest control, and a contested control goes to the closest
+bidder. Controls with a non-finite feature are left out of the tree, and treatments with
+one are left unmatched.
+
+    matched = control_sample.match_controls(mis_z0, align_z0, n_match=1, replace=False, caliper=0.2)
+    control_tab = tree_tab[tree_tab.root_subfind.isin(matched.control_id.values)]
+'''
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+FEATURES = ['stel_mass', 'SFR', 'halo_mass', 'BH_mass']
+
+
+def scale_features(treatment, control, log=True):
+    '''
+    Scaled (n, n_features) arrays for the treatments and the controls.
+    '''
+    treatment = np.asarray(treatment, dtype=float)
+    control = np.asarray(control, dtype=float)
+    both = np.concatenate([treatment, control])
+    if log:
+        positive = np.where(both > 0, both, np.inf)
+        floor = np.min(positive, axis=0)
+        floor = np.where(np.isfinite(floor), floor, 1.)
+        treatment = np.log10(np.maximum(treatment, floor))
+        control = np.log10(np.maximum(control, floor))
+        both = np.log10(np.maximum(both, floor))
+    with np.errstate(invalid='ignore'):
+        scale = np.nanstd(np.where(np.isfinite(both), both, np.nan), axis=0)
+    scale = np.where(scale > 0, scale, 1.)
+    return treatment / scale, control / scale
+
+
+class ControlMatcher(object):
+    '''
+    Parameters
+    ----------
+    control : ndarray (n_control, n_features)
+        Scaled features of the controls (see scale_features).
+    control_ids : ndarray (n_control)
+    '''
+    def __init__(self, control, control_ids):
+        self.control = np.asarray(control, dtype=float)
+        self.control_ids = np.asarray(control_ids)
+        # rows of control in the tree (cKDTree needs finite data).
+        self.rows = np.flatnonzero(np.all(np.isfinite(self.control), axis=1))
+        self.tree = cKDTree(self.control[self.rows])
+
+    def __len__(self):
+        return self.rows.shape[0]
+
+    def query(self, treatment, k):
+        k = min(k, len(self))
+        distance, index = self.tree.query(treatment, k=k)
+        return distance.reshape(len(treatment), k), index.reshape(len(treatment), k)
+
+    def match(self, treatment, n_match=1, replace=True, caliper=None):
+        '''
+        n_match controls for every treatment.
+
+        Returns
+        -------
+        index, distance : ndarray (n_treatment, n_match)
+            Row of the matched control (-1 if none is left within the caliper, or the
+            treatment has a non-finite feature) and its scaled distance.
+        '''
+        treatment = np.asarray(treatment, dtype=float)
+        index = np.full((len(treatment), n_match), -1)
+        distance = np.full((len(treatment), n_match), np.inf)
+        finite = np.flatnonzero(np.all(np.isfinite(treatment), axis=1))
+        if finite.shape[0] > 0 and len(self) > 0:
+            found, found_distance = self._match(treatment[finite], n_match, replace, caliper)
+            index[finite] = np.where(found >= 0, self.rows[found], -1)
+            distance[finite] = found_distance
+        return index, distance
+
+    def _match(self, treatment, n_match, replace, caliper):
+        '''
+        match for finite treatments, with rows of the tree.
+        '''
+        caliper = np.inf if caliper is None else caliper
+        if replace:
+            distance, index = self.query(treatment, n_match)
+            missing = distance > caliper
+            if index.shape[1] < n_match:
+                pad = n_match - index.shape[1]
+                index = np.concatenate([index, np.full((len(treatment), pad), -1)], axis=1)
+                distance = np.concatenate([distance, np.full((len(treatment), pad), np.inf)], axis=1)
+                missing = np.concatenate([missing, np.ones((len(treatment), pad), dtype=bool)], axis=1)
+            return np.where(missing, -1, index), np.where(missing, np.inf, distance)
+        index = np.full((len(treatment), n_match), -1)
+        distance = np.full((len(treatment), n_match), np.inf)
+        used = np.zeros(len(self), dtype=bool)
+        for j in range(n_match):
+            index[:, j], distance[:, j] = self._greedy(treatment, used, caliper)
+        return index, distance
+
+    def _greedy(self, treatment, used, caliper):
+        n = len(treatment)
+        index = np.full(n, -1)
+        distance = np.full(n, np.inf)
+        open_ = np.arange(n)
+        k = 8
+        while open_.shape[0] > 0 and not np.all(used):
+            dist, nn = self.query(treatment[open_], k)
+            n_nn = nn.shape[1]
+            rank = np.zeros(open_.shape[0], dtype=np.int64)
+            active = np.ones(open_.shape[0], dtype=bool)
+            while np.any(active):
+                # move every open treatment on to its nearest unused candidate.
+                taken = active.copy()
+                while np.any(taken):
+                    taken &= rank < n_nn
+                    taken[taken] = used[nn[taken, np.minimum(rank[taken], n_nn - 1)]]
+                    rank[taken] += 1
+                active &= rank < n_nn
+                rows = np.flatnonzero(active)
+                # candidates are sorted by distance, so past the caliper there is no match.
+                too_far = dist[rows, rank[rows]] > caliper
+                active[rows[too_far]] = False
+                rows = rows[~too_far]
+                if rows.shape[0] == 0:
+                    break
+                bids = nn[rows, rank[rows]]
+                order = np.lexsort((dist[rows, rank[rows]], bids))
+                _, first = np.unique(bids[order], return_index=True)
+                won = rows[order[first]]
+                index[open_[won]] = nn[won, rank[won]]
+                distance[open_[won]] = dist[won, rank[won]]
+                used[nn[won, rank[won]]] = True
+                active[won] = False
+            # treatments which ran out of candidates (rather than caliper) look further.
+            retry = (rank >= n_nn) & (index[open_] < 0)
+            if n_nn >= len(self) or not np.any(retry):
+                break
+            open_ = open_[retry]
+            k *= 4
+        return index, distance
+
+
+def match_controls(treatment_tab, control_tab, features=FEATURES, id='subfind_id', n_match=1, replace=True,
+                   caliper=None, log=True):
+    '''
+    Matches every row of treatment_tab to the nearest n_match rows of control_tab.
+
+    Returns
+    -------
+    DataFrame with treatment_id, control_id and (scaled) distance, one row per matched pair.
+    '''
+    treatment, control = scale_features(treatment_tab[features].values, control_tab[features].values, log=log)
+    matcher = ControlMatcher(control, control_tab[id].values)
+    index, distance = matcher.match(treatment, n_match=n_match, replace=replace, caliper=caliper)
+    found = index >= 0
+    return pd.DataFrame({'treatment_id':np.repeat(treatment_tab[id].values, n_match)[found.ravel()],
+                         'control_id':matcher.control_ids[index[found]], 'distance':distance[found]})
+
+
+def match_at_snapshots(tree_tab, treatment_roots, control_roots, features=FEATURES, n_match=1, replace=True,
+                       caliper=None, log=True):
+    '''
+    Matches the branches of treatment_roots to those of control_roots separately at every
+    snapshot of tree_tab, on the properties at that snapshot.
+
+    Returns
+    -------
+    DataFrame with branch_snapnum, treatment_id, control_id (root subfinds) and distance.
+    '''
+    out = []
+    for snap, snap_tab in tree_tab.groupby('branch_snapnum'):
+        treatment = snap_tab[snap_tab.root_subfind.isin(treatment_roots)]
+        control = snap_tab[snap_tab.root_subfind.isin(control_roots)]
+        if treatment.shape[0] == 0 or control.shape[0] == 0:
+            continue
+        matched = match_controls(treatment, control, features=features, id='root_subfind', n_match=n_match,
+                                 replace=replace, caliper=caliper, log=log)
+        matched.insert(0, 'branch_snapnum', snap)
+        out.append(matched)
+    if len(out) == 0:
+        return pd.DataFrame({'branch_snapnum':[], 'treatment_id':[], 'control_id':[], 'distance':[]})
+    return pd.concat(out, ignore_index=True)
@@ -0,0 +1,124 @@
+'''
+correlation_scan - correlation of the z=0 PA offset with every numeric column of the
+branch catalogues (BH, gas history, ...) at every snapshot, with bootstrap errors, as
+(snapshot x property) tables.
+
+The catalogues are put on one (snapshot, root, property) grid. At every snapshot all the
+columns are ranked together (scipy.stats.rankdata along axis 0) and the correlations of
+all columns come from masked sums, so a column with missing values only loses those
+galaxies (the PA offsets are re-ranked over the galaxies left in every column). Bootstrap
+replicates resample galaxies as weight vectors, one matrix product for all columns; the
+spearman errors use the ranks of the full sample.
+
+    scan = correlation_scan.scan(tng100_pa, [tree_tab, flows_tab])
+    scan['spearman'].loc[80].sort_values()
+'''
+
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+# identifying columns of the branch catalogues, never scanned.
+ID_COLUMNS = ['root_subfind', 'root_snap', 'branch_subfind', 'branch_snapnum', 'prog_snapnum', 'progenitor']
+
+
+def catalogue_grid(roots, catalogues, exclude=ID_COLUMNS):
+    '''
+    Numeric columns of the catalogues on a (snapshot, root, property) grid, nan where a
+    root has no point.
+
+    Returns
+    -------
+    snapnums : ndarray (n_snap)
+    columns : list (n_prop)
+    grid : ndarray (n_snap, n_roots, n_prop)
+    '''
+    roots = np.asarray(roots)
+    order = np.argsort(roots)
+    snapnums = np.unique(np.concatenate([tab.branch_snapnum.values for tab in catalogues]))
+    columns, blocks = [], []
+    for tab in catalogues:
+        names = [c for c in tab.columns if c not in exclude and c not in columns and np.issubdtype(tab[c].dtype, np.number)]
+        block = np.full((snapnums.shape[0], roots.shape[0], len(names)), np.nan)
+        pos = np.minimum(np.searchsorted(roots[order], tab.root_subfind.values), roots.shape[0] - 1)
+        found = roots[order][pos] == tab.root_subfind.values
+        snap_index = np.searchsorted(snapnums, tab.branch_snapnum.values[found])
+        block[snap_index, order[pos[found]]] = tab[names].values[found].astype(float)
+        columns += names
+        blocks.append(block)
+    return snapnums, columns, np.concatenate(blocks, axis=2)
+
+
+def _masked_ranks(y, mask):
+    '''
+    Ranks (ties averaged) of y among the rows where mask is True, separately for every
+    column of mask.
+    '''
+    order = np.argsort(y, kind='stable')
+    counted = np.cumsum(mask[order], axis=0)
+    # groups of tied y.
+    starts = np.flatnonzero(np.concatenate([[True], y[order][1:] != y[order][:-1]]))
+    ends = np.concatenate([starts[1:], [y.shape[0]]]) - 1
+    before = np.concatenate([np.zeros((1, mask.shape[1])), counted[ends[:-1]]])
+    rank = np.repeat((before + 1 + counted[ends]) / 2, np.diff(np.concatenate([starts, [y.shape[0]]])), axis=0)
+    out = np.empty(mask.shape)
+    out[order] = rank
+    return out
+
+
+def _correlation(x, y, mask, weights):
+    '''
+    Pearson correlation of every column of x with the same column of y over the rows in
+    mask, for every row of weights (n_rep, n_rows). Returns (n_rep, n_prop).
+    '''
+    x = np.where(mask, x, 0.)
+    y = np.where(mask, y, 0.)
+    m = mask.astype(float)
+    n = weights @ m
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = (weights @ x) / n
+        mean_y = (weights @ y) / n
+        cov = (weights @ (x*y)) / n - mean_x*mean_y
+        var_x = (weights @ (x*x)) / n - mean_x**2
+        var_y = (weights @ (y*y)) / n - mean_y**2
+        return cov / np.sqrt(var_x * var_y)
+
+
+def scan(sample, catalogues, target='pa_offset', id='subfind_id', n_boot=200, min_count=10, seed=None):
+    '''
+    Spearman and pearson correlations of target (one value per galaxy of sample, e.g. the
+    z=0 pa_offset) with every numeric column of the catalogues at every snapshot.
+
+    Returns
+    -------
+    dict of DataFrames (index snapshot, columns property): 'spearman', 'spearman_err',
+    'pearson', 'pearson_err' (bootstrap standard deviations) and 'n'. Entries with fewer
+    than min_count galaxies are nan.
+    '''
+    sample = sample[np.isfinite(sample[target].values)]
+    roots = sample[id].values
+    y = sample[target].values.astype(float)
+    snapnums, columns, grid = catalogue_grid(roots, catalogues)
+    rng = np.random.default_rng(seed)
+    draws = rng.integers(0, roots.shape[0], size=(n_boot, roots.shape[0])) + (np.arange(n_boot) * roots.shape[0])[:, None]
+    weights = np.bincount(draws.ravel(), minlength=n_boot*roots.shape[0]).reshape(n_boot, -1).astype(float)
+    weights = np.concatenate([np.ones((1, roots.shape[0])), weights])
+
+    out = {name: np.full((snapnums.shape[0], len(columns)), np.nan) for name in ['spearman', 'spearman_err', 'pearson', 'pearson_err', 'n']}
+    for i in range(snapnums.shape[0]):
+        x = grid[i]
+        mask = np.isfinite(x)
+        n = np.sum(mask, axis=0)
+        ok = n >= min_count
+        y_col = np.broadcast_to(y[:, None], x.shape)
+        pearson = _correlation(x, y_col, mask, weights)
+        # nan/inf rank after every finite value, and are masked.
+        x_rank = scipy.stats.rankdata(np.where(mask, x, np.inf), axis=0)
+        spearman = _correlation(x_rank, _masked_ranks(y, mask), mask, weights)
+        out['n'][i] = n
+        out['pearson'][i, ok] = pearson[0, ok]
+        out['spearman'][i, ok] = spearman[0, ok]
+        if n_boot > 1:
+            out['pearson_err'][i, ok] = np.nanstd(pearson[1:, ok], axis=0)
+            out['spearman_err'][i, ok] = np.nanstd(spearman[1:, ok], axis=0)
+    return {name: pd.DataFrame(values, index=pd.Index(snapnums, name='branch_snapnum'), columns=columns) for name, values in out.items()}
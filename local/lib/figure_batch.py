@@ -0,0 +1,212 @@
+'''
+figure_batch - builds a set of population evolution figures from declarative specs.
+
+Every curve of every figure is a selection (catalogue, z=0 sample, PA split, mass split,
+property, cut on the property). The mean and standard error of every distinct selection
+are computed once, in the parent process, however many figures or panels use it; each
+figure is then drawn in its own process (Agg backend) from those few arrays and saved in
+every requested format.
+
+A figure spec is a dict:
+
+    {'name': 'LM_BH_residual_evo_Mstel10_2_twocol', 'shape': (2, 2), 'figsize': (10, 7),
+     'sharex': 'all', 'sharey': 'row', 'formats': ['pdf', 'png'],
+     'panels': {(0, 0): [curve, ...], ...},
+     'axes': {(0, 0): {'title': 'Star forming at $z=0$', 'ylabel': ..., 'xlim': [0, 7.85],
+                       'invert_x': True, 'ylim': ..., 'yscale': 'log', 'hline': 0,
+                       'legend': {'frameon': False, 'fontsize': 16}}, ...},
+     'subplots_adjust': {'wspace': 0, 'hspace': 0}}
+
+and a curve spec:
+
+    {'catalogue': 'mass', 'sample': 'SF', 'property': 'BH_mass', 'condition': 0,
+     'pa': 'misaligned', 'mass': ('stel_mass', 'low', 10**10.2),
+     'residual': {'pa': 'aligned'}, 'peak': True,
+     'label': ..., 'color': 'darkseagreen', 'linestyle': 'dashed', 'alpha': 0.2}
+
+pa is one of PA_SPLITS. mass is (column, 'high' | 'low' | 'high_percentile' |
+'low_percentile', threshold) on the z=0 sample (high is > threshold, low is <=, as in
+split_population) or None. residual plots the curve minus the same selection with those
+keys replaced, with the standard error of the curve, as plot_property_residual does.
+'''
+
+import os
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# (lowest included, highest excluded) pa_offset of every PA split.
+PA_SPLITS = {'all': (None, None), 'aligned': (None, 30), 'misaligned': (30, None), 'counter': (150, None)}
+
+SELECTION_KEYS = ['catalogue', 'sample', 'property', 'condition', 'pa', 'mass', 'time']
+
+
+def selection(curve):
+    '''
+    Hashable key of the data a curve shows.
+    '''
+    defaults = {'condition': None, 'pa': 'all', 'mass': None, 'time': 'branch_lookback_time'}
+    key = []
+    for name in SELECTION_KEYS:
+        value = curve.get(name, defaults.get(name))
+        key.append(tuple(value) if isinstance(value, list) else value)
+    return tuple(key)
+
+
+def reference(curve):
+    '''
+    Selection the residual of a curve is taken against, or None.
+    '''
+    if curve.get('residual') is None:
+        return None
+    return selection(dict(curve, **curve['residual']))
+
+
+def figure_selections(spec):
+    keys = set()
+    for curves in spec['panels'].values():
+        for curve in curves:
+            keys.add(selection(curve))
+            if reference(curve) is not None:
+                keys.add(reference(curve))
+    return keys
+
+
+def select_roots(sample, pa='all', mass=None):
+    '''
+    subfind_ids of the z=0 sample in a PA split and a mass split.
+    '''
+    keep = np.ones(sample.shape[0], dtype=bool)
+    lower, upper = PA_SPLITS[pa]
+    if lower is not None:
+        keep &= sample.pa_offset.values >= lower
+    if upper is not None:
+        keep &= sample.pa_offset.values < upper
+    if mass is not None:
+        column, side, threshold = mass
+        values = sample[column].values
+        if side.endswith('_percentile'):
+            threshold = np.percentile(values, threshold)
+        keep &= (values > threshold) if side.startswith('high') else (values <= threshold)
+    return sample.subfind_id.values[keep]
+
+
+def evolution_stats(tab, roots, property, condition=None, time='branch_lookback_time'):
+    '''
+    Mean and standard error of a property at every time over the branches of roots (the
+    points of plot_property_evolution).
+    '''
+    keep = np.array(tab.root_subfind.isin(roots).values)
+    values = tab[property].values
+    if condition is not None:
+        keep &= values > condition
+    ts, index = np.unique(tab[time].values[keep], return_inverse=True)
+    values = values[keep].astype(float)
+    n = np.bincount(index, minlength=ts.shape[0]).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(index, weights=values, minlength=ts.shape[0]) / n
+        var = np.bincount(index, weights=(values - mean[index])**2, minlength=ts.shape[0]) / (n - 1)
+        sem = np.sqrt(var / n)
+    return ts, mean, sem
+
+
+def compute_stats(specs, catalogues, samples):
+    '''
+    Statistics of every selection used by the specs, each computed once.
+
+    catalogues and samples are dicts of DataFrames (branch catalogues with
+    branch_lookback_time, and z=0 samples such as QU, GV, SF).
+    '''
+    keys = set()
+    for spec in specs:
+        keys |= figure_selections(spec)
+    roots = {}
+    stats = {}
+    for key in sorted(keys, key=repr):
+        catalogue, sample, property, condition, pa, mass, time = key
+        if (sample, pa, mass) not in roots:
+            roots[(sample, pa, mass)] = select_roots(samples[sample], pa, mass)
+        stats[key] = evolution_stats(catalogues[catalogue], roots[(sample, pa, mass)], property, condition, time)
+    return stats
+
+
+def _init_worker(rc):
+    import matplotlib
+    matplotlib.use('Agg')
+    matplotlib.rcParams.update(rc)
+
+
+def _draw_curve(ax, curve, stats):
+    ts, mean, sem = stats[selection(curve)]
+    if reference(curve) is not None:
+        ref_ts, ref_mean, _ = stats[reference(curve)]
+        ts, index, ref_index = np.intersect1d(ts, ref_ts, return_indices=True)
+        mean, sem = mean[index] - ref_mean[ref_index], sem[index]
+    color = curve.get('color', 'k')
+    ax.plot(ts, mean, linestyle=curve.get('linestyle', 'solid'), color=color, label=curve.get('label'), linewidth=3)
+    ax.fill_between(ts, mean - sem, mean + sem, alpha=curve.get('alpha', 0.3), color=color)
+    if curve.get('peak', False):
+        # midpoint of the cumulative curve, as in plot_property_residual.
+        past = np.flatnonzero(np.cumsum(mean) > np.sum(mean) / 2)
+        if past.shape[0] > 0:
+            ax.axvline(ts[past[0]], color=color, linewidth=5, alpha=0.5)
+
+
+def _style_axis(ax, style):
+    if 'hline' in style:
+        ax.axhline(style['hline'], linestyle='dashed', color='k', alpha=0.3, linewidth=3)
+    for name in ['title', 'xlabel', 'ylabel']:
+        if name in style:
+            getattr(ax, 'set_'+name)(style[name], fontsize=style.get('fontsize'))
+    for name in ['xlim', 'ylim', 'xscale', 'yscale']:
+        if name in style:
+            getattr(ax, 'set_'+name)(style[name])
+    if style.get('invert_x', False):
+        ax.invert_xaxis()
+    if 'legend' in style:
+        ax.legend(**style['legend'])
+
+
+def render_figure(spec, stats, out_dir):
+    '''
+    Draws and saves one figure from the statistics of its curves. Returns the files written.
+    '''
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(*spec.get('shape', (1, 1)), figsize=spec.get('figsize'), squeeze=False,
+                           sharex=spec.get('sharex', False), sharey=spec.get('sharey', False))
+    for position, curves in spec['panels'].items():
+        position = position if isinstance(position, tuple) else np.unravel_index(position, ax.shape)
+        for curve in curves:
+            _draw_curve(ax[position], curve, stats)
+    for position, style in spec.get('axes', {}).items():
+        position = position if isinstance(position, tuple) else np.unravel_index(position, ax.shape)
+        _style_axis(ax[position], style)
+    if 'subplots_adjust' in spec:
+        fig.subplots_adjust(**spec['subplots_adjust'])
+    paths = []
+    for format in spec.get('formats', ['pdf']):
+        paths.append(os.path.join(out_dir, spec['name']+'.'+format))
+        fig.savefig(paths[-1], format=format, bbox_inches='tight', dpi=spec.get('dpi', 200))
+    plt.close(fig)
+    return paths
+
+
+def build_figures(specs, catalogues, samples, out_dir, n_workers=4, rc={}, stats=None):
+    '''
+    Computes the statistics shared by the specs and renders every figure in a process pool.
+
+    Returns
+    -------
+    paths : dict
+        Files written for every figure name.
+    '''
+    stats = compute_stats(specs, catalogues, samples) if stats is None else stats
+    os.makedirs(out_dir, exist_ok=True)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max(1, min(n_workers, len(specs))), mp_context=context,
+                             initializer=_init_worker, initargs=(rc,)) as pool:
+        futures = {}
+        for spec in specs:
+            needed = {key: stats[key] for key in figure_selections(spec)}
+            futures[spec['name']] = pool.submit(render_figure, spec, needed, out_dir)
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,197 @@
+'''
+figure_build - incremental rebuilds of a figure_batch figure set: only figures whose
+inputs changed are re-rendered, and the statistics of unchanged selections are read back
+from a cache rather than recomputed.
+
+Every selection (curve) depends on the catalogue columns it reads (root_subfind, time and
+the property), the z=0 sample columns of its split (subfind_id, pa_offset, the mass
+column) and its thresholds; its hash combines the content hashes of those columns with
+the selection itself and the code computing statistics (figure_batch.select_roots,
+evolution_stats and the PA splits), so cached statistics go stale with it. A figure depends on the hashes of its selections, its spec, the
+rendering code (figure_batch.py) and the rcParams. A new column in a catalogue, or a
+changed value in a column no figure reads, therefore rebuilds nothing.
+
+The manifest (cache_dir/manifest.json) keeps the hash and the dependencies of every
+figure built; statistics are kept as cache_dir/stats/<hash>.npz.
+
+    paths = figure_build.build(specs, catalogues, samples, out_dir)
+'''
+
+import os
+import json
+import inspect
+import hashlib
+import numpy as np
+import figure_batch
+
+
+def column_hash(values):
+    '''
+    Content hash of one column.
+    '''
+    values = np.asarray(values)
+    digest = hashlib.sha1(str(values.dtype).encode())
+    if values.dtype == object:
+        digest.update(repr(values.tolist()).encode())
+    else:
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+def _hash(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+class InputHashes(object):
+    '''
+    Hashes of the columns and selections of one build, each column hashed at most once.
+    '''
+    def __init__(self, catalogues, samples, code=None):
+        self.catalogues = catalogues
+        self.samples = samples
+        self.code = stats_code_hash() if code is None else code
+        self._columns = {}
+
+    def column(self, kind, name, column):
+        if (kind, name, column) not in self._columns:
+            tab = self.catalogues[name] if kind == 'catalogue' else self.samples[name]
+            self._columns[(kind, name, column)] = column_hash(tab[column].values)
+        return self._columns[(kind, name, column)]
+
+    def dependencies(self, key):
+        '''
+        Catalogue and sample columns a selection reads, with their hashes.
+        '''
+        catalogue, sample, property, condition, pa, mass, time = key
+        columns = {'catalogue:'+catalogue+':'+c: self.column('catalogue', catalogue, c) for c in ['root_subfind', time, property]}
+        sample_columns = ['subfind_id'] + (['pa_offset'] if pa != 'all' else []) + ([mass[0]] if mass is not None else [])
+        columns.update({'sample:'+sample+':'+c: self.column('sample', sample, c) for c in sample_columns})
+        return columns
+
+    def selection(self, key):
+        return _hash(repr(key), self.dependencies(key), self.code)
+
+
+def stats_code_hash():
+    '''
+    Hash of the code computing the statistics of a selection.
+    '''
+    sources = [inspect.getsource(figure_batch.select_roots), inspect.getsource(figure_batch.evolution_stats)]
+    return _hash(sources, repr(figure_batch.PA_SPLITS))
+
+
+def code_hash():
+    '''
+    Hash of the rendering code.
+    '''
+    with open(os.path.splitext(figure_batch.__file__)[0]+'.py', 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def figure_hash(spec, selection_hashes, rc, code):
+    return _hash(repr(spec), sorted(selection_hashes), repr(sorted(rc.items())), code)
+
+
+def load_manifest(cache_dir):
+    path = os.path.join(cache_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, 'manifest.json')
+    with open(path+'.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path+'.tmp', path)
+
+
+def _stats_path(cache_dir, digest):
+    return os.path.join(cache_dir, 'stats', digest+'.npz')
+
+
+def load_stats(cache_dir, digest):
+    with np.load(_stats_path(cache_dir, digest)) as f:
+        return f['ts'], f['mean'], f['sem']
+
+
+def save_stats(cache_dir, digest, stats):
+    path = _stats_path(cache_dir, digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ts, mean, sem = stats
+    np.savez(path+'.tmp.npz', ts=ts, mean=mean, sem=sem)
+    os.replace(path+'.tmp.npz', path)
+
+
+def stale_figures(specs, catalogues, samples, out_dir, cache_dir, rc={}):
+    '''
+    Names of the figures which need rendering, with the hashes of this build.
+
+    Returns
+    -------
+    stale : list
+    hashes : InputHashes
+    figures : dict
+        Hash and dependencies of every figure.
+    '''
+    manifest = load_manifest(cache_dir)
+    hashes = InputHashes(catalogues, samples)
+    code = code_hash()
+    figures, stale = {}, []
+    for spec in specs:
+        keys = sorted(figure_batch.figure_selections(spec), key=repr)
+        selections = {repr(key): hashes.selection(key) for key in keys}
+        digest = figure_hash(spec, selections.values(), rc, code)
+        paths = [os.path.join(out_dir, spec['name']+'.'+format) for format in spec.get('formats', ['pdf'])]
+        figures[spec['name']] = {'hash': digest, 'selections': selections, 'code': code, 'paths': paths,
+                                 'columns': {repr(key): hashes.dependencies(key) for key in keys}}
+        previous = manifest.get(spec['name'], {})
+        if previous.get('hash') != digest or not all(os.path.exists(p) for p in paths):
+            stale.append(spec['name'])
+    return stale, hashes, figures
+
+
+def build(specs, catalogues, samples, out_dir, cache_dir=None, n_workers=4, rc={}, force=False, verbose=True):
+    '''
+    Renders the figures of specs whose inputs changed since the last build (all of them if
+    force), computing only the statistics which are not cached.
+
+    Returns
+    -------
+    paths : dict
+        Files of every figure (rendered now or before).
+    '''
+    cache_dir = os.path.join(out_dir, '.figure_build') if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    stale, hashes, figures = stale_figures(specs, catalogues, samples, out_dir, cache_dir, rc)
+    if force:
+        stale = [spec['name'] for spec in specs]
+    todo = [spec for spec in specs if spec['name'] in stale]
+
+    stats = {}
+    n_computed = 0
+    for spec in todo:
+        for key in figure_batch.figure_selections(spec):
+            if key in stats:
+                continue
+            digest = figures[spec['name']]['selections'][repr(key)]
+            if os.path.exists(_stats_path(cache_dir, digest)):
+                stats[key] = load_stats(cache_dir, digest)
+            else:
+                catalogue, sample, property, condition, pa, mass, time = key
+                roots = figure_batch.select_roots(samples[sample], pa, mass)
+                stats[key] = figure_batch.evolution_stats(catalogues[catalogue], roots, property, condition, time)
+                save_stats(cache_dir, digest, stats[key])
+                n_computed += 1
+    if verbose:
+        print(str(len(todo))+' of '+str(len(specs))+' figures to render, '+str(n_computed)+' statistics computed')
+
+    if len(todo) > 0:
+        figure_batch.build_figures(todo, catalogues, samples, out_dir, n_workers=n_workers, rc=rc, stats=stats)
+    manifest = load_manifest(cache_dir)
+    for spec in specs:
+        if spec['name'] in stale:
+            manifest[spec['name']] = figures[spec['name']]
+    save_manifest(cache_dir, manifest)
+    return {name: figures[name]['paths'] for name in figures}
@@ -6,16 +6,23 @@ import numpy as np
 import matplotlib.pyplot as plt
 import scipy.stats
 import split_population
+import resampling
 from matplotlib.ticker import MultipleLocator, FormatStrFormatter
 
 
-def plot_property_evolution(time, property, ax, label=None, color='k', linestyle='solid', alpha=0.3):
+def plot_property_evolution(time, property, ax, label=None, color='k', linestyle='solid', alpha=0.3, roots=None, n_boot=1000):
     '''
-    Given a population of galaxies with a defined property and equivalent redshift, this 
+    Given a population of galaxies with a defined property and equivalent redshift, this
     finds the average value at every snapshot and finds the median and standard error.
-    These are then plotted. 
+    These are then plotted. If the root subfind of every point is given, the band is a
+    bootstrap interval over whole branches instead of the standard error.
     '''
-    ts = np.unique(time) 
+    if roots is not None:
+        ts, av, lower, upper = resampling.bootstrap_mean(time, property, roots, n_boot=n_boot)
+        ax.plot(ts, av, linestyle=linestyle, color=color, label=label, linewidth=3)
+        ax.fill_between(ts, lower, upper, alpha=alpha, color=color)
+        return
+    ts = np.unique(time)
     # finding average value for each defined z.
     av = np.zeros(ts.shape[0])
     std = np.zeros(ts.shape[0])
@@ -0,0 +1,140 @@
+'''
+resampling - bootstrap confidence bands and permutation tests for the mean evolution of
+a population, resampling whole branches (roots) rather than rows, since the points of a
+branch are not independent.
+
+Every branch is reduced once to its sum and count of values at every snapshot (an
+n_roots x n_times matrix). A replicate is then a vector of weights over roots (how often
+each root is drawn, or which group it is put in), so a block of replicates is a single
+matrix product, and blocks are spread over a process pool.
+
+    ts, av, lower, upper = resampling.bootstrap_mean(tab.branch_lookback_time.values,
+                                                     tab.BH_CumEgyInjection_RM.values,
+                                                     tab.root_subfind.values)
+    ts, diff, p = resampling.permutation_test(align_tab, mis_tab, 'BH_CumEgyInjection_RM')
+'''
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# replicates evaluated per matrix product (bounds the n_block x n_roots weight matrix).
+BLOCK = 256
+
+
+def branch_matrix(time, values, roots, times=None):
+    '''
+    Sum and number of the (non-nan) values of every root at every time.
+
+    Returns
+    -------
+    root_ids : ndarray (n_roots)
+    times : ndarray (n_times)
+    sums, counts : ndarray (n_roots, n_times)
+    '''
+    time = np.asarray(time)
+    values = np.asarray(values, dtype=float)
+    root_ids, root_index = np.unique(np.asarray(roots), return_inverse=True)
+    times = np.unique(time) if times is None else np.asarray(times)
+    time_index = np.searchsorted(times, time)
+    keep = np.isfinite(values) & (time_index < times.shape[0])
+    keep[keep] = times[time_index[keep]] == time[keep]
+    cell = root_index[keep] * times.shape[0] + time_index[keep]
+    size = root_ids.shape[0] * times.shape[0]
+    sums = np.bincount(cell, weights=values[keep], minlength=size).reshape(root_ids.shape[0], -1)
+    counts = np.bincount(cell, minlength=size).reshape(root_ids.shape[0], -1).astype(float)
+    return root_ids, times, sums, counts
+
+
+def _weighted_mean(weights, sums, counts):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (weights @ sums) / (weights @ counts)
+
+
+def _bootstrap_block(sums, counts, n_rep, seed):
+    rng = np.random.default_rng(seed)
+    n_roots = sums.shape[0]
+    out = np.empty((n_rep, sums.shape[1]))
+    for i in range(0, n_rep, BLOCK):
+        n = min(BLOCK, n_rep - i)
+        # draw counts of every root in every replicate.
+        draws = rng.integers(0, n_roots, size=(n, n_roots)) + (np.arange(n) * n_roots)[:, None]
+        weights = np.bincount(draws.ravel(), minlength=n*n_roots).reshape(n, n_roots).astype(float)
+        out[i:i+n] = _weighted_mean(weights, sums, counts)
+    return out
+
+
+def _permutation_block(sums, counts, n_a, n_rep, seed):
+    rng = np.random.default_rng(seed)
+    n_roots = sums.shape[0]
+    total_sums = np.sum(sums, axis=0)
+    total_counts = np.sum(counts, axis=0)
+    out = np.empty((n_rep, sums.shape[1]))
+    for i in range(0, n_rep, BLOCK):
+        n = min(BLOCK, n_rep - i)
+        # the n_a roots with the smallest random keys make group a.
+        in_a = (np.argsort(rng.random((n, n_roots)), axis=1) < n_a).astype(float)
+        sum_a, count_a = in_a @ sums, in_a @ counts
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out[i:i+n] = sum_a / count_a - (total_sums - sum_a) / (total_counts - count_a)
+    return out
+
+
+def _replicates(func, args, n_rep, n_workers, seed):
+    '''
+    Runs func(*args, n, seed) over blocks of replicates, in a process pool if n_workers > 1.
+    '''
+    n_jobs = max(1, min(n_workers, n_rep))
+    sizes = np.diff(np.linspace(0, n_rep, n_jobs + 1).astype(int))
+    seeds = np.random.SeedSequence(seed).spawn(n_jobs)
+    if n_jobs == 1:
+        return func(*args, n_rep, seeds[0])
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(func, *args, int(n), s) for n, s in zip(sizes, seeds)]
+        return np.concatenate([f.result() for f in futures])
+
+
+def bootstrap_mean(time, values, roots, n_boot=1000, ci=68.27, n_workers=1, seed=None):
+    '''
+    Mean value at every time, with a bootstrap confidence band from resampling roots.
+
+    Returns
+    -------
+    times, mean, lower, upper : ndarray (n_times)
+    '''
+    _, times, sums, counts = branch_matrix(time, values, roots)
+    mean = _weighted_mean(np.ones(sums.shape[0]), sums, counts)
+    reps = _replicates(_bootstrap_block, (sums, counts), n_boot, n_workers, seed)
+    lower, upper = np.nanpercentile(reps, [50 - ci/2, 50 + ci/2], axis=0)
+    return times, mean, lower, upper
+
+
+def permutation_test(tab_a, tab_b, property, time='branch_lookback_time', root='root_subfind',
+                     n_perm=10000, n_workers=1, seed=None):
+    '''
+    Difference of the mean property of two groups of branches (e.g. aligned and misaligned)
+    at every time, with two-sided p-values from permuting the group labels of the roots.
+    Roots in both tables are counted in both groups.
+
+    Returns
+    -------
+    times, diff (mean a - mean b), p : ndarray (n_times)
+        p is taken over the replicates in which both groups have values, and is nan at
+        times where diff is (a group has no values) or no replicate has a difference.
+    '''
+    roots_a = np.unique(tab_a[root].values)
+    # b roots are relabelled so that a root shared by both tables stays two branches.
+    offset = np.max(np.abs(np.concatenate([roots_a, tab_b[root].values]))) + 1
+    _, times, sums, counts = branch_matrix(np.concatenate([tab_a[time].values, tab_b[time].values]),
+                                           np.concatenate([tab_a[property].values, tab_b[property].values]),
+                                           np.concatenate([tab_a[root].values, tab_b[root].values + offset]))
+    n_a = roots_a.shape[0]
+    in_a = np.arange(sums.shape[0]) < n_a
+    diff = _weighted_mean(in_a.astype(float), sums, counts) - _weighted_mean((~in_a).astype(float), sums, counts)
+    reps = _replicates(_permutation_block, (sums, counts, n_a), n_perm, n_workers, seed)
+    # only relabellings which give both groups values count; no p-value without a diff.
+    valid = np.isfinite(reps)
+    with np.errstate(invalid='ignore'):
+        extreme = np.sum((np.abs(reps) >= np.abs(diff)) & valid, axis=0)
+    n_valid = np.sum(valid, axis=0)
+    p = np.where(np.isfinite(diff) & (n_valid > 0), (1 + extreme) / (1 + n_valid), np.nan)
+    return times, diff, p
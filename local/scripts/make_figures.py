@@ -0,0 +1,129 @@
+'''
+make_figures - rebuilds the population evolution figures in local/plots from the
+catalogues with figure_batch (statistics shared between figures, figures rendered in
+parallel). Only figures whose inputs changed since the last run are rebuilt (see
+figure_build); pass --force to rebuild them all.
+
+    python3 make_figures.py [--force]
+'''
+
+import os
+import sys
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import split_population
+import figure_build
+
+# ---------------------------------------------------------------------------------------
+# Configuration.
+
+catalogue_dir = '/Users/cd201/projects/bh_star_gas_misalignment/popeye/catalogues/'
+sample_path = '/Users/cd201/morphology_misalignment/catalogues/tng100_mpl8_pa_info_v0.1_z0_info.csv'
+out_dir = '../plots/'
+n_workers = 8
+split_mass = 10**10.2
+rc = {'text.usetex': True, 'axes.linewidth': 4,
+      'xtick.major.size': 5.5, 'xtick.major.width': 2.5, 'xtick.minor.size': 4.5, 'xtick.minor.width': 2,
+      'ytick.major.size': 5.5, 'ytick.major.width': 2.5, 'ytick.minor.size': 4.5, 'ytick.minor.width': 2,
+      'xtick.labelsize': 'x-large', 'ytick.labelsize': 'x-large'}
+
+# ---------------------------------------------------------------------------------------
+# Figure specs.
+
+high = ('stel_mass', 'high', split_mass)
+low = ('stel_mass', 'low', split_mass)
+labels = {'aligned': '\\Delta PA < 30^{\\circ}', 'misaligned': '\\Delta PA \\geq 30^{\\circ}',
+          'counter': '\\Delta PA \\geq 150^{\\circ}'}
+linestyles = {'aligned': 'solid', 'misaligned': 'dashed', 'counter': 'dotted'}
+
+
+def two_evolution(catalogue, property, condition=0):
+    '''
+    Curves of plot_population.plot_two_evolution_mass: star forming then quenched, both
+    mass ranges, aligned/misaligned/counter-rotating.
+    '''
+    panels = []
+    for sample in ['SF', 'QU']:
+        curves = []
+        for mass, color, sign in [(high, 'slategrey', '\\geq'), (low, 'darkseagreen', '<')]:
+            for pa in ['aligned', 'misaligned', 'counter']:
+                curves.append({'catalogue': catalogue, 'sample': sample, 'property': property, 'condition': condition,
+                               'pa': pa, 'mass': mass, 'color': color, 'linestyle': linestyles[pa],
+                               'alpha': 0.1 if pa == 'counter' else 0.3,
+                               'label': '$\\mathrm{M_{stel} '+sign+' 10^{10.2}M_{\\odot}, '+labels[pa]+'}$'})
+        panels.append(curves)
+    return panels
+
+
+def two_residual(catalogue, property, mass, color, condition=0, peak=False):
+    '''
+    Curves of plot_population.plot_two_residual_LM/HM: misaligned and counter-rotating
+    minus aligned, star forming then quenched.
+    '''
+    panels = []
+    for sample in ['SF', 'QU']:
+        panels.append([{'catalogue': catalogue, 'sample': sample, 'property': property, 'condition': condition,
+                        'pa': pa, 'mass': mass, 'residual': {'pa': 'aligned'}, 'color': color,
+                        'linestyle': linestyles[pa], 'alpha': 0.1 if pa == 'counter' else 0.2,
+                        'peak': peak and pa == 'misaligned', 'label': '$'+labels[pa]+'$'}
+                       for pa in ['misaligned', 'counter']])
+    return panels
+
+
+def grid_spec(name, rows, ylabels, figsize, residual=False):
+    spec = {'name': name, 'shape': (len(rows), 2), 'figsize': figsize, 'sharex': 'all', 'sharey': 'row',
+            'panels': {}, 'axes': {}, 'formats': ['pdf', 'png']}
+    for i, (panels, ylabel) in enumerate(zip(rows, ylabels)):
+        for j, curves in enumerate(panels):
+            spec['panels'][(i, j)] = curves
+            spec['axes'][(i, j)] = {'hline': 0} if residual else {}
+        spec['axes'][(i, 0)]['ylabel'] = ylabel
+        spec['axes'][(i, 0)]['fontsize'] = 18
+    spec['axes'][(0, 0)].update({'title': 'Star forming at $z=0$', 'xlim': [0, 7.93], 'invert_x': True,
+                                 'legend': {'frameon': False, 'fontsize': 12}})
+    spec['axes'][(0, 1)]['title'] = 'Quenched at $z=0$'
+    for j in range(2):
+        spec['axes'][(len(rows) - 1, j)]['xlabel'] = 'lookback time, [Gyr]'
+    return spec
+
+
+specs = [grid_spec('two_pop_evolution_Mstel10_2_nosfr',
+                   [two_evolution('mass', 'log10_Lbh_bol'), two_evolution('gas', 'gas_frac_2re'),
+                    two_evolution('gas', 'frac_of_which_cold'), two_evolution('mass', 'GasMetallicitySolar')],
+                   ['$log_{10}\\mathrm{(L_{bol, AGN})}$ \n [ergs/s]', 'Gas fraction \n [$\\mathrm{M_{gas}/M_{stel}}$]',
+                    'of which cold/star forming \n [$\\mathrm{M_{cold}/M_{gas}}$]',
+                    'Gas phase metallicity \n [$\\mathrm{Z/Z_{\\odot}}$]'], (10, 15)),
+         grid_spec('LM_BH_residual_evo_Mstel10_2_twocol',
+                   [two_residual('mass', 'BH_CumEgyInjection_Total', low, 'darkseagreen', peak=True),
+                    two_residual('mass', 'BH_mass', low, 'darkseagreen')],
+                   ['$\\Delta$Energy injected', '$\\Delta$$M_{BH}$ \n [$M_{\\odot}$]'], (10, 7), residual=True),
+         grid_spec('HM_BH_residual_evo_Mstel10_2_twocol',
+                   [two_residual('mass', 'BH_CumEgyInjection_Total', high, 'slategrey', peak=True),
+                    two_residual('mass', 'BH_mass', high, 'slategrey')],
+                   ['$\\Delta$Energy injected', '$\\Delta$$M_{BH}$ \n [$M_{\\odot}$]'], (10, 7.5), residual=True)]
+
+# ---------------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    # catalogues (and astropy) are only loaded here, since spawned figure workers re-run
+    # the top level of this file.
+    from astropy.cosmology import Planck15
+    tng100_pa = split_population.tng100_pa_sample(pd.read_csv(sample_path, comment='#'))
+    QU, SF, GV = split_population.SFMS_breakdown(tng100_pa)
+    samples = {'QU': QU, 'SF': SF, 'GV': GV}
+
+    mass_tab = pd.read_csv(catalogue_dir+'tng100_bh_history.csv')
+    mass_tab['BH_CumEgyInjection_Total'] = mass_tab['BH_CumEgyInjection_QM'] + mass_tab['BH_CumEgyInjection_RM']
+    mass_tab['GasMetallicitySolar'] = mass_tab['GasMetallicity'] / 0.0134
+    gas_tab = pd.read_csv(catalogue_dir+'tng100_gas_history.csv')
+    gas_tab['frac_of_which_cold'] = gas_tab['cold_gas_frac_2re'] / gas_tab['gas_frac_2re']
+    catalogues = {'mass': mass_tab, 'gas': gas_tab}
+    for tab in catalogues.values():
+        tab['branch_lookback_time'] = Planck15.lookback_time(tab.branch_z.values).value
+
+    paths = figure_build.build(specs, catalogues, samples, out_dir, n_workers=n_workers, rc=rc,
+                               force='--force' in sys.argv)
+    for name in paths:
+        print(name+': '+', '.join(paths[name]))
+
+# ---------------------------------------------------------------------------------------
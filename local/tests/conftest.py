@@ -0,0 +1,8 @@
+'''
+The local tests import the modules of ../lib by bare name, as the local scripts do.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
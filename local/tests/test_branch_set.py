@@ -0,0 +1,42 @@
+'''
+Tests of the per-branch running quantities of branch_set.
+'''
+
+import numpy as np
+import pandas as pd
+import branch_set
+
+
+def _branches(values, lengths):
+    roots = np.repeat(np.arange(len(lengths)), lengths)
+    snaps = np.concatenate([np.arange(n) for n in lengths])
+    tab = pd.DataFrame({'root_subfind': roots, 'branch_snapnum': snaps, 'x': values})
+    return branch_set.BranchSet.from_dataframe(tab)
+
+
+def _per_branch(branches, values):
+    return np.concatenate([np.cumsum(values[a:b]) for a, b in zip(branches.starts, branches.ends)])
+
+
+def test_cumsum_nan_stays_in_branch():
+    values = np.array([1., np.nan, 2., 3., 4., np.inf, 5., 6.])
+    branches = _branches(values, [3, 2, 1, 2])
+    out = branches.cumsum('x')
+    assert np.array_equal(out, _per_branch(branches, values), equal_nan=True)
+    assert np.array_equal(out[3:], [3., 7., np.inf, 5., 11.])
+
+
+def test_cumsum_magnitudes():
+    # a huge earlier branch must not swallow the small values after it.
+    values = np.array([1e20, 3e20, 1., 2., 1e-5, 3.])
+    branches = _branches(values, [2, 3, 1])
+    out = branches.cumsum('x')
+    assert np.array_equal(out, _per_branch(branches, values))
+    assert np.array_equal(out[2:], [1., 3., 3.00001, 3.])
+
+
+def test_half_point():
+    values = np.array([1e20, 1e20, 3e20, 1., 1., 4., np.nan, 1., 0., 0.])
+    branches = _branches(values, [3, 3, 2, 2])
+    # the nan branch and the branch with nothing have no half point.
+    assert np.array_equal(branches.half_point('x'), [2, 5, -1, -1])
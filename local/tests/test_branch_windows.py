@@ -0,0 +1,31 @@
+'''
+Tests of the rolling windows of branch_windows against a direct sum over every window.
+'''
+
+import numpy as np
+import pandas as pd
+import branch_set
+import branch_windows
+
+
+def _window(lengths, values, window):
+    roots = np.repeat(np.arange(len(lengths)), lengths)
+    times = np.concatenate([np.arange(n)[::-1] * 0.7 for n in lengths])
+    tab = pd.DataFrame({'root_subfind': roots, 'branch_snapnum': np.concatenate([np.arange(n) for n in lengths]),
+                        'branch_lookback_time': times, 'x': values})
+    return branch_windows.TimeWindow(branch_set.BranchSet.from_dataframe(tab), window), roots, times
+
+
+def _direct(roots, times, values, window, reduce):
+    return np.array([reduce(values[(roots == roots[i]) & (times >= times[i]) & (times < times[i] + window)])
+                     for i in range(values.shape[0])])
+
+
+def test_sum_and_count_stay_in_branch():
+    # a huge branch, one with nan, then small values that must be summed exactly.
+    values = np.array([1e20, 3e20, 2e20, 1., np.nan, 2., 1e-5, 2e-5, 3e-5, 4e-5])
+    windows, roots, times = _window([3, 3, 4], values, 1.5)
+    # differences of prefix sums agree with the direct sums to rounding.
+    np.testing.assert_allclose(windows.sum('x'), _direct(roots, times, values, 1.5, np.nansum), rtol=1e-12, atol=0)
+    assert np.array_equal(windows.count('x'), _direct(roots, times, values, 1.5, lambda v: np.sum(~np.isnan(v))))
+    assert np.array_equal(windows.sum('x')[3:6], [1., 1., 3.])
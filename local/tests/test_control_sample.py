@@ -0,0 +1,20 @@
+'''
+Tests of control_sample matching with non-finite features.
+'''
+
+import numpy as np
+import pandas as pd
+import control_sample
+
+
+def test_non_finite_rows():
+    control = pd.DataFrame({'subfind_id': [10, 11, 12, 13], 'x': [1., np.nan, 3., np.inf], 'y': [1., 2., 3., 4.]})
+    treatment = pd.DataFrame({'subfind_id': [0, 1, 2], 'x': [2.9, np.nan, 1.1], 'y': [3., 2., 1.]})
+    for replace in [True, False]:
+        matched = control_sample.match_controls(treatment, control, features=['x', 'y'], replace=replace)
+        # the nan treatment is unmatched, and no control with a non-finite feature is used.
+        assert list(matched.treatment_id) == [0, 2]
+        assert list(matched.control_id) == [12, 10]
+    matcher = control_sample.ControlMatcher(np.array([[np.nan, 0.], [0., 0.]]), np.array([5, 6]))
+    index, distance = matcher.match(np.array([[0.1, 0.], [np.inf, 0.]]))
+    assert list(index[:, 0]) == [1, -1]
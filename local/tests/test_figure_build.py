@@ -0,0 +1,25 @@
+'''
+Tests of the selection hashes of figure_build.
+'''
+
+import numpy as np
+import pandas as pd
+import figure_batch
+import figure_build
+
+
+def _hashes():
+    catalogues = {'bh': pd.DataFrame({'root_subfind': [0, 0, 1], 'branch_lookback_time': [1., 0., 0.], 'x': [1., 2., 3.]})}
+    samples = {'QU': pd.DataFrame({'subfind_id': [0, 1], 'pa_offset': [10., 50.]})}
+    return figure_build.InputHashes(catalogues, samples)
+
+
+def test_selection_follows_stats_code(monkeypatch):
+    key = ('bh', 'QU', 'x', None, 'all', None, 'branch_lookback_time')
+    before = _hashes().selection(key)
+    assert _hashes().selection(key) == before
+
+    def evolution_stats(tab, roots, property, condition=None, time='branch_lookback_time'):
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    monkeypatch.setattr(figure_batch, 'evolution_stats', evolution_stats)
+    assert _hashes().selection(key) != before
@@ -0,0 +1,23 @@
+'''
+Tests of the permutation test of resampling.
+'''
+
+import numpy as np
+import pandas as pd
+import resampling
+
+
+def test_permutation_test_p_undefined_without_diff():
+    # at t=2 only group a has values, so there is no difference (and no p-value); at t=1
+    # one root of each group has a value, so every relabelling which gives both groups a
+    # value is as extreme (p = 1); at t=0 a third of the relabellings are.
+    a = pd.DataFrame({'root_subfind': [0, 0, 0, 1, 1, 1], 'branch_lookback_time': [0., 1., 2.] * 2,
+                      'x': [1., 5., 1., 2., np.nan, 1.]})
+    b = pd.DataFrame({'root_subfind': [2, 2, 2, 3, 3, 3], 'branch_lookback_time': [0., 1., 2.] * 2,
+                      'x': [3., 3., np.nan, 4., np.nan, np.nan]})
+    times, diff, p = resampling.permutation_test(a, b, 'x', n_perm=200, seed=1)
+    assert np.array_equal(times, [0., 1., 2.])
+    assert np.all(np.isfinite(diff[:2])) and np.isnan(diff[2])
+    assert abs(p[0] - 1/3) < 0.1
+    assert p[1] == 1
+    assert np.isnan(p[2])
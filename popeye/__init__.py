@@ -0,0 +1,37 @@
+'''
+popeye - library of functions used on clusters with TNG raw data (mainly to create
+catalogues). The modules live in lib/.
+
+Submodules are imported on first access, so `import popeye` costs next to nothing and a
+worker process only pays for the modules it actually uses:
+
+    import popeye
+    popeye.simulation_registry.use(basePath)
+    tab = popeye.branch_properties.branch_tabulate(...)
+
+The modules in lib/ import each other by bare name (as the scripts do), so lib/ is put on
+sys.path and popeye.<name> is the very same module object as <name>: module state (the
+current simulation, shared memory blocks) is never duplicated.
+'''
+
+import os
+import sys
+import importlib
+
+LIB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib')
+if LIB not in sys.path:
+    sys.path.insert(0, LIB)
+
+SUBMODULES = sorted(f[:-3] for f in os.listdir(LIB) if f.endswith('.py'))
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        module = importlib.import_module(name)
+        globals()[name] = module
+        return module
+    raise AttributeError("module 'popeye' has no attribute '"+name+"'")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(SUBMODULES))
@@ -100,3 +100,99 @@ def compute_particle_magnitudes(pos, vel, masses=None):
     
     print('Not tested for actual science use.')
     return magnitude_sJ
+
+
+def compute_angular_momentum_profile(pos, vel, radii, masses=None):
+    ''' Radially resolved angular momentum: the direction (and specific magnitude) of the
+        angular momentum enclosed within each radius and in each shell between radii.
+        
+        Particles are sorted by radius once; the cumulative sum of the per-particle
+        angular momentum contributions then gives every enclosed and shell total by
+        differencing, so any number of radii costs one O(N log N) pass.
+        
+        Parameters
+        ----------
+        
+        pos : ndarray (n1, 3)
+            Must already be defined with respect to centre position and scaled by scale 
+            factor.
+        vel : ndarray (n1, 3)
+            Must already be defined with respect to centre motion and scaled by scale 
+            factor.
+        radii : ndarray (m)
+            Increasing radii (same units as pos), e.g. multiples of the stellar half mass
+            radius from fractional_radii.mass_enclosed_radii. Shell i spans
+            radii[i-1] < r <= radii[i], with the first shell starting at 0.
+        masses : ndarray (n1) 
+            1D masses referring to each particle/cell position. In physical units.
+        
+        Returns
+        -------
+        
+        enclosed_unit : ndarray (m, 3)
+            unit vector of the angular momentum within each radius (nan if empty).
+        shell_unit : ndarray (m, 3)
+            unit vector of the angular momentum in each shell (nan if empty).
+        enclosed_sJ : ndarray (m)
+            magnitude of specific angular momentum within each radius.
+        shell_sJ : ndarray (m)
+            magnitude of specific angular momentum in each shell.
+        shell_count : ndarray (m)
+            number of particles in each shell.
+    '''
+    
+    # If masses are undefined, all particles are assumed to have a mass of one.
+    if masses is None:
+        masses = np.ones(pos.shape[0])
+    radii = np.atleast_1d(radii)
+    
+    # Sorting on radius once and accumulating the angular momentum contributions.
+    rad = np.linalg.norm(pos, axis=1)
+    order = np.argsort(rad)
+    ang_mom = np.cross(pos[order], vel[order]) * masses[order][:, np.newaxis]
+    cum_ang_mom = np.vstack([np.zeros(3), np.cumsum(ang_mom, axis=0)])
+    cum_mass = np.concatenate([[0], np.cumsum(masses[order])])
+    
+    # Number of particles within each radius, and the totals within/between radii.
+    n_inside = np.searchsorted(rad[order], radii, side='right')
+    enclosed = cum_ang_mom[n_inside]
+    enclosed_mass = cum_mass[n_inside]
+    shell = np.diff(np.vstack([np.zeros(3), enclosed]), axis=0)
+    shell_mass = np.diff(np.concatenate([[0], enclosed_mass]))
+    shell_count = np.diff(np.concatenate([[0], n_inside]))
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        enclosed_norm = np.linalg.norm(enclosed, axis=1)
+        shell_norm = np.linalg.norm(shell, axis=1)
+        enclosed_unit = enclosed / enclosed_norm[:, np.newaxis]
+        shell_unit = shell / shell_norm[:, np.newaxis]
+        enclosed_sJ = enclosed_norm / enclosed_mass
+        shell_sJ = shell_norm / shell_mass
+    
+    return enclosed_unit, shell_unit, enclosed_sJ, shell_sJ, shell_count
+
+
+def compute_misalignment_profile(star_pos, star_vel, gas_pos, gas_vel, radii, star_masses=None, gas_masses=None):
+    ''' 3D angle (degrees) between the stellar and gas angular momentum within each radius
+        and in each shell between radii (see compute_angular_momentum_profile). Large shell
+        angles at large radii with small enclosed angles point to a warped or misaligned
+        outer gas disc.
+        
+        Both components must be defined relative to the same centre and motion.
+        
+        Returns
+        -------
+        
+        enclosed_angle : ndarray (m)
+            star-gas angle within each radius (nan where either component is empty).
+        shell_angle : ndarray (m)
+            star-gas angle in each shell.
+        star_profile, gas_profile : tuple
+            full compute_angular_momentum_profile output for stars and gas.
+    '''
+    star_profile = compute_angular_momentum_profile(star_pos, star_vel, radii, star_masses)
+    gas_profile = compute_angular_momentum_profile(gas_pos, gas_vel, radii, gas_masses)
+    
+    enclosed_angle = np.degrees(np.arccos(np.clip(np.einsum('ij,ij->i', star_profile[0], gas_profile[0]), -1, 1)))
+    shell_angle = np.degrees(np.arccos(np.clip(np.einsum('ij,ij->i', star_profile[1], gas_profile[1]), -1, 1)))
+    return enclosed_angle, shell_angle, star_profile, gas_profile
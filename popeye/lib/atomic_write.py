@@ -0,0 +1,32 @@
+'''
+atomic_write - files (or directories) written under a temporary name next to their final
+path and renamed into place only once complete, so a partly written cache, bundle or
+batch is never read, by this or any other process or node.
+
+    with atomic_write.temporary_path(path) as tmp:
+        np.save(tmp, values)
+'''
+
+import os
+import shutil
+import socket
+from contextlib import contextmanager
+
+
+@contextmanager
+def temporary_path(path, suffix=''):
+    '''
+    Yields a temporary name for path, unique to this host and process, with suffix
+    appended (e.g. '.npz' for writers which add their own extension). When the block
+    succeeds it is renamed onto path; either way nothing is left under the temporary name.
+    os.replace raises OSError if path is a directory which exists already.
+    '''
+    tmp = path+'.'+socket.gethostname()+'_'+str(os.getpid())+'.tmp'+suffix
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif os.path.lexists(tmp):
+            os.remove(tmp)
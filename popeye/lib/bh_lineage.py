@@ -0,0 +1,119 @@
+'''
+bh_lineage - per black hole time series across snapshots for every BH in the box.
+
+bh_params_subhalo sums BH quantities per subhalo and snapshot, which loses the history
+of individual BHs when a subhalo holds several or when they merge. Here the BH IDs of
+all snapshots are joined into one sorted ID list, and each snapshot is placed into it
+through its sorted ID index (particle_index.ParticleIndex.locate), so every BH in the box
+gets its series in one pass over the snapshots. With a cache_dir the indexes are kept
+between runs and the ParticleIDs are not read again.
+
+Mergers: a BH that swallows another keeps its ID and its BH_Progs count increases, while
+the swallowed BH disappears. merger[i, k] flags an increase of BH_Progs of BH i at
+snapshot k since its previous appearance; last_snap[i] is the last snapshot a BH is
+seen at (before the final one for BHs that were swallowed).
+'''
+
+import numpy as np
+import h5py
+import snapshot as ss
+import particle_index
+
+# BH fields tabulated per snapshot.
+SERIES_FIELDS = ['BH_CumEgyInjection_QM', 'BH_CumEgyInjection_RM', 'BH_CumMassGrowth_QM',
+                 'BH_CumMassGrowth_RM', 'BH_Mass', 'BH_Mdot']
+
+
+def load_bh_snapshot(basePath, snapnum, fields=SERIES_FIELDS, ids=True):
+    '''
+    Every BH in the snapshot: ParticleIDs (if ids), BH_Progs and fields (snapshot order).
+    '''
+    props = ss.loadSubset(basePath, snapnum, 'BH', fields=(['ParticleIDs'] if ids else []) + ['BH_Progs'] + list(fields), sq=False)
+    if props['count'] == 0:
+        if ids:
+            props['ParticleIDs'] = np.array([], dtype=np.uint64)
+        props['BH_Progs'] = np.array([], dtype=np.int64)
+        for field in fields:
+            props[field] = np.array([])
+    return props
+
+
+def compute_bh_lineage(snapnums, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', fields=SERIES_FIELDS,
+                       hosts=True, cache_dir=None):
+    '''
+    Builds per-BH time series over snapnums.
+
+    Parameters
+    ----------
+    snapnums : array_like
+        Snapshots to include (any order, returned increasing).
+    fields : list of str
+        BH fields to tabulate.
+    hosts : bool
+        Also find the subfind ID hosting each BH at each snapshot.
+    cache_dir : str
+        If set, the per-snapshot sorted ID indexes are kept here (see particle_index) and
+        read back instead of the ParticleIDs on later runs.
+
+    Returns
+    -------
+    dict with
+        ParticleIDs : (n_bh) sorted IDs of every BH seen in any snapshot.
+        snapnum : (n_snap)
+        <field> : (n_bh, n_snap) nan where the BH does not exist.
+        BH_Progs : (n_bh, n_snap) -1 where the BH does not exist.
+        SubfindID : (n_bh, n_snap) host subhalo, -1 if none (only with hosts).
+        merger : (n_bh, n_snap) BH_Progs increased since the previous appearance.
+        first_snap, last_snap : (n_bh) first and last snapshot the BH exists at.
+    '''
+    snapnums = np.sort(np.asarray(snapnums))
+    snaps = [load_bh_snapshot(basePath, snap, fields, ids=False) for snap in snapnums]
+    indexes = [particle_index.load_index(basePath, snap, 'BH', cache_dir) for snap in snapnums]
+
+    # one sorted list of every BH ID, and each snapshot's rows placed into it.
+    all_ids = np.unique(np.concatenate([index.sorted_ids for index in indexes]))
+    n_bh, n_snap = all_ids.shape[0], snapnums.shape[0]
+    out = {'ParticleIDs': all_ids, 'snapnum': snapnums,
+           'BH_Progs': np.full((n_bh, n_snap), -1, dtype=np.int64)}
+    for field in fields:
+        out[field] = np.full((n_bh, n_snap), np.nan)
+    if hosts:
+        out['SubfindID'] = np.full((n_bh, n_snap), -1, dtype=np.int64)
+
+    for k, (snap, props, index) in enumerate(zip(snapnums, snaps, indexes)):
+        # snapshot-order position of every BH, -1 where it does not exist at snap.
+        position = index.locate(all_ids)
+        rows = np.flatnonzero(position >= 0)
+        position = position[rows]
+        out['BH_Progs'][rows, k] = props['BH_Progs'][position]
+        for field in fields:
+            out[field][rows, k] = props[field][position]
+        if hosts and rows.shape[0] > 0:
+            out['SubfindID'][rows, k] = particle_index.host_subhalos(basePath, snap, 'BH', position)
+
+    exists = out['BH_Progs'] >= 0
+    out['first_snap'] = np.where(exists.any(axis=1), snapnums[np.argmax(exists, axis=1)], -1)
+    out['last_snap'] = np.where(exists.any(axis=1), snapnums[n_snap - 1 - np.argmax(exists[:, ::-1], axis=1)], -1)
+
+    # BH_Progs carried forward over gaps, so an increase is found against the previous
+    # appearance of the BH.
+    progs = np.where(exists, out['BH_Progs'], 0)
+    previous = np.maximum.accumulate(progs, axis=1)
+    previous = np.concatenate([np.zeros((n_bh, 1), dtype=np.int64), previous[:, :-1]], axis=1)
+    seen_before = np.concatenate([np.zeros((n_bh, 1), dtype=bool), np.logical_or.accumulate(exists, axis=1)[:, :-1]], axis=1)
+    out['merger'] = exists & seen_before & (out['BH_Progs'] > previous)
+    return out
+
+
+def write_lineage_hdf5(lineage, filename):
+    '''
+    Writes compute_bh_lineage output to hdf5, one dataset per key.
+    '''
+    with h5py.File(filename, 'w') as hf:
+        for key, values in lineage.items():
+            hf.create_dataset(key, data=values, compression='gzip', shuffle=True)
+
+
+def read_lineage_hdf5(filename):
+    with h5py.File(filename, 'r') as hf:
+        return {key: hf[key][()] for key in hf}
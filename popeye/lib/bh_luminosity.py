@@ -4,9 +4,8 @@ code courtesy of Mélanie Habouzit
 '''
 
 import numpy as np
-from astropy.cosmology import Planck15
+import cosmology
 
-h = Planck15.h
 cte_G = 6.67408*10**-8 ## cm3 g-1 s-2                                                                                                                                               
 cte_m_p = 1.6726*10**-24 ## g                                                                                                                                                       
 cte_eps_r = 0.1
@@ -27,7 +26,7 @@ def compute_luminosity_MH(mbh, accbh, radia_efficient_agn):
        For more information see: Habouzit+19: Linking galaxy structural properties... 
        '''
 
-    mbh = np.array([p*1e10/h for p in mbh]) ## Msun                                                                                                                                    
+    mbh = np.array([p*1e10/cosmology.h() for p in mbh]) ## Msun                                                                                                                                    
     accbh = np.array([p*10.22 for p in accbh]) ## Msun/yr                                                                                                                          
     edd = np.array([4*np.pi*cte_G*cte_m_p*p/cte_eps_r/cte_sigma_t/cte_c*(3.154*10**7) for p in mbh])
     fedd = np.array([np.log10(accbh[p]/edd[p]) for p in range(len(edd))])
@@ -77,7 +76,7 @@ def compute_luminosity(mbh, accbh, method):
         
     elif isinstance(mbh, float):
         # calculating only for float. note this fails if int.
-        mbh= mbh*1e10/h ## Msun                                                                                                                                    
+        mbh= mbh*1e10/cosmology.h() ## Msun                                                                                                                                    
         accbh= accbh*10.22 ## Msun/yr                                                                                                                              
         edd = 4 * np.pi* cte_G * cte_m_p* mbh /cte_eps_r/ cte_sigma_t/ cte_c*(3.154*10**7)
         fedd = np.log10(accbh/edd)
@@ -5,10 +5,19 @@ provided in subhalo catalogues. basically just summing individual particle info.
 
 import numpy as np
 import snapshot as ss
+import instrumentation
+import prefetch
+import shared_blocks
+import branch_bundle
 
-def compute_params_branch(subfind_id, snapnum, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output'):
+# BH particle fields read by load_params.
+BH_FIELDS = ['BH_CumEgyInjection_QM', 'BH_CumEgyInjection_RM', 'BH_CumMassGrowth_QM', 'BH_CumMassGrowth_RM', 'BH_Density', 'BH_Progs']
+
+def compute_params_branch(subfind_id, snapnum, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', n_prefetch=0):
     '''
     Returns compute_params for an array of subfind_ids and snaps.
+    If n_prefetch > 0, up to n_prefetch (subhalo, snap) BH blocks are read in the background
+    while the current one is summed (see prefetch).
     '''
     # creating arrays to append to.
     BH_CumEgyInjection_QM = np.array([])
@@ -19,8 +28,11 @@ def compute_params_branch(subfind_id, snapnum, basePath='/simons/scratch/sgenel/
     BHpart_count = np.array([])
     BH_progenitors = np.array([])
     
-    for ind, sub in enumerate(subfind_id):
-        output = compute_params(sub, snapnum[ind], basePath)
+    blocks = prefetch.prefetch(lambda sub, snap: load_params(sub, snap, basePath), zip(subfind_id, snapnum), n_prefetch=n_prefetch)
+    for (sub, snap), props, error in blocks:
+        if error is not None:
+            raise error
+        output = params_from_particles(props)
         BH_CumEgyInjection_QM = np.append(BH_CumEgyInjection_QM, output[0])
         BH_CumEgyInjection_RM = np.append(BH_CumEgyInjection_RM, output[1])
         BH_CumMassGrowth_QM = np.append(BH_CumMassGrowth_QM, output[2])
@@ -79,9 +91,30 @@ def compute_params(subfind_id, snapnum, basePath='/simons/scratch/sgenel/Illustr
            BH particles.)
     '''
 
+    return params_from_particles(load_params(subfind_id, snapnum, basePath))
+
+
+def load_params(subfind_id, snapnum, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output'):
+    '''
+    Loads the BH particle fields needed by compute_params for one subhalo.
+    '''
+    # using a shared block if a broker in the parent process holds this snapshot, then the
+    # root's branch_bundle if one is active.
+    props = shared_blocks.lookup(snapnum, subfind_id, 'BH', BH_FIELDS)
+    if props is not None:
+        return props
+    props = branch_bundle.lookup(basePath, snapnum, subfind_id, 'BH', BH_FIELDS)
+    if props is not None:
+        return props
     # loading in all black hole particles in this subhalo.
-    props = ss.loadSubhalo(basePath=basePath, snapNum=snapnum, id=subfind_id, partType='BH', fields = ['BH_CumEgyInjection_QM', 'BH_CumEgyInjection_RM', 'BH_CumMassGrowth_QM', 'BH_CumMassGrowth_RM', 'BH_Density', 'BH_Progs'])
+    with instrumentation.stage('bh_particle_load', snapnum=int(snapnum)):
+        return ss.loadSubhalo(basePath=basePath, snapNum=snapnum, id=subfind_id, partType='BH', fields = BH_FIELDS)
+
 
+def params_from_particles(props):
+    '''
+    compute_params on BH particles already loaded with load_params.
+    '''
     if props['count'] == 0:
         # If no black hole in the subhalo returning -inf for all values.
         return -np.inf, -np.inf, -np.inf, -np.inf, -np.inf, 0, 0
@@ -0,0 +1,352 @@
+'''
+branch_bundle - per-root cutouts of the main branch in one compressed HDF5 file.
+
+The history of one galaxy touches a subhalo in every snapshot back to lookback_z, each in
+a different snapshot directory (and chunk files) on scratch, and every analysis of that
+galaxy repeats the same scattered reads. export_bundle reads them once and writes a single
+bundle per root: the particles of the chosen types and fields of every main branch
+progenitor, the tree catalogue rows of the branch (SubhaloPos being the centres) and the
+snapshot header values the loaders need.
+
+    bundle_<root_snap>_<root_subfind>.hdf5
+        attrs                       root_subfind, root_snap, basePath
+        catalogue/<field>           one row per branch point (decreasing SnapNum)
+        snap_NNN                    attrs subfind_id, HubbleParam, MassTable, Redshift, ...
+        snap_NNN/PartTypeN/<field>  attrs count
+
+    branch_bundle.export_bundle(sub, 99, tree, 1, basePath, bundle_dir)
+    branch_bundle.use(bundle_dir)
+    props = branch_bundle.load_subhalo(basePath, snapnum, subfind_id, 'gas', fields)
+
+As with shared_blocks, the active directory is kept in the environment (inherited by pool
+workers). cold_gas_fraction.load_gas, bh_params_subhalo.load_params and the particle
+loaders of kinematic_morphology, process_subhalo and anisotropy_radii read through
+lookup, and fall back to the snapshot when no bundle of that simulation (basePath) holds
+the subhalo or a field.
+
+Which bundle holds each branch point is kept in bundle_dir/manifest.json (branch points,
+basePath and mtime of every bundle), so a new reader opens only the bundles written or
+rewritten since the manifest was last brought up to date.
+'''
+
+import os
+import json
+import fnmatch
+import threading
+import numpy as np
+import h5py
+import snapshot as ss
+import instrumentation
+import time_conversions
+import shared_blocks
+import atomic_write
+
+# environment variable holding the active bundle directory.
+ENV_BUNDLE_DIR = 'POPEYE_BUNDLE_DIR'
+
+# particle fields exported by default: those read by the popeye loaders.
+PARTICLE_FIELDS = {'gas': ['Coordinates', 'Velocities', 'Masses', 'Potential', 'ElectronAbundance',
+                           'StarFormationRate', 'InternalEnergy'],
+                   'star': ['Coordinates', 'Velocities', 'Masses', 'Potential', 'GFM_StellarFormationTime'],
+                   'DM': ['Coordinates', 'Velocities', 'Potential'],
+                   'BH': ['BH_CumEgyInjection_QM', 'BH_CumEgyInjection_RM', 'BH_CumMassGrowth_QM',
+                          'BH_CumMassGrowth_RM', 'BH_Density', 'BH_Progs']}
+# tree fields kept as the catalogue rows of the branch.
+CATALOGUE_FIELDS = ['SubfindID', 'SnapNum', 'SubhaloGrNr', 'SubhaloPos', 'SubhaloVel', 'SubhaloHalfmassRadType',
+                    'SubhaloMassType', 'SubhaloMassInRadType', 'SubhaloSFRinRad', 'SubhaloGasMetallicity',
+                    'SubhaloLenType']
+HEADER_FIELDS = ['HubbleParam', 'MassTable', 'Redshift', 'Time', 'BoxSize']
+
+COMPRESSION = {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True}
+
+
+def bundle_path(bundle_dir, root_subfind, root_snap):
+    return os.path.join(bundle_dir, 'bundle_'+'%03d' % int(root_snap)+'_'+str(int(root_subfind))+'.hdf5')
+
+
+def _same_path(a, b):
+    return os.path.normpath(os.path.abspath(a)) == os.path.normpath(os.path.abspath(b))
+
+
+def _snap_group(snapnum):
+    return 'snap_'+'%03d' % int(snapnum)
+
+
+def _write_dataset(group, name, values):
+    values = np.asarray(values)
+    if values.size == 0:
+        group.create_dataset(name, data=values)
+    else:
+        group.create_dataset(name, data=values, chunks=True, **COMPRESSION)
+
+
+def write_bundle(path, root_subfind, root_snap, branch, basePath, parts=PARTICLE_FIELDS):
+    '''
+    Writes the bundle of one main branch (a tree.get_main_branch object with at least
+    SubfindID and SnapNum) to path.
+    '''
+    with h5py.File(path, 'w') as f:
+        f.attrs['root_subfind'] = int(root_subfind)
+        f.attrs['root_snap'] = int(root_snap)
+        f.attrs['basePath'] = basePath
+        catalogue = f.create_group('catalogue')
+        for field in CATALOGUE_FIELDS:
+            if hasattr(branch, field):
+                catalogue.create_dataset(field, data=getattr(branch, field))
+
+        for snapnum, subfind_id in zip(branch.SnapNum, branch.SubfindID):
+            group = f.create_group(_snap_group(snapnum))
+            group.attrs['subfind_id'] = int(subfind_id)
+            with h5py.File(ss.snapPath(basePath, snapnum), 'r') as snap:
+                for name in HEADER_FIELDS:
+                    if name in snap['Header'].attrs:
+                        group.attrs[name] = snap['Header'].attrs[name]
+            for partType, fields in parts.items():
+                with instrumentation.stage('bundle_read', snapnum=int(snapnum)):
+                    props = ss.loadSubhalo(basePath, snapnum, subfind_id, partType, fields=fields)
+                if isinstance(props, np.ndarray):
+                    props = {'count': props.shape[0], fields[0]: props}
+                particles = group.create_group('PartType'+str(shared_blocks.part_type_num(partType)))
+                particles.attrs['count'] = int(props['count'])
+                with instrumentation.stage('bundle_write', snapnum=int(snapnum)):
+                    for field in fields:
+                        if field in props:
+                            _write_dataset(particles, field, props[field])
+
+
+def export_bundle(root_subfind, root_snap, tree, lookback_z, basePath, bundle_dir, parts=PARTICLE_FIELDS, overwrite=False):
+    '''
+    Writes the bundle of the main branch of one root (subfind_id at root_snap) back to a
+    given redshift (lookback_z) into bundle_dir, unless it is there already.
+
+    Returns
+    -------
+    path : str
+        Bundle file, or None if the root has no branch.
+    '''
+    path = bundle_path(bundle_dir, root_subfind, root_snap)
+    if os.path.exists(path) and not overwrite:
+        return path
+    with instrumentation.stage('tree_read'):
+        branch = tree.get_main_branch(root_snap, root_subfind, keysel=CATALOGUE_FIELDS)
+    # Since branch is constructed from DM only, those halos with zero DM (but stellar comps)
+    # may not have ANY branch object.
+    if branch == None:
+        return None
+    branch_z = np.array([time_conversions.snap_to_z(i) for i in branch.SnapNum])
+    mask = (branch_z <= lookback_z)
+    for field in CATALOGUE_FIELDS:
+        if hasattr(branch, field):
+            setattr(branch, field, getattr(branch, field)[mask])
+
+    os.makedirs(bundle_dir, exist_ok=True)
+    with atomic_write.temporary_path(path) as tmp:
+        write_bundle(tmp, root_subfind, root_snap, branch, basePath, parts)
+    return path
+
+
+def use(bundle_dir):
+    '''
+    Makes loaders in this process (and workers started from it) read from the bundles in
+    bundle_dir. None stops reading from bundles.
+    '''
+    if bundle_dir is None:
+        os.environ.pop(ENV_BUNDLE_DIR, None)
+    else:
+        os.environ[ENV_BUNDLE_DIR] = os.path.abspath(bundle_dir)
+
+
+def _manifest_entry(path, mtime):
+    '''
+    Manifest entry of one bundle: its mtime, basePath and (snapnum, subfind_id) points.
+    '''
+    with h5py.File(path, 'r') as f:
+        points = [[int(snapnum), int(subfind_id)] for snapnum, subfind_id in zip(f['catalogue/SnapNum'][:], f['catalogue/SubfindID'][:])]
+        return {'mtime': mtime, 'basePath': str(f.attrs['basePath']), 'points': points}
+
+
+def read_manifest(bundle_dir):
+    path = os.path.join(bundle_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def update_manifest(bundle_dir):
+    '''
+    Brings bundle_dir/manifest.json up to date with the bundles in bundle_dir, opening only
+    those not in it (or changed since), and returns it.
+    '''
+    manifest = read_manifest(bundle_dir)
+    entries = {}
+    for entry in os.scandir(bundle_dir):
+        if not fnmatch.fnmatch(entry.name, 'bundle_*.hdf5'):
+            continue
+        mtime = entry.stat().st_mtime
+        known = manifest.get(entry.name)
+        entries[entry.name] = known if known is not None and known['mtime'] == mtime else _manifest_entry(entry.path, mtime)
+    if entries != manifest:
+        # an entry lost to a concurrent writer only means that bundle is opened again.
+        try:
+            with atomic_write.temporary_path(os.path.join(bundle_dir, 'manifest.json')) as tmp, open(tmp, 'w') as f:
+                json.dump(entries, f)
+        except OSError:
+            pass
+    return entries
+
+
+class BundleIndex(object):
+    '''
+    Which bundle holds each (snapnum, subfind_id) of a bundle directory, with the file last
+    read kept open (a history is read bundle by bundle).
+    '''
+    def __init__(self, bundle_dir):
+        self.bundle_dir = bundle_dir
+        self.mtime = None
+        self.files = {}
+        self.base_paths = {}
+        self.path = None
+        self.file = None
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Re-reads the manifest (see update_manifest) if the directory has changed.
+        '''
+        mtime = os.stat(self.bundle_dir).st_mtime
+        if mtime == self.mtime:
+            return
+        self.files = {}
+        self.base_paths = {}
+        for name, entry in sorted(update_manifest(self.bundle_dir).items()):
+            path = os.path.join(self.bundle_dir, name)
+            self.base_paths[path] = entry['basePath']
+            for snapnum, subfind_id in entry['points']:
+                self.files[(snapnum, subfind_id)] = path
+        self.mtime = mtime
+
+    def open(self, basePath, snapnum, subfind_id):
+        '''
+        Open bundle holding a subhalo of the simulation at basePath, or None.
+        '''
+        path = self.files.get((int(snapnum), int(subfind_id)))
+        if path is None or not _same_path(self.base_paths[path], basePath):
+            return None
+        if path != self.path:
+            self.close()
+            self.file = h5py.File(path, 'r')
+            self.path = path
+        return self.file
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.file = None
+        self.path = None
+
+
+_index = None
+# prefetch threads may look up subhalos while the open file is switched.
+_lock = threading.Lock()
+
+
+def _active_index():
+    global _index
+    bundle_dir = os.environ.get(ENV_BUNDLE_DIR)
+    if bundle_dir is None or not os.path.isdir(bundle_dir):
+        return None
+    if _index is None or _index.bundle_dir != bundle_dir:
+        if _index is not None:
+            _index.close()
+        _index = BundleIndex(bundle_dir)
+    return _index
+
+
+def _snapshot(basePath, snapnum, subfind_id):
+    index = _active_index()
+    if index is None:
+        return None
+    f = index.open(basePath, snapnum, subfind_id)
+    if f is None:
+        # bundles may have been exported since the index was read.
+        index.refresh()
+        f = index.open(basePath, snapnum, subfind_id)
+    if f is None:
+        return None
+    return f[_snap_group(snapnum)]
+
+
+def lookup(basePath, snapnum, subfind_id, partType, fields):
+    '''
+    Returns the particles of a subhalo from the active bundles, in the form of
+    snapshot.loadSubhalo ({'count': n, field: array}), or None if no bundle exported from
+    basePath holds this subhalo and all of fields.
+    '''
+    if os.environ.get(ENV_BUNDLE_DIR) is None:
+        return None
+    with _lock:
+        group = _snapshot(basePath, snapnum, subfind_id)
+        name = 'PartType'+str(shared_blocks.part_type_num(partType))
+        if group is None or name not in group:
+            return None
+        particles = group[name]
+        props = {'count': int(particles.attrs['count'])}
+        if props['count'] == 0:
+            return props
+        if any(field not in particles for field in fields):
+            return None
+        with instrumentation.stage('bundle_load', snapnum=int(snapnum)):
+            for field in fields:
+                props[field] = particles[field][()]
+    return props
+
+
+def header(basePath, snapnum, subfind_id):
+    '''
+    Snapshot header values (HEADER_FIELDS) kept with a subhalo's bundle, or None.
+    '''
+    if os.environ.get(ENV_BUNDLE_DIR) is None:
+        return None
+    with _lock:
+        group = _snapshot(basePath, snapnum, subfind_id)
+        if group is None:
+            return None
+        return {name: group.attrs[name] for name in HEADER_FIELDS if name in group.attrs}
+
+
+def load_subhalo(basePath, snapNum, id, partType, fields):
+    '''
+    snapshot.loadSubhalo, reading from the active bundles when they hold the subhalo.
+    '''
+    props = lookup(basePath, snapNum, id, partType, fields)
+    if props is None:
+        return ss.loadSubhalo(basePath, snapNum, id, partType, fields=fields)
+    # a single field is returned as an array, as snapshot.loadSubhalo does.
+    if len(fields) == 1 and props['count'] > 0:
+        return props[fields[0]]
+    return props
+
+
+def load_header(basePath, snapnum, subfind_id):
+    '''
+    header, read from the snapshot when no bundle holds the subhalo.
+    '''
+    values = header(basePath, snapnum, subfind_id)
+    if values is None:
+        with h5py.File(ss.snapPath(basePath, snapnum), 'r') as f:
+            values = {name: f['Header'].attrs[name] for name in HEADER_FIELDS if name in f['Header'].attrs}
+    return values
+
+
+def catalogue(root_subfind, root_snap=99, bundle_dir=None):
+    '''
+    Catalogue rows (CATALOGUE_FIELDS of the tree) of the branch of one root, as a dict of
+    arrays ordered by decreasing SnapNum. bundle_dir defaults to the active one.
+    '''
+    bundle_dir = os.environ.get(ENV_BUNDLE_DIR) if bundle_dir is None else bundle_dir
+    with h5py.File(bundle_path(bundle_dir, root_subfind, root_snap), 'r') as f:
+        return {name: f['catalogue'][name][()] for name in f['catalogue']}
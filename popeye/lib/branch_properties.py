@@ -5,14 +5,21 @@ branch properties - returns a variety of properties along the main branch for a
 import numpy as np
 import groupcat as gc
 import h5py
-from astropy.cosmology import Planck15, z_at_value
+import cosmology
 import pandas as pd
 import bh_luminosity
 import bh_params_subhalo
 import time_conversions
 import cold_gas_fraction
+import kinematic_morphology
+import angular_momentum
+import shared_blocks
+import snapshot as ss
+import instrumentation
+import scheduler
 
-def branch_tabulate(subfind, snapnum, tree, lookback_z, basepath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output'):
+def branch_tabulate(subfind, snapnum, tree, lookback_z, basepath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', n_prefetch=0,
+                    field_dir=None):
     '''
     Function which finds the main branch for a given subhalo (subfind_id, snapnum)
     back to a given redshift (lookback_z).
@@ -23,12 +30,17 @@ def branch_tabulate(subfind, snapnum, tree, lookback_z, basepath='/simons/scratc
     - SFR and gas metallicity
     - black hole propeties: energy growth, mass accreted, local gas density
     - cold gas fraction
+
+    n_prefetch > 0 reads that many particle blocks ahead in the background (see prefetch).
+    field_dir takes the cold phase from the gas_field_cache stores there (see
+    cold_gas_fraction.compute_fraction_set).
     '''
 
-    branch = tree.get_main_branch(snapnum, subfind, keysel=['SubfindID', 'SubhaloMass', 'SubhaloMassType',
-                                                            'SubhaloBHMass', 'SubhaloBHMdot', 'SubhaloGrNr',
-                                                            'SubhaloSFR', 'SubhaloGrNr', 'SubhaloGasMetallicity',
-                                                            'SnapNum'])
+    with instrumentation.stage('tree_read'):
+        branch = tree.get_main_branch(snapnum, subfind, keysel=['SubfindID', 'SubhaloMass', 'SubhaloMassType',
+                                                                'SubhaloBHMass', 'SubhaloBHMdot', 'SubhaloGrNr',
+                                                                'SubhaloSFR', 'SubhaloGrNr', 'SubhaloGasMetallicity',
+                                                                'SubhaloHalfmassRadType', 'SubhaloPos', 'SnapNum'])
 
     # Since branch is constructed from DM only, those halos with zero DM (but stellar comps)
     # may not have ANY branch object.
@@ -46,7 +58,8 @@ def branch_tabulate(subfind, snapnum, tree, lookback_z, basepath='/simons/scratc
 
     # Looping over all subhalos in main branch. Stopping at z limit.
     for i in np.arange(branch.SnapNum[mask].shape[0]):
-        group_info = gc.loadSingle(basepath, branch.SnapNum[i], haloID=branch.SubhaloGrNr[i])
+        with instrumentation.stage('groupcat_load', snapnum=int(branch.SnapNum[i])):
+            group_info = gc.loadSingle(basepath, branch.SnapNum[i], haloID=branch.SubhaloGrNr[i])
         halo_mass = np.append(halo_mass, group_info['GroupMass'])
         # Finding if current subhalo is a central or satellite in current group.
         if branch.SubfindID[i] == group_info['GroupFirstSub']:
@@ -59,37 +72,45 @@ def branch_tabulate(subfind, snapnum, tree, lookback_z, basepath='/simons/scratc
     root_snap = np.full(branch.SnapNum[mask].shape[0], snapnum)
 
     # Converting masses to consistent units.
-    halo_mass = halo_mass * 10**10 * (1/Planck15.h)
-    stel_mass = branch.SubhaloMassType[:,4][mask] * 10**10 * (1/Planck15.h)
-    gas_mass = branch.SubhaloMassType[:,0][mask] * 10**10 * (1/Planck15.h)
-    subhalo_mass = branch.SubhaloMassType[:,1][mask] * 10**10 * (1/Planck15.h)
-    BH_mass = branch.SubhaloBHMass[mask] * 10**10 * (1/Planck15.h)
-    BH_Mdot = branch.SubhaloBHMdot[mask] * 10**10 * (1/Planck15.h)
+    halo_mass = halo_mass * 10**10 * (1/cosmology.h())
+    stel_mass = branch.SubhaloMassType[:,4][mask] * 10**10 * (1/cosmology.h())
+    gas_mass = branch.SubhaloMassType[:,0][mask] * 10**10 * (1/cosmology.h())
+    subhalo_mass = branch.SubhaloMassType[:,1][mask] * 10**10 * (1/cosmology.h())
+    BH_mass = branch.SubhaloBHMass[mask] * 10**10 * (1/cosmology.h())
+    BH_Mdot = branch.SubhaloBHMdot[mask] * 10**10 * (1/cosmology.h())
     
     # Calculating BH_luminosity. This should deal with single floats or np.ndarray formats.
-    log10_Lbh_bol, log10_Lbh_xray = bh_luminosity.compute_luminosity(branch.SubhaloBHMass[mask], branch.SubhaloBHMdot[mask], method=1)
+    with instrumentation.stage('bh_luminosity'):
+        log10_Lbh_bol, log10_Lbh_xray = bh_luminosity.compute_luminosity(branch.SubhaloBHMass[mask], branch.SubhaloBHMdot[mask], method=1)
     
     # returning other black hole properties.
-    BH_CumEgyInjection_QM, BH_CumEgyInjection_RM, BH_CumMassGrowth_QM, BH_CumMassGrowth_RM, BH_Density, BHpart_count, BH_progenitors = bh_params_subhalo.compute_params_branch(branch.SubfindID[mask], branch.SnapNum[mask], basepath)
+    BH_CumEgyInjection_QM, BH_CumEgyInjection_RM, BH_CumMassGrowth_QM, BH_CumMassGrowth_RM, BH_Density, BHpart_count, BH_progenitors = bh_params_subhalo.compute_params_branch(branch.SubfindID[mask], branch.SnapNum[mask], basepath, n_prefetch=n_prefetch)
 	
-    # computing cold gas fraction.
-    gas_fraction = cold_gas_fraction.compute_fraction_set(branch.SubfindID[mask], branch.SnapNum[mask], basePath=basepath)
+    # computing cold gas fraction: cold over total gas mass, both within the stellar half mass
+    # radius (nan where there is no gas within it).
+    cold_gas_mass, gas_mass_inRad = cold_gas_fraction.compute_fraction_set(branch.SubfindID[mask], branch.SnapNum[mask], branch.SubhaloHalfmassRadType[:,4][mask],
+                                                                           branch.SubhaloPos[mask], basePath=basepath, n_prefetch=n_prefetch,
+                                                                           field_dir=field_dir, return_total=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gas_fraction = np.where(gas_mass_inRad > 0, cold_gas_mass / gas_mass_inRad, np.nan)
 	
     # Creating pandas object to output. These are designed to appended to others for other branches.
-    tab = pd.DataFrame({'branch_subfind':branch.SubfindID[mask], 'branch_snapnum':branch.SnapNum[mask],
-                        'root_subfind':root_sub, 'root_snap':root_snap, 'halo_mass':halo_mass, 'subhalo_mass':subhalo_mass,
-                        'central_flag':central_flag, 'stel_mass':stel_mass, 'gas_mass':gas_mass,
-                        'cold_gas_fraction':gas_fraction,
-                        'BH_mass':BH_mass, 'BH_Mdot':BH_Mdot, 'SFR':branch.SubhaloSFR[mask],
-                        'log10_Lbh_bol':log10_Lbh_bol, 'log10_Lbh_xray':log10_Lbh_xray,
-                        'BH_CumEgyInjection_QM':BH_CumEgyInjection_QM, 'BH_CumEgyInjection_RM':BH_CumEgyInjection_RM,
-                        'BH_CumMassGrowth_QM':BH_CumMassGrowth_QM, 'BH_CumMassGrowth_RM':BH_CumMassGrowth_RM,
-                        'BH_local_gas_density':BH_Density, 'BHpart_count':BHpart_count, 'BH_progenitors':BH_progenitors,
-                        'GasMetallicity':branch.SubhaloGasMetallicity[mask], 'branch_z':branch_z[mask]})
+    with instrumentation.stage('dataframe'):
+        tab = pd.DataFrame({'branch_subfind':branch.SubfindID[mask], 'branch_snapnum':branch.SnapNum[mask],
+                            'root_subfind':root_sub, 'root_snap':root_snap, 'halo_mass':halo_mass, 'subhalo_mass':subhalo_mass,
+                            'central_flag':central_flag, 'stel_mass':stel_mass, 'gas_mass':gas_mass,
+                            'cold_gas_fraction':gas_fraction,
+                            'BH_mass':BH_mass, 'BH_Mdot':BH_Mdot, 'SFR':branch.SubhaloSFR[mask],
+                            'log10_Lbh_bol':log10_Lbh_bol, 'log10_Lbh_xray':log10_Lbh_xray,
+                            'BH_CumEgyInjection_QM':BH_CumEgyInjection_QM, 'BH_CumEgyInjection_RM':BH_CumEgyInjection_RM,
+                            'BH_CumMassGrowth_QM':BH_CumMassGrowth_QM, 'BH_CumMassGrowth_RM':BH_CumMassGrowth_RM,
+                            'BH_local_gas_density':BH_Density, 'BHpart_count':BHpart_count, 'BH_progenitors':BH_progenitors,
+                            'GasMetallicity':branch.SubhaloGasMetallicity[mask], 'branch_z':branch_z[mask]})
     return tab
 
 
-def branch_tabulate_gas_only(subfind, snapnum, tree, lookback_z, basepath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output'):
+def branch_tabulate_gas_only(subfind, snapnum, tree, lookback_z, basepath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', n_prefetch=0,
+							 field_dir=None):
 	'''
 	Function which finds the main branch for a given subhalo (subfind_id, snapnum)
 	back to a given redshift (lookback_z).
@@ -97,8 +118,13 @@ def branch_tabulate_gas_only(subfind, snapnum, tree, lookback_z, basepath='/simo
 	Returns a pandas dataframe with:
 	- total gas fraction within 2Re
 	- cold gas fraction within 2Re
+
+	n_prefetch > 0 reads that many gas blocks ahead in the background (see prefetch).
+	field_dir takes the cold phase from the gas_field_cache stores there (see
+	cold_gas_fraction.compute_fraction_set).
 	'''
-	branch = tree.get_main_branch(snapnum, subfind, keysel=['SubfindID', 'SubhaloMassInRadType', 'SubhaloPos', 'SubhaloSFRinRad', 'SubhaloGasMetallicity', 'SnapNum', 'SubhaloHalfmassRadType'])
+	with instrumentation.stage('tree_read'):
+		branch = tree.get_main_branch(snapnum, subfind, keysel=['SubfindID', 'SubhaloMassInRadType', 'SubhaloPos', 'SubhaloSFRinRad', 'SubhaloGasMetallicity', 'SnapNum', 'SubhaloHalfmassRadType'])
 	
 	# Since branch is constructed from DM only, those halos with zero DM (but stellar comps)
 	# may not have ANY branch object.
@@ -115,25 +141,265 @@ def branch_tabulate_gas_only(subfind, snapnum, tree, lookback_z, basepath='/simo
 	root_snap = np.full(branch.SnapNum[mask].shape[0], snapnum)
 
 	# Converting masses to consistent units.
-	stel_mass_2re = branch.SubhaloMassInRadType[:,4][mask] * 10**10 * (1/Planck15.h)
-	gas_mass_2re = branch.SubhaloMassInRadType[:,0][mask] * 10**10 * (1/Planck15.h)
+	stel_mass_2re = branch.SubhaloMassInRadType[:,4][mask] * 10**10 * (1/cosmology.h())
+	gas_mass_2re = branch.SubhaloMassInRadType[:,0][mask] * 10**10 * (1/cosmology.h())
 
 	# computing total gas mass fraction.
 	gas_frac_2re = gas_mass_2re / stel_mass_2re
 
 	# computing cold gas fraction.
 	cold_gas_mass_2re = cold_gas_fraction.compute_fraction_set(branch.SubfindID[mask], branch.SnapNum[mask], branch.SubhaloHalfmassRadType[:,4][mask], 
-															   branch.SubhaloPos[mask], basePath=basepath)
-	cold_gas_mass_2re *= 10**10 * (1/Planck15.h)
+															   branch.SubhaloPos[mask], basePath=basepath, n_prefetch=n_prefetch,
+															   field_dir=field_dir)
+	cold_gas_mass_2re *= 10**10 * (1/cosmology.h())
 
 	# cold gas frac.
 	cold_gas_frac_2re = cold_gas_mass_2re / stel_mass_2re
 
     # Creating pandas object to output. These are designed to appended to others for other branches.
-	tab = pd.DataFrame({'branch_subfind':branch.SubfindID[mask], 'branch_snapnum':branch.SnapNum[mask], 
-						'root_subfind':root_sub, 'root_snap':root_snap, 
-						'stel_mass_2re':stel_mass_2re, 'gas_mass_2re':gas_mass_2re,
-						'gas_frac_2re':gas_frac_2re, 'cold_gas_frac_2re':cold_gas_frac_2re, 
-						'GasMetallicity_2re':branch.SubhaloGasMetallicity[mask], 'branch_z':branch_z[mask]})
+	with instrumentation.stage('dataframe'):
+		tab = pd.DataFrame({'branch_subfind':branch.SubfindID[mask], 'branch_snapnum':branch.SnapNum[mask], 
+							'root_subfind':root_sub, 'root_snap':root_snap, 
+							'stel_mass_2re':stel_mass_2re, 'gas_mass_2re':gas_mass_2re,
+							'gas_frac_2re':gas_frac_2re, 'cold_gas_frac_2re':cold_gas_frac_2re, 
+							'GasMetallicity_2re':branch.SubhaloGasMetallicity[mask], 'branch_z':branch_z[mask]})
 	
-	return tab
\ No newline at end of file
+	return tab
+
+# per-process tree for pool workers (see scheduler.run_scheduled): h5py handles cannot be
+# pickled, so each worker opens the tree once in init_worker.
+_worker_tree = None
+
+def init_worker(treepath):
+    '''
+    Pool initializer opening the SubLink tree in the worker process.
+    '''
+    global _worker_tree
+    import readtreeHDF5
+    _worker_tree = readtreeHDF5.TreeDB(treepath)
+
+
+
+
+def branch_tabulate_morphology(subfind, snapnum, tree, lookback_z, basepath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', n_prefetch=0):
+    '''
+    Function which finds the main branch for a given subhalo (subfind_id, snapnum)
+    back to a given redshift (lookback_z).
+
+    Returns a pandas dataframe with the stellar kinematic morphology at each branch point
+    (see kinematic_morphology):
+    - kappa_rot
+    - disc and bulge fractions from circularities
+    - mass weighted mean circularity
+
+    n_prefetch > 0 reads that many subhalos ahead in the background (see prefetch).
+    '''
+    with instrumentation.stage('tree_read'):
+        branch = tree.get_main_branch(snapnum, subfind, keysel=['SubfindID', 'SnapNum'])
+
+    # Since branch is constructed from DM only, those halos with zero DM (but stellar comps)
+    # may not have ANY branch object.
+    if branch == None:
+        return pd.DataFrame({})
+
+    # Converting snapnums to redshifts
+    branch_z = np.array([time_conversions.snap_to_z(i) for i in branch.SnapNum])
+    # Creating mask for maximum lookback snapnum.
+    mask = (branch_z <= lookback_z)
+
+    morph = kinematic_morphology.compute_morphology_set(branch.SubfindID[mask], branch.SnapNum[mask], basePath=basepath, n_prefetch=n_prefetch)
+
+    with instrumentation.stage('dataframe'):
+        tab = pd.DataFrame({'branch_subfind':branch.SubfindID[mask], 'branch_snapnum':branch.SnapNum[mask],
+                            'root_subfind':np.full(mask.sum(), subfind), 'root_snap':np.full(mask.sum(), snapnum),
+                            'kappa_rot':morph['kappa_rot'], 'disc_fraction':morph['disc_fraction'],
+                            'bulge_fraction':morph['bulge_fraction'], 'mean_circularity':morph['mean_circularity'],
+                            'branch_z':branch_z[mask]})
+    return tab
+
+
+def branch_points(subfinds, snapnum, tree, lookback_z):
+    '''
+    Every main branch point of a set of subhalos (subfind_ids at snapnum) back to a given
+    redshift (lookback_z), as rows of a pandas dataframe with root_subfind, root_snap,
+    branch_subfind, branch_snapnum, rhalf (stellar SubhaloHalfmassRadType), branch_z and
+    progenitor (row of the previous point on the same branch, -1 for the earliest).
+    '''
+    subfinds = np.atleast_1d(subfinds)
+    with instrumentation.stage('tree_read'):
+        branches = [tree.get_main_branch(snapnum, sub, keysel=['SubfindID', 'SnapNum', 'SubhaloHalfmassRadType']) for sub in subfinds]
+
+    points = []
+    n_rows = 0
+    for sub, branch in zip(subfinds, branches):
+        # Since branch is constructed from DM only, those halos with zero DM (but stellar comps)
+        # may not have ANY branch object.
+        if branch == None:
+            continue
+        branch_z = np.array([time_conversions.snap_to_z(i) for i in branch.SnapNum])
+        mask = (branch_z <= lookback_z)
+        n = np.sum(mask)
+        # main branch points are in decreasing snapnum, so the progenitor is the next row.
+        progenitor = np.arange(n_rows + 1, n_rows + n + 1)
+        progenitor[-1:] = -1
+        points.append(pd.DataFrame({'root_subfind':sub, 'root_snap':snapnum, 'branch_subfind':branch.SubfindID[mask],
+                                    'branch_snapnum':branch.SnapNum[mask], 'rhalf':branch.SubhaloHalfmassRadType[:,4][mask],
+                                    'branch_z':branch_z[mask], 'progenitor':progenitor}))
+        n_rows += n
+    if len(points) == 0:
+        return pd.DataFrame({})
+    return pd.concat(points, ignore_index=True)
+
+
+def snapshot_frames(points, basepath, star_fields=kinematic_morphology.STAR_FIELDS, gas_fields=['Coordinates', 'Velocities', 'Masses'],
+                    max_gap=100000, stage='kinematics'):
+    '''
+    Walks the points of branch_points snapshot by snapshot (latest first) rather than root
+    by root: at each snapshot the stars and gas of every point are read together (nearby
+    subhalos in one contiguous read, see shared_blocks.SnapshotBroker), handed over and
+    released before the next snapshot is read.
+
+    Yields (snap, rows, galaxies, a, h), with galaxies[i] = (stars, gas, frame) for
+    points.iloc[rows[i]]: the particles as loaded and the kinematic_morphology.galaxy_frame
+    output (star_pos, star_vel, star_masses, [(gas_pos, gas_vel, gas_masses)]). gas rows are
+    in the same order in both.
+    '''
+    stars_broker = shared_blocks.SnapshotBroker(basepath, 'star', star_fields, max_gap=max_gap, publish=False)
+    gas_broker = shared_blocks.SnapshotBroker(basepath, 'gas', gas_fields, max_gap=max_gap, publish=False)
+    try:
+        for snap in np.unique(points.branch_snapnum.values)[::-1]:
+            rows = np.flatnonzero(points.branch_snapnum.values == snap)
+            subs = points.branch_subfind.values[rows]
+            with instrumentation.stage(stage+'_load', snapnum=int(snap)):
+                stars_broker.acquire(snap, subs)
+                gas_broker.acquire(snap, subs)
+            with h5py.File(ss.snapPath(basepath, snap), 'r') as f:
+                h = f['Header'].attrs['HubbleParam']
+            a = time_conversions.snap_to_scale_factor(snap)
+
+            galaxies = []
+            for sub in subs:
+                stars = stars_broker.subhalo(snap, sub)
+                gas = gas_broker.subhalo(snap, sub)
+                galaxies.append((stars, gas, kinematic_morphology.galaxy_frame(stars, [gas], snap, h)))
+            yield snap, rows, galaxies, a, h
+            del galaxies, stars, gas
+            stars_broker.release(snap)
+            gas_broker.release(snap)
+    finally:
+        stars_broker.close()
+        gas_broker.close()
+
+
+def branch_tabulate_kinematics(subfinds, snapnum, tree, lookback_z, basepath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output',
+                               aperture_rhalf=2, max_gap=100000):
+    '''
+    Star and gas spin vectors and the 3D star-gas misalignment angle along the main branch
+    of a set of subhalos (subfind_ids at snapnum) back to a given redshift (lookback_z).
+
+    The branches are walked snapshot by snapshot rather than root by root (see
+    snapshot_frames).
+
+    Spins are measured within aperture_rhalf stellar half mass radii (SubhaloHalfmassRadType)
+    of the stellar potential minimum, in the stellar CoM frame (see
+    kinematic_morphology.galaxy_frame).
+
+    Returns a pandas dataframe with:
+    - star and gas angular momentum unit vectors (star_Lx ... gas_Lz)
+    - star and gas specific angular momentum magnitudes (kpc km/s)
+    - 3D misalignment angle (degrees)
+    - number of gas cells within the aperture
+    '''
+    points = branch_points(subfinds, snapnum, tree, lookback_z)
+    if len(points) == 0:
+        return pd.DataFrame({})
+
+    columns = ['star_Lx', 'star_Ly', 'star_Lz', 'gas_Lx', 'gas_Ly', 'gas_Lz', 'star_sJ', 'gas_sJ', 'misalignment_3d', 'n_gas']
+    values = np.full((len(points), len(columns)), np.nan)
+
+    for snap, rows, galaxies, a, h in snapshot_frames(points, basepath, max_gap=max_gap):
+        with instrumentation.stage('kinematics', snapnum=int(snap)):
+            for row, (_, _, frame) in zip(rows, galaxies):
+                star_pos, star_vel, star_masses, [(gas_pos, gas_vel, gas_masses)] = frame
+                aperture = aperture_rhalf * points.rhalf.values[row] * a / h
+                star_in = np.linalg.norm(star_pos, axis=1) <= aperture
+                gas_in = np.linalg.norm(gas_pos, axis=1) <= aperture
+                values[row, 9] = np.sum(gas_in)
+                if np.sum(star_in) > 0:
+                    values[row, 6], values[row, 0:3] = angular_momentum.compute_angular_momentum(star_pos[star_in], star_vel[star_in], star_masses[star_in])
+                if np.sum(gas_in) > 0:
+                    values[row, 7], values[row, 3:6] = angular_momentum.compute_angular_momentum(gas_pos[gas_in], gas_vel[gas_in], gas_masses[gas_in])
+                values[row, 8] = np.degrees(np.arccos(np.clip(np.dot(values[row, 0:3], values[row, 3:6]), -1, 1)))
+
+    with instrumentation.stage('dataframe'):
+        tab = points[['branch_subfind', 'branch_snapnum', 'root_subfind', 'root_snap']].copy()
+        for k, column in enumerate(columns):
+            tab[column] = values[:, k]
+        tab['branch_z'] = points.branch_z.values
+    return tab
+
+# branch tabulation function for each catalogue task.
+TABULATE = {'bh': branch_tabulate, 'gas': branch_tabulate_gas_only, 'morphology': branch_tabulate_morphology}
+# tasks which read the cold phase of gas cells (and so take field_dir).
+COLD_GAS_TASKS = ('bh', 'gas')
+
+
+def tabulate_options(task, n_prefetch=0, field_dir=None):
+    '''
+    Keyword arguments of TABULATE[task]: field_dir is only passed to the tasks using it.
+    '''
+    options = {'n_prefetch': n_prefetch}
+    if task in COLD_GAS_TASKS:
+        options['field_dir'] = field_dir
+    return options
+
+
+def tabulate_root(subfind, snapnum, lookback_z, basepath, task='bh', n_prefetch=0, field_dir=None):
+    '''
+    branch_tabulate ('bh'), branch_tabulate_gas_only ('gas') or branch_tabulate_morphology
+    ('morphology') using the tree opened by init_worker.
+    '''
+    return TABULATE[task](subfind, snapnum, _worker_tree, lookback_z, basepath, **tabulate_options(task, n_prefetch, field_dir))
+
+
+def tabulate_roots(subfinds, snapnum, tree, lookback_z, basepath, task='bh', n_prefetch=0, n_workers=1, treepath=None,
+                   memory_budget=64e9, cost_model_path=None, share_parts=None, wave_size=8, field_dir=None):
+    '''
+    Runs TABULATE[task] for every root (subfind_ids at snapnum) and returns the rows of all
+    of them in one dataframe, as the compute_*_branch_properties scripts do.
+
+    With n_workers == 1 the roots run in turn in this process. Otherwise they run in a
+    pool (see scheduler.run_scheduled) whose workers open the tree at treepath, with the
+    cost model read from and saved to cost_model_path (if given). share_parts, a list of
+    (partType, fields), reads those particles into shared memory per wave of wave_size
+    roots (see shared_blocks.RollingBlocks). field_dir is the gas_field_cache directory of
+    the 'bh' and 'gas' tasks (None reads the cold phase from the gas cells).
+    '''
+    roots = [(sub, snapnum) for sub in subfinds]
+    if n_workers <= 1:
+        tabs = []
+        for sub in subfinds:
+            print(sub)
+            with instrumentation.root(sub, snapnum):
+                tabs.append(TABULATE[task](sub, snapnum, tree, lookback_z, basepath, **tabulate_options(task, n_prefetch, field_dir)))
+    else:
+        model = scheduler.CostModel(task) if cost_model_path is None else scheduler.CostModel.load(cost_model_path, task)
+        model.fit()
+        features, points = scheduler.branch_features(tree, roots, lookback_z, return_points=True)
+        blocks = None
+        if share_parts:
+            blocks = shared_blocks.RollingBlocks(basepath, share_parts, points, wave_size=wave_size)
+        try:
+            tabs, errors = scheduler.run_scheduled(tabulate_root, roots, features, model, n_workers=n_workers,
+                                                   memory_budget=memory_budget, blocks=blocks,
+                                                   args=(lookback_z, basepath, task, n_prefetch, field_dir),
+                                                   initializer=init_worker, initargs=(treepath,))
+        finally:
+            if blocks is not None:
+                blocks.close()
+        if cost_model_path is not None:
+            model.save(cost_model_path)
+    tabs = [t for t in tabs if t is not None]
+    if len(tabs) == 0:
+        return pd.DataFrame({})
+    return pd.concat(tabs, ignore_index=True)
@@ -6,6 +6,17 @@ the fraction within
 
 import numpy as np
 import snapshot as ss
+import instrumentation
+import prefetch
+import shared_blocks
+import branch_bundle
+import simulation_registry
+import gas_field_cache
+
+# gas cell fields read by load_gas.
+GAS_FIELDS = ['Coordinates', 'ElectronAbundance', 'StarFormationRate', 'InternalEnergy', 'Masses']
+# gas cell fields read when the cold phase comes from gas_field_cache.
+CACHED_GAS_FIELDS = ['Coordinates', 'Masses']
 
 def radial_pos(cen,sat,blen):
 	'''
@@ -31,7 +42,7 @@ def radial_pos(cen,sat,blen):
 	return delt
 
 
-def compute_fraction_2re(subfind_id, snapnum, radius, centre, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output'):
+def compute_fraction_2re(subfind_id, snapnum, radius, centre, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', field_dir=None):
 	'''
 	Function that returns integrated black hole properties for a given subhalo at a certain
 	snapshot.
@@ -44,8 +55,9 @@ def compute_fraction_2re(subfind_id, snapnum, radius, centre, basePath='/simons/
 		   Snapshot number for object of interest
 	   basePath : str
 		   Base directory for output of TNG simulation.
-	   Tcrit : float
-	       Cutoff to determine cold vs hot gas.
+	   field_dir : str
+	       If given, the cold phase is taken from the gas_field_cache store of snapnum
+	       there (built on first use) and only Coordinates and Masses are read.
 	   
 	   Returns (naming convention follows individual BH particles in TNG)
 	   -------
@@ -53,39 +65,86 @@ def compute_fraction_2re(subfind_id, snapnum, radius, centre, basePath='/simons/
 	       Fraction of gas mass in subhalo that is below temperature threshold.
 	'''
 	
+	if field_dir is None:
+		return cold_mass_from_particles(load_gas(subfind_id, snapnum, basePath), radius, centre)
+	props = load_gas(subfind_id, snapnum, basePath, CACHED_GAS_FIELDS)
+	cold = gas_field_cache.cold_mask(gas_field_cache.load_fields(basePath, snapnum, field_dir).subhalo(subfind_id, 'phase'))
+	return cold_mass_from_particles(props, radius, centre, cold)
+
+
+def load_gas(subfind_id, snapnum, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', fields=GAS_FIELDS):
+	'''
+	Loads the gas cell fields needed by compute_fraction_2re for one subhalo.
+	'''
+	# using a shared block if a broker in the parent process holds this snapshot, then the
+	# root's branch_bundle if one is active.
+	props = shared_blocks.lookup(snapnum, subfind_id, 'gas', fields)
+	if props is not None:
+		return props
+	props = branch_bundle.lookup(basePath, snapnum, subfind_id, 'gas', fields)
+	if props is not None:
+		return props
 	# loading in all gas cells for this subhalo.
-	props = ss.loadSubhalo(basePath=basePath, snapNum=snapnum, id=subfind_id, partType='gas', fields = ['Coordinates', 'ElectronAbundance', 'StarFormationRate', 'InternalEnergy', 'Masses'])
-	
+	with instrumentation.stage('gas_load', snapnum=int(snapnum)):
+		return ss.loadSubhalo(basePath=basePath, snapNum=snapnum, id=subfind_id, partType='gas', fields = fields)
+
+
+def cold_mass_from_particles(props, radius, centre, cold_phase_mask=None, return_total=False):
+	'''
+	compute_fraction_2re on gas cells already loaded with load_gas. If the cold mask of the
+	cells is given (e.g. from gas_field_cache), temperatures are not computed. If
+	return_total, the total gas mass within the same radius is returned as well.
+	'''
 	# if no gas cells, then returning -inf for values.
 	if props['count'] == 0:
-		return -np.inf
+		return (-np.inf, -np.inf) if return_total else -np.inf
 	
 	# making radial selection.
-	pos = radial_pos(centre, props['Coordinates'], 75000)
+	pos = radial_pos(centre, props['Coordinates'], simulation_registry.current().boxsize)
 	radii = np.linalg.norm(pos, axis=1)
 	radial_mask = (radii <= radius)
 	# total mass within radius.
 	gas_mass_total_inRad = np.sum(props['Masses'][radial_mask])
 	
-	# compute gas temperature for all cells
-	Xh = 0.76 # hydrogen mass fraction
-	mp_cgs = 1.6726231 * 10 ** -24 # proton mass in cgs.
-	gamma = 5.0 / 3.0 # adiabatic index
-	kb_cgs = 1.38064852 * 10 ** -16 # boltzmann constant in cgs.
-	
-	mean_molecular_weight = 4 / (1 + 3 * Xh + 4 * Xh * props['ElectronAbundance']) * mp_cgs
-	temp = (gamma - 1) * props['InternalEnergy'] / kb_cgs * 10**10 * mean_molecular_weight
-	
-	# selecting star forming gas or that which meets lower temperature criteria.
-	cold_phase_mask = (props['StarFormationRate'] > 0) | (temp < 10**4.5)
+	if cold_phase_mask is None:
+		# compute gas temperature for all cells
+		with instrumentation.stage('gas_temperature'):
+			temp = gas_field_cache.temperature(props['InternalEnergy'], props['ElectronAbundance'])
+			
+			# selecting star forming gas or that which meets lower temperature criteria.
+			cold_phase_mask = (props['StarFormationRate'] > 0) | (temp < gas_field_cache.T_COLD)
 	# total cold phase within radius
 	gas_mass_cold_inRad = np.sum(props['Masses'][(radial_mask) & (cold_phase_mask)])
 	
+	if return_total:
+		return gas_mass_cold_inRad, gas_mass_total_inRad
 	return gas_mass_cold_inRad
 
 
-def compute_fraction_set(subs, snaps, radii, centres, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output'):
+def compute_fraction_set(subs, snaps, radii, centres, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', n_prefetch=0,
+						 field_dir=None, return_total=False):
 	'''
 	For a set of subfind_ids defined at the corresponding snapshots, run compute_fraction.
+	If n_prefetch > 0, up to n_prefetch gas blocks are read in the background while the
+	current one is processed (see prefetch). If field_dir is given, the cold phase is
+	taken from the per-snapshot gas_field_cache stores there (built on first use), and
+	only Coordinates and Masses are read per subhalo. If return_total, the total gas
+	masses within the same radii are returned as a second array.
 	'''
-	return np.array([compute_fraction_2re(subfind_id, snapnum, radius, centre) for subfind_id, snapnum, radius, centre in zip(subs, snaps, radii, centres)])
\ No newline at end of file
+	fields = GAS_FIELDS if field_dir is None else CACHED_GAS_FIELDS
+	blocks = prefetch.prefetch(lambda sub, snap: load_gas(sub, snap, basePath, fields), zip(subs, snaps), n_prefetch=n_prefetch)
+	stores = {}
+	out = []
+	for ((subfind_id, snapnum), props, error), radius, centre in zip(blocks, radii, centres):
+		if error is not None:
+			raise error
+		cold = None
+		if field_dir is not None:
+			if snapnum not in stores:
+				stores[snapnum] = gas_field_cache.load_fields(basePath, snapnum, field_dir)
+			cold = gas_field_cache.cold_mask(stores[snapnum].subhalo(subfind_id, 'phase'))
+		out.append(cold_mass_from_particles(props, radius, centre, cold, return_total))
+	if return_total:
+		out = np.array(out, dtype=float).reshape(-1, 2)
+		return out[:, 0], out[:, 1]
+	return np.array(out)
@@ -3,17 +3,14 @@ coordinate_transforms - functions that convert code/physical units and box wrap.
 '''
 
 import numpy as np
+import simulation_registry
+import cosmology
 
-# defining planck 15 cosmology. astropy is off for some reason.
-HubbleParam = 0.6774
-OmegaLambda = 0.6911
-Omega0 = 0.3089
+# cosmology (h, Omega0, OmegaLambda) is that of the current simulation, see
+# simulation_registry.
 
 def H(z):
-    term1 = Omega0*(1+z)**3;
-    term2 = (1-Omega0-OmegaLambda)*(1+z)**2;
-    hubz = 100 * HubbleParam * np.sqrt(term1+term2+OmegaLambda)
-    return hubz
+    return cosmology.H(z)
 
 
 def box_wrap(pos_comoving, box_side_length):
@@ -37,7 +34,7 @@ def code_to_physical(pos_comoving, vel_comoving, z):
     ''' This function accepts the code units (ckpc/h for pos) and transforms them to
         physical units including Hubble flow for vel.'''
 
-    pos_physical = pos_comoving * 1 / (1 + z) * 1 / HubbleParam
+    pos_physical = pos_comoving * 1 / (1 + z) * 1 / simulation_registry.current().hubble_param
     vel_peculiar = vel_comoving * 1 / np.sqrt(1 + z)
     vel_physical_total = vel_peculiar + H(z) * pos_physical / 1000
     return pos_physical, vel_physical_total
@@ -50,10 +47,10 @@ def physical_to_code(pos_physical, vel_physical_total, z):
         this will return in code units (i.e. comoving). 
         Make sure that physical pos input are in kpc.'''
 
-    # Using inbuilt astropy function with Planck15 cosmology to calc Hubble parameter.
+    # Hubble parameter of the current simulation's cosmology.
     vel_physical_peculiar = vel_physical_total - H(z) * pos_physical / 1000 
     vel_comoving = vel_physical_peculiar * np.sqrt(1 + z)
-    pos_comoving = pos_physical * (1 + z) * HubbleParam
+    pos_comoving = pos_physical * (1 + z) * simulation_registry.current().hubble_param
     return pos_comoving, vel_comoving
 
 
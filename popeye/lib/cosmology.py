@@ -0,0 +1,62 @@
+'''
+cosmology - the background cosmology popeye needs (h, H(z), cosmic time), for the current
+simulation (see simulation_registry), in plain numpy.
+
+This replaces astropy.cosmology.Planck15, which was only used for h and ages but takes
+about a second to import in every worker process. Ages come from a table of
+t(a) = integral of dln(a) / H(a) (matter, curvature and Lambda; radiation is negligible
+at the redshifts of the snapshots), built once per cosmology and interpolated.
+'''
+
+import numpy as np
+import simulation_registry
+
+# 1 / (km/s/Mpc) in Gyr.
+HUBBLE_TIME_GYR = 977.7922216807892
+
+# age tables by (h, Omega0, OmegaLambda).
+_age_tables = {}
+
+
+def h():
+    '''
+    Hubble parameter h of the current simulation.
+    '''
+    return simulation_registry.current().hubble_param
+
+
+def H(z):
+    '''
+    Hubble rate at redshift z (km/s/Mpc).
+    '''
+    sim = simulation_registry.current()
+    z = np.asarray(z, dtype=float)
+    return 100 * sim.hubble_param * np.sqrt(sim.omega0*(1+z)**3 + (1-sim.omega0-sim.omega_lambda)*(1+z)**2 + sim.omega_lambda)
+
+
+def _age_table(n=4096):
+    sim = simulation_registry.current()
+    key = (sim.hubble_param, sim.omega0, sim.omega_lambda)
+    if key not in _age_tables:
+        ln_a = np.linspace(-20, 0, n)
+        z = np.exp(-ln_a) - 1
+        integrand = HUBBLE_TIME_GYR / H(z)
+        # t(a) ~ a^1.5 during matter domination, which sets the start of the integral.
+        age = np.concatenate([[0], np.cumsum(0.5 * (integrand[1:] + integrand[:-1]) * np.diff(ln_a))]) + integrand[0] / 1.5
+        _age_tables[key] = (ln_a, age)
+    return _age_tables[key]
+
+
+def age(z):
+    '''
+    Age of the universe (Gyr) at redshift z.
+    '''
+    ln_a, table = _age_table()
+    return np.interp(-np.log1p(np.asarray(z, dtype=float)), ln_a, table)
+
+
+def lookback_time(z):
+    '''
+    Lookback time (Gyr) to redshift z.
+    '''
+    return age(0) - age(z)
@@ -0,0 +1,214 @@
+'''
+environment - local environment of branch points from a periodic KD-tree over SubhaloPos.
+
+One scipy cKDTree (boxsize set, so distances wrap across the box) is built per snapshot
+over every subhalo and pickled to a cache directory (a subdirectory per simulation), so
+later runs only load it. All the branch points at a snapshot are then measured with
+batched queries:
+
+    d_N            : distance to the N-th nearest neighbour with stellar mass >= min_mass.
+    n_within_<r>   : number of neighbours with stellar mass >= min_mass within r.
+    d_more_massive : distance to the nearest subhalo with a larger total mass (SubhaloMass).
+
+The subhalo itself is never counted. Distances and radii are physical kpc, masses Msol.
+
+    env = environment.load_environment(basePath, 99, cache_dir)
+    values = environment.measure(env, subfind_ids, n_neighbour=5, radii=[500, 1000])
+'''
+
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import h5py
+from scipy.spatial import cKDTree
+import groupcat as gc
+import snapshot as ss
+import time_conversions
+import branch_properties
+import instrumentation
+import simulation_registry
+import atomic_write
+
+
+class SnapshotEnvironment(object):
+    '''
+    Periodic KD-tree over the subhalos of one snapshot, with their masses.
+
+    Parameters
+    ----------
+    pos : ndarray (n, 3)
+        SubhaloPos (ckpc/h).
+    mass, stellar_mass : ndarray (n)
+        Total and stellar mass (Msol).
+    boxsize : float
+        Box side length (ckpc/h).
+    to_kpc : float
+        a / h, converting distances to physical kpc.
+    '''
+    def __init__(self, pos, mass, stellar_mass, boxsize, to_kpc, tree=None):
+        self.mass = mass
+        self.stellar_mass = stellar_mass
+        self.boxsize = boxsize
+        self.to_kpc = to_kpc
+        self.tree = tree if tree is not None else cKDTree(np.mod(pos, boxsize), boxsize=boxsize)
+        # KD-trees over the subhalos above a stellar mass, by threshold. These are small and
+        # only kept in memory.
+        self._selected = {}
+
+    def __len__(self):
+        return self.mass.shape[0]
+
+    @property
+    def pos(self):
+        return self.tree.data
+
+    def selected(self, min_mass):
+        '''
+        Indices of the subhalos with stellar mass >= min_mass and a KD-tree over them.
+        '''
+        if min_mass not in self._selected:
+            index = np.flatnonzero(self.stellar_mass >= min_mass)
+            self._selected[min_mass] = (index, cKDTree(self.pos[index], boxsize=self.boxsize))
+        return self._selected[min_mass]
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump({'tree': self.tree, 'mass': self.mass, 'stellar_mass': self.stellar_mass,
+                         'boxsize': self.boxsize, 'to_kpc': self.to_kpc}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        return cls(None, saved['mass'], saved['stellar_mass'], saved['boxsize'], saved['to_kpc'], tree=saved['tree'])
+
+
+def build_environment(basePath, snapnum):
+    '''
+    SnapshotEnvironment of every subhalo at snapnum, from the group catalogue.
+    '''
+    with h5py.File(ss.snapPath(basePath, snapnum), 'r') as f:
+        h = f['Header'].attrs['HubbleParam']
+        boxsize = f['Header'].attrs['BoxSize']
+    subs = gc.loadSubhalos(basePath, snapnum, fields=['SubhaloPos', 'SubhaloMass', 'SubhaloMassType'])
+    return SnapshotEnvironment(subs['SubhaloPos'], subs['SubhaloMass'] * 10**10 / h, subs['SubhaloMassType'][:, 4] * 10**10 / h,
+                               boxsize, time_conversions.snap_to_scale_factor(snapnum) / h)
+
+
+def load_environment(basePath, snapnum, cache_dir=None):
+    '''
+    Returns the SnapshotEnvironment at snapnum, from cache_dir if it has been built before,
+    else built and saved there (under a directory per simulation, see
+    simulation_registry.simulation_key).
+    '''
+    path = None
+    if cache_dir is not None:
+        directory = os.path.join(cache_dir, simulation_registry.simulation_key(basePath))
+        path = os.path.join(directory, 'kdtree_'+'%03d' % int(snapnum)+'.pkl')
+        if os.path.exists(path):
+            return SnapshotEnvironment.load(path)
+    env = build_environment(basePath, snapnum)
+    if path is not None:
+        os.makedirs(directory, exist_ok=True)
+        with atomic_write.temporary_path(path) as tmp:
+            env.save(tmp)
+    return env
+
+
+def nearest_more_massive(env, subfind_ids, k=16):
+    '''
+    Distance (physical kpc) from each subhalo to the nearest subhalo of larger total mass,
+    inf if there is none. Neighbours are queried k at a time, doubling k for the subhalos
+    not yet resolved.
+    '''
+    subfind_ids = np.asarray(subfind_ids)
+    dist = np.full(subfind_ids.shape[0], np.inf)
+    todo = np.arange(subfind_ids.shape[0])
+    k = min(k, len(env))
+    while todo.shape[0] > 0:
+        d, i = env.tree.query(env.pos[subfind_ids[todo]], k=k)
+        d, i = d.reshape(todo.shape[0], -1), i.reshape(todo.shape[0], -1)
+        # missing neighbours come back as index len(env).
+        heavier = np.zeros(i.shape, dtype=bool)
+        valid = i < len(env)
+        heavier[valid] = env.mass[i[valid]] > np.repeat(env.mass[subfind_ids[todo]], k).reshape(i.shape)[valid]
+        found = heavier.any(axis=1)
+        dist[todo[found]] = d[found, np.argmax(heavier[found], axis=1)]
+        if k >= len(env):
+            break
+        todo = todo[~found]
+        k = min(2 * k, len(env))
+    return dist * env.to_kpc
+
+
+def measure(env, subfind_ids, n_neighbour=5, radii=[500., 1000., 2000.], min_mass=1e9):
+    '''
+    Environment measures of a set of subhalos at one snapshot, in batched queries.
+
+    Parameters
+    ----------
+    env : SnapshotEnvironment
+    n_neighbour : int
+        N of the N-th nearest neighbour distance.
+    radii : list of float
+        Radii (physical kpc) to count neighbours within.
+    min_mass : float
+        Stellar mass (Msol) above which subhalos count as neighbours.
+
+    Returns
+    -------
+    dict of d_N, n_within_<r> for each r and d_more_massive arrays.
+    '''
+    subfind_ids = np.asarray(subfind_ids)
+    index, tree = env.selected(min_mass)
+    pos = env.pos[subfind_ids]
+    # the subhalo itself is among its own neighbours when it is above min_mass.
+    is_self = np.isin(subfind_ids, index)
+
+    k = min(n_neighbour + 1, index.shape[0])
+    out = {}
+    if k == 0:
+        out['d_N'] = np.full(subfind_ids.shape[0], np.nan)
+    else:
+        d, i = tree.query(pos, k=k)
+        d = d.reshape(subfind_ids.shape[0], -1)
+        column = np.where(is_self, n_neighbour, n_neighbour - 1)
+        out['d_N'] = np.where(column < k, d[np.arange(d.shape[0]), np.minimum(column, k - 1)], np.inf) * env.to_kpc
+    for r in radii:
+        count = tree.query_ball_point(pos, r / env.to_kpc, return_length=True)
+        out['n_within_'+str(int(r))] = count - is_self
+    out['d_more_massive'] = nearest_more_massive(env, subfind_ids)
+    return out
+
+
+def branch_environment(subfinds, snapnum, tree, lookback_z, basepath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output',
+                       cache_dir=None, n_neighbour=5, radii=[500., 1000., 2000.], min_mass=1e9):
+    '''
+    Environment measures (see measure) at every main branch point of a set of subhalos
+    (subfind_ids at snapnum) back to a given redshift (lookback_z). All points at a
+    snapshot are measured with one set of queries on that snapshot's (cached) KD-tree.
+
+    Returns a pandas dataframe with d_N, n_within_<r> and d_more_massive per branch point.
+    '''
+    points = branch_properties.branch_points(subfinds, snapnum, tree, lookback_z)
+    if len(points) == 0:
+        return pd.DataFrame({})
+
+    columns = ['d_N'] + ['n_within_'+str(int(r)) for r in radii] + ['d_more_massive']
+    values = np.full((len(points), len(columns)), np.nan)
+    for snap in np.unique(points.branch_snapnum.values)[::-1]:
+        rows = np.flatnonzero(points.branch_snapnum.values == snap)
+        with instrumentation.stage('environment_load', snapnum=int(snap)):
+            env = load_environment(basepath, snap, cache_dir)
+        with instrumentation.stage('environment', snapnum=int(snap)):
+            out = measure(env, points.branch_subfind.values[rows], n_neighbour, radii, min_mass)
+        for k, column in enumerate(columns):
+            values[rows, k] = out[column]
+
+    with instrumentation.stage('dataframe'):
+        tab = points[['branch_subfind', 'branch_snapnum', 'root_subfind', 'root_snap']].copy()
+        for k, column in enumerate(columns):
+            tab[column] = values[:, k]
+        tab['branch_z'] = points.branch_z.values
+    return tab
@@ -0,0 +1,140 @@
+'''
+gas_field_cache - derived gas cell fields (temperature, phase) for a whole snapshot,
+computed once and kept on disk as memory-mapped arrays in snapshot order.
+
+Temperature needs InternalEnergy and ElectronAbundance, and the cold phase also
+StarFormationRate: three fields read and combined for every subhalo and aperture. Here
+they are read once per snapshot, chunk file by chunk file, and reduced to a float32
+temperature and a uint8 phase label per cell (5 bytes instead of 12). A subhalo's cells
+are then a slice at its snapshot offset, and only the pages touched are read. Stores are
+kept per simulation (cache_dir/<simulation_key>/gas_fields_NNN), so one cache_dir can
+serve several.
+
+    fields = gas_field_cache.load_fields(basePath, 99, cache_dir)
+    cold = fields.subhalo(subfind_id, 'phase') <= gas_field_cache.COLD
+'''
+
+import os
+import numpy as np
+import h5py
+import snapshot as ss
+import instrumentation
+import simulation_registry
+import atomic_write
+
+XH = 0.76 # hydrogen mass fraction
+MP_CGS = 1.6726231 * 10 ** -24 # proton mass in cgs.
+GAMMA = 5.0 / 3.0 # adiabatic index
+KB_CGS = 1.38064852 * 10 ** -16 # boltzmann constant in cgs.
+
+# phase labels: star forming, then non star forming by temperature.
+STAR_FORMING, COLD, WARM, HOT = 0, 1, 2, 3
+# temperature (K) below which gas is cold, and above which it is hot.
+T_COLD = 10**4.5
+T_HOT = 10**6
+
+FIELDS = {'temperature': np.float32, 'phase': np.uint8}
+SOURCE_FIELDS = ['InternalEnergy', 'ElectronAbundance', 'StarFormationRate']
+
+
+def temperature(internal_energy, electron_abundance):
+    '''
+    Gas temperature (K) from InternalEnergy ((km/s)^2) and ElectronAbundance.
+    '''
+    mean_molecular_weight = 4 / (1 + 3 * XH + 4 * XH * electron_abundance) * MP_CGS
+    return (GAMMA - 1) * internal_energy / KB_CGS * 10**10 * mean_molecular_weight
+
+
+def phase(temp, sfr):
+    '''
+    Phase label of every cell: STAR_FORMING where sfr > 0, else COLD, WARM or HOT.
+    '''
+    out = np.full(temp.shape, WARM, dtype=np.uint8)
+    out[temp < T_COLD] = COLD
+    out[temp >= T_HOT] = HOT
+    out[sfr > 0] = STAR_FORMING
+    return out
+
+
+def cold_mask(phases):
+    '''
+    Star forming or cold gas (the cold gas of cold_gas_fraction).
+    '''
+    return phases <= COLD
+
+
+class GasFields(object):
+    '''
+    Derived fields of every gas cell of one snapshot, memory mapped read-only.
+    '''
+    def __init__(self, directory, basePath=None, snapnum=None):
+        self.directory = directory
+        self.basePath = basePath
+        self.snapnum = snapnum
+        self.arrays = {name: np.load(os.path.join(directory, name+'.npy'), mmap_mode='r') for name in FIELDS}
+
+    def __len__(self):
+        return self.arrays['phase'].shape[0]
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def slice(self, start, length, name):
+        return self.arrays[name][start:start + length]
+
+    def subhalo(self, subfind_id, name):
+        '''
+        Field of the gas cells of one subhalo (in the order of snapshot.loadSubhalo).
+        '''
+        offsets = ss.getSnapOffsets(self.basePath, self.snapnum, subfind_id, 'Subhalo')
+        return self.slice(int(offsets['offsetType'][0]), int(offsets['lenType'][0]), name)
+
+
+def _directory(cache_dir, basePath, snapnum):
+    return os.path.join(cache_dir, simulation_registry.simulation_key(basePath), 'gas_fields_'+'%03d' % int(snapnum))
+
+
+def build_fields(basePath, snapnum, directory):
+    '''
+    Computes the derived fields of every gas cell at snapnum, one chunk file at a time,
+    into .npy files in directory.
+    '''
+    with h5py.File(ss.snapPath(basePath, snapnum), 'r') as f:
+        header = dict(f['Header'].attrs.items())
+    n_total = int(ss.getNumPart(header)[0])
+    os.makedirs(directory, exist_ok=True)
+    out = {name: np.lib.format.open_memmap(os.path.join(directory, name+'.npy'), mode='w+', dtype=dtype, shape=(n_total,))
+           for name, dtype in FIELDS.items()}
+    write = 0
+    for chunk in range(int(header['NumFilesPerSnapshot'])):
+        with h5py.File(ss.snapPath(basePath, snapnum, chunk), 'r') as f:
+            if 'PartType0' not in f or f['Header'].attrs['NumPart_ThisFile'][0] == 0:
+                continue
+            gas = {field: f['PartType0'][field][:] for field in SOURCE_FIELDS}
+        n = gas['InternalEnergy'].shape[0]
+        temp = temperature(gas['InternalEnergy'].astype(np.float64), gas['ElectronAbundance'].astype(np.float64))
+        out['temperature'][write:write + n] = temp
+        out['phase'][write:write + n] = phase(temp, gas['StarFormationRate'])
+        write += n
+    for array in out.values():
+        array.flush()
+    if write != n_total:
+        raise ValueError('read '+str(write)+' gas cells at snapshot '+str(snapnum)+', header has '+str(n_total))
+
+
+def load_fields(basePath, snapnum, cache_dir):
+    '''
+    Returns the GasFields of snapnum, from cache_dir if they have been built before, else
+    built and saved there.
+    '''
+    directory = _directory(cache_dir, basePath, snapnum)
+    if not os.path.exists(directory):
+        with instrumentation.stage('gas_fields_build', snapnum=int(snapnum)):
+            try:
+                with atomic_write.temporary_path(directory) as tmp:
+                    build_fields(basePath, snapnum, tmp)
+            except OSError:
+                # another process finished the same snapshot first.
+                if not os.path.exists(directory):
+                    raise
+    return GasFields(directory, basePath, snapnum)
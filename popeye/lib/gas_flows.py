@@ -0,0 +1,227 @@
+'''
+gas_flows - gas inflow, outflow and retained mass (and their angular momentum) along main
+branches, from matching gas between consecutive branch points by ID.
+
+For every branch point and its progenitor, the gas within an aperture around the galaxy
+at both snapshots is compared:
+    retained  : in the aperture at both (mass and J at the later snapshot).
+    inflow    : in the aperture at the later snapshot only.
+    outflow   : in the aperture at the earlier snapshot only, and not turned into one of
+                the galaxy's stars.
+    converted : in the aperture at the earlier snapshot and a star of the galaxy at the
+                later one.
+
+Matching is done in batch for all branch points at a snapshot pair: the aperture gas of
+every point is concatenated with a label (the point), and the earlier and later sets are
+joined with one sorted-ID join (particle_index.match). Only joins with the same label
+count, since a cell belongs to one subhalo per snapshot. Sums per point are np.bincount
+over the labels, so nothing runs per particle in python.
+
+Gas cells are refined and derefined, so cell IDs are not a perfect Lagrangian tag. With
+tracers=True the Monte Carlo tracers (TracerID, ParentID) of each subhalo are used
+instead: every aperture cell passes its mass (split evenly) and velocity on to the tracers
+it holds, and tracers are matched by TracerID.
+'''
+
+import numpy as np
+import pandas as pd
+import particle_index
+import cosmology
+import branch_properties
+import shared_blocks
+import kinematic_morphology
+import instrumentation
+
+GAS_FIELDS = ['ParticleIDs', 'Coordinates', 'Velocities', 'Masses']
+STAR_FIELDS = kinematic_morphology.STAR_FIELDS + ['ParticleIDs']
+TRACER_FIELDS = ['TracerID', 'ParentID']
+
+COLUMNS = ['inflow_mass', 'outflow_mass', 'retained_mass', 'converted_mass', 'inflow_rate', 'outflow_rate',
+           'inflow_jx', 'inflow_jy', 'inflow_jz', 'outflow_jx', 'outflow_jy', 'outflow_jz',
+           'retained_jx', 'retained_jy', 'retained_jz', 'dt']
+
+
+def match_labelled(labels_a, ids_a, labels_b, ids_b):
+    '''
+    Joins two labelled ID sets, with IDs unique within each set: returns boolean masks of
+    the entries of a and of b whose ID is present in the other set with the same label.
+    '''
+    in_a = np.zeros(ids_a.shape[0], dtype=bool)
+    in_b = np.zeros(ids_b.shape[0], dtype=bool)
+    ia, ib = particle_index.match(ids_a, ids_b)
+    same = labels_a[ia] == labels_b[ib]
+    in_a[ia[same]] = True
+    in_b[ib[same]] = True
+    return in_a, in_b
+
+
+def to_tracers(parent_ids, tracer_ids, tracer_parents, weights=None):
+    '''
+    Tracers held by a set of parent cells.
+
+    Parameters
+    ----------
+    parent_ids : ndarray (n)
+        ParticleIDs of the parents.
+    tracer_ids, tracer_parents : ndarray (m)
+        TracerID and ParentID of the candidate tracers.
+    weights : ndarray (n, k)
+        Per-parent quantities split evenly over its tracers (e.g. mass, m r x v).
+
+    Returns
+    -------
+    parent : ndarray (t)
+        Index into parent_ids of the parent of each tracer found.
+    ids : ndarray (t)
+        TracerID of each tracer found.
+    weights : ndarray (t, k)
+        Share of the parent weights (only if weights is given).
+    '''
+    order = np.argsort(tracer_parents, kind='stable')
+    sorted_parents = tracer_parents[order]
+    start = np.searchsorted(sorted_parents, parent_ids, side='left')
+    count = np.searchsorted(sorted_parents, parent_ids, side='right') - start
+    parent = np.repeat(np.arange(parent_ids.shape[0]), count)
+    # position of every tracer in the sorted list: its parent's start plus its rank.
+    rank = np.arange(parent.shape[0]) - np.repeat(np.cumsum(count) - count, count)
+    ids = tracer_ids[order[start[parent] + rank]]
+    if weights is None:
+        return parent, ids
+    return parent, ids, weights[parent] / count[parent][:, None]
+
+
+def _aperture_gas(points, rows, galaxies, a, h, aperture_rhalf, tracers=None):
+    '''
+    Labelled aperture gas (and the labelled IDs of the stars) of the points at one snapshot.
+
+    Returns labels, ids, mass and J (m r x v) of the gas, and star labels and ids. With
+    tracers (list of tracer dicts per row) these are the tracers of the gas and stars.
+    '''
+    labels, ids, weights, star_labels, star_ids = [], [], [], [], []
+    for k, (row, (stars, gas, frame)) in enumerate(zip(rows, galaxies)):
+        _, _, _, [(gas_pos, gas_vel, gas_masses)] = frame
+        if gas_masses is None:
+            # no stars to centre on (see galaxy_frame).
+            gas_pos, gas_vel, gas_masses = np.zeros((0, 3)), np.zeros((0, 3)), np.zeros(0)
+        aperture = aperture_rhalf * points.rhalf.values[row] * a / h
+        gas_in = np.flatnonzero(np.linalg.norm(gas_pos, axis=1) <= aperture)
+        gas_ids = gas['ParticleIDs'][gas_in] if gas['count'] > 0 else np.array([], dtype=np.uint64)
+        gas_weights = np.column_stack([gas_masses[gas_in], gas_masses[gas_in][:, None] * np.cross(gas_pos[gas_in], gas_vel[gas_in])])
+        member_ids = stars['ParticleIDs'] if stars['count'] > 0 else np.array([], dtype=np.uint64)
+
+        if tracers is not None:
+            if tracers[k]['count'] == 0:
+                gas_ids, gas_weights, member_ids = np.array([], dtype=np.uint64), np.zeros((0, 4)), np.array([], dtype=np.uint64)
+            else:
+                _, gas_ids, gas_weights = to_tracers(gas_ids, tracers[k]['TracerID'], tracers[k]['ParentID'], gas_weights)
+                _, member_ids = to_tracers(member_ids, tracers[k]['TracerID'], tracers[k]['ParentID'])
+
+        labels.append(np.full(gas_ids.shape[0], row))
+        ids.append(gas_ids)
+        weights.append(gas_weights)
+        star_labels.append(np.full(member_ids.shape[0], row))
+        star_ids.append(member_ids)
+    return (np.concatenate(labels), np.concatenate(ids), np.concatenate(weights),
+            np.concatenate(star_labels), np.concatenate(star_ids))
+
+
+def branch_gas_flows(subfinds, snapnum, tree, lookback_z, basepath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output',
+                     aperture_rhalf=2, tracers=False, max_gap=100000):
+    '''
+    Gas inflow, outflow and retained mass between every main branch point and its
+    progenitor, for a set of subhalos (subfind_ids at snapnum) back to a given redshift
+    (lookback_z).
+
+    The branches are walked snapshot by snapshot (see branch_properties.snapshot_frames);
+    only the aperture gas of the previous points is kept between snapshots. The aperture
+    is aperture_rhalf stellar half mass radii around the stellar potential minimum, and
+    J is measured in the stellar CoM frame of each snapshot (see
+    kinematic_morphology.galaxy_frame).
+
+    Returns a pandas dataframe with, per branch point (nan at the earliest point):
+    - inflow, outflow, retained and converted (to stars) gas mass (Msol)
+    - inflow and outflow rates (Msol/yr) over the time since the progenitor, dt (Gyr)
+    - specific angular momentum vectors (kpc km/s) of the inflowing, outflowing and
+      retained gas
+    '''
+    points = branch_properties.branch_points(subfinds, snapnum, tree, lookback_z)
+    if len(points) == 0:
+        return pd.DataFrame({})
+
+    # a subhalo shared by several branches is measured once.
+    key = points.branch_snapnum.values.astype(np.int64) * 2**32 + points.branch_subfind.values.astype(np.int64)
+    unique_keys, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    unique = points.iloc[first].reset_index(drop=True)
+    progenitor = points.progenitor.values[first]
+    unique['progenitor'] = np.where(progenitor >= 0, inverse[np.maximum(progenitor, 0)], -1)
+
+    values = np.full((len(unique), len(COLUMNS)), np.nan)
+    age = cosmology.age(unique.branch_z.values)
+    # aperture gas of points waiting for their progenitor, keyed by the progenitor row.
+    pending = {}
+    tracer_broker = shared_blocks.SnapshotBroker(basepath, 'tracers', TRACER_FIELDS, max_gap=max_gap, publish=False) if tracers else None
+    try:
+        for snap, rows, galaxies, a, h in branch_properties.snapshot_frames(unique, basepath, STAR_FIELDS, GAS_FIELDS,
+                                                                            max_gap=max_gap, stage='gas_flows'):
+            tracer_blocks = None
+            if tracers:
+                with instrumentation.stage('gas_flows_load', snapnum=int(snap)):
+                    tracer_broker.acquire(snap, unique.branch_subfind.values[rows])
+                tracer_blocks = [tracer_broker.subhalo(snap, sub) for sub in unique.branch_subfind.values[rows]]
+
+            with instrumentation.stage('gas_flows', snapnum=int(snap)):
+                old = _aperture_gas(unique, rows, galaxies, a, h, aperture_rhalf, tracer_blocks)
+                # the later points whose progenitor is at this snapshot.
+                later = [pending.pop(row) for row in rows if row in pending]
+                if len(later) > 0:
+                    young = [np.concatenate([p[k] for p in later]) for k in range(5)]
+                    done = np.array([p[5] for p in later])
+                    progs = unique.progenitor.values[done]
+                    # joins are on the progenitor row, results are labelled by the later point.
+                    retained, kept = match_labelled(unique.progenitor.values[young[0]], young[1], old[0], old[1])
+                    # cells gone from the aperture but now stars of the same galaxy.
+                    to_stars, _ = match_labelled(old[0], old[1], unique.progenitor.values[young[3]], young[4])
+                    descendant = np.full(len(unique), -1)
+                    descendant[progs] = done
+                    old_labels = descendant[old[0]]
+                    gone = ~kept & ~to_stars & (old_labels >= 0)
+                    to_stars &= ~kept & (old_labels >= 0)
+
+                    n = len(unique)
+                    inflow = [np.bincount(young[0][~retained], young[2][~retained, k], minlength=n)[done] for k in range(4)]
+                    stays = [np.bincount(young[0][retained], young[2][retained, k], minlength=n)[done] for k in range(4)]
+                    outflow = [np.bincount(old_labels[gone], old[2][gone, k], minlength=n)[done] for k in range(4)]
+                    dt = age[done] - age[progs]
+                    values[done, 0] = inflow[0]
+                    values[done, 1] = outflow[0]
+                    values[done, 2] = stays[0]
+                    values[done, 3] = np.bincount(old_labels[to_stars], old[2][to_stars, 0], minlength=n)[done]
+                    values[done, 4] = inflow[0] / (dt * 1e9)
+                    values[done, 5] = outflow[0] / (dt * 1e9)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        for c, flow in zip([6, 9, 12], [inflow, outflow, stays]):
+                            values[done, c:c + 3] = np.column_stack(flow[1:]) / flow[0][:, None]
+                    values[done, 15] = dt
+
+                # this snapshot's gas, for comparison at the progenitor snapshot.
+                for row in rows:
+                    if unique.progenitor.values[row] >= 0:
+                        mine = old[0] == row
+                        stars = old[3] == row
+                        pending[unique.progenitor.values[row]] = (old[0][mine], old[1][mine], old[2][mine],
+                                                                  old[3][stars], old[4][stars], row)
+            del tracer_blocks
+            if tracers:
+                tracer_broker.release(snap)
+    finally:
+        if tracer_broker is not None:
+            tracer_broker.close()
+
+    with instrumentation.stage('dataframe'):
+        tab = points[['branch_subfind', 'branch_snapnum', 'root_subfind', 'root_snap']].copy()
+        tab['prog_snapnum'] = np.where(points.progenitor.values >= 0,
+                                       points.branch_snapnum.values[np.maximum(points.progenitor.values, 0)], -1)
+        for k, column in enumerate(COLUMNS):
+            tab[column] = values[inverse, k]
+        tab['branch_z'] = points.branch_z.values
+    return tab
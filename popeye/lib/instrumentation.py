@@ -0,0 +1,239 @@
+'''
+instrumentation - opt-in per-stage timing and HDF5 read counters for the popeye pipeline.
+
+When enabled, every h5py dataset read is counted (number of reads and bytes returned, by
+indexing or by Dataset.read_direct as snapshot.loadSubset uses) and
+each pipeline stage wrapped in stage() writes one JSON-lines record with its wall/CPU
+time and I/O. Roots wrapped in root() write a record with their totals. When disabled
+(the default) stage() and root() cost a single dictionary lookup.
+
+Usage:
+
+    import instrumentation
+    instrumentation.enable('timing.jsonl')
+    with instrumentation.root(subfind, snapnum):
+        branch_properties.branch_tabulate(...)
+    instrumentation.disable()
+    instrumentation.print_summary('timing.jsonl')
+'''
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import h5py
+
+_state = {'enabled': False, 'log': None, 'root': None, 'original_getitem': None, 'original_read_direct': None}
+_counters = {'reads': 0, 'bytes_read': 0}
+_lock = threading.Lock()
+
+
+def _counting_getitem(self, args, *extra, **kwargs):
+    '''
+    Replacement for h5py.Dataset.__getitem__ which tallies the number of reads and the
+    number of bytes returned before handing back the data.
+    '''
+    out = _state['original_getitem'](self, args, *extra, **kwargs)
+    _count(getattr(out, 'nbytes', 0))
+    return out
+
+
+def _counting_read_direct(self, dest, source_sel=None, dest_sel=None):
+    '''
+    Replacement for h5py.Dataset.read_direct which tallies the read and the bytes of the
+    selected elements.
+    '''
+    _state['original_read_direct'](self, dest, source_sel, dest_sel)
+    if source_sel is None:
+        n = self.size
+    else:
+        # size of the selection, from a zero-stride view of the dataset's shape.
+        shape = np.lib.stride_tricks.as_strided(np.zeros(1, dtype=np.uint8), shape=self.shape, strides=(0,) * len(self.shape))
+        n = shape[source_sel].size
+    _count(n * self.dtype.itemsize)
+
+
+def _count(nbytes):
+    with _lock:
+        _counters['reads'] += 1
+        _counters['bytes_read'] += int(nbytes)
+
+
+def enable(logpath, mode='a'):
+    '''
+    Switches instrumentation on. Records are appended to logpath (JSON lines).
+
+    Parameters
+    ----------
+    logpath : str
+        File to write JSON-lines records to.
+    mode : str
+        File mode. 'a' appends to an existing log (e.g. several slurm jobs), 'w' starts
+        a fresh one.
+    '''
+    if _state['enabled']:
+        disable()
+    _state['log'] = open(logpath, mode)
+    _state['original_getitem'] = h5py.Dataset.__getitem__
+    _state['original_read_direct'] = h5py.Dataset.read_direct
+    h5py.Dataset.__getitem__ = _counting_getitem
+    h5py.Dataset.read_direct = _counting_read_direct
+    _state['enabled'] = True
+
+
+def disable():
+    '''
+    Switches instrumentation off, restoring h5py and closing the log.
+    '''
+    if not _state['enabled']:
+        return
+    h5py.Dataset.__getitem__ = _state['original_getitem']
+    h5py.Dataset.read_direct = _state['original_read_direct']
+    _state['log'].close()
+    _state['log'] = None
+    _state['enabled'] = False
+
+
+def is_enabled():
+    return _state['enabled']
+
+
+def io_counters():
+    '''
+    Returns a copy of the running (reads, bytes_read) counters.
+    '''
+    with _lock:
+        return dict(_counters)
+
+
+def _write(record):
+    with _lock:
+        _state['log'].write(json.dumps(record) + '\n')
+        _state['log'].flush()
+
+
+@contextmanager
+def _measure(record):
+    '''
+    Times the enclosed block and adds wall, cpu, reads and bytes_read to record, which
+    is then written to the log.
+    '''
+    io_start = io_counters()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        io_end = io_counters()
+        record['wall'] = time.perf_counter() - wall_start
+        record['cpu'] = time.process_time() - cpu_start
+        record['reads'] = io_end['reads'] - io_start['reads']
+        record['bytes_read'] = io_end['bytes_read'] - io_start['bytes_read']
+        _write(record)
+
+
+@contextmanager
+def stage(name, **info):
+    '''
+    Context manager wrapping a single pipeline stage (e.g. 'tree_read'). Any keyword
+    arguments (e.g. snapnum) are stored in the record.
+    '''
+    if not _state['enabled']:
+        yield
+        return
+    record = {'type': 'stage', 'stage': name, 'root': _state['root']}
+    record.update(info)
+    with _measure(record):
+        yield
+
+
+@contextmanager
+def root(subfind, snapnum):
+    '''
+    Context manager wrapping all of the work done for a single root (z=0) subhalo. All
+    stage records inside are tagged with this root.
+    '''
+    if not _state['enabled']:
+        yield
+        return
+    previous = _state['root']
+    _state['root'] = [int(subfind), int(snapnum)]
+    record = {'type': 'root', 'root': _state['root']}
+    try:
+        with _measure(record):
+            yield
+    finally:
+        _state['root'] = previous
+
+
+def read_log(logpath):
+    '''
+    Returns the list of records stored in a JSON-lines log.
+    '''
+    with open(logpath) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarise(logpath, n_slowest=10):
+    '''
+    Summarises a log into throughput numbers and the slowest roots.
+
+    Parameters
+    ----------
+    logpath : str
+        JSON-lines file written while enabled.
+    n_slowest : int
+        Number of slowest roots to return.
+
+    Returns
+    -------
+    summary : dict
+        n_roots, total wall time (s), roots_per_hour, MB read, MB_per_s, per-stage totals
+        (wall, cpu, reads, MB, calls, fraction of the root wall time) and the slowest roots.
+    '''
+    records = read_log(logpath)
+    roots = [r for r in records if r['type'] == 'root']
+    stages = [r for r in records if r['type'] == 'stage']
+
+    total_wall = sum(r['wall'] for r in roots)
+    total_bytes = sum(r['bytes_read'] for r in roots)
+
+    per_stage = {}
+    for r in stages:
+        s = per_stage.setdefault(r['stage'], {'wall': 0., 'cpu': 0., 'reads': 0, 'MB': 0., 'calls': 0})
+        s['wall'] += r['wall']
+        s['cpu'] += r['cpu']
+        s['reads'] += r['reads']
+        s['MB'] += r['bytes_read'] / 1e6
+        s['calls'] += 1
+    for s in per_stage.values():
+        s['fraction'] = s['wall'] / total_wall if total_wall > 0 else 0.
+
+    slowest = sorted(roots, key=lambda r: r['wall'], reverse=True)[:n_slowest]
+
+    return {'n_roots': len(roots),
+            'wall': total_wall,
+            'roots_per_hour': 3600 * len(roots) / total_wall if total_wall > 0 else 0.,
+            'MB_read': total_bytes / 1e6,
+            'MB_per_s': total_bytes / 1e6 / total_wall if total_wall > 0 else 0.,
+            'stages': per_stage,
+            'slowest_roots': [(r['root'], r['wall'], r['bytes_read'] / 1e6) for r in slowest]}
+
+
+def print_summary(logpath, n_slowest=10):
+    '''
+    Prints the output of summarise() in a readable form.
+    '''
+    summary = summarise(logpath, n_slowest)
+    print('Roots: '+str(summary['n_roots'])+'  wall: '+str(round(summary['wall'], 1))+' s'
+          +'  roots/hour: '+str(round(summary['roots_per_hour'], 1))
+          +'  read: '+str(round(summary['MB_read'], 1))+' MB ('+str(round(summary['MB_per_s'], 2))+' MB/s)')
+    print('{:<22}{:>10}{:>10}{:>8}{:>10}{:>10}{:>8}'.format('stage', 'wall [s]', 'cpu [s]', 'calls', 'reads', 'MB', 'frac'))
+    for name, s in sorted(summary['stages'].items(), key=lambda x: -x[1]['wall']):
+        print('{:<22}{:>10.2f}{:>10.2f}{:>8d}{:>10d}{:>10.1f}{:>8.2f}'.format(name, s['wall'], s['cpu'], s['calls'], s['reads'], s['MB'], s['fraction']))
+    print('Slowest roots (subfind, snap) : wall [s], MB')
+    for r, wall, mb in summary['slowest_roots']:
+        print('  '+str(tuple(r))+' : '+str(round(wall, 2))+', '+str(round(mb, 1)))
+    return
@@ -0,0 +1,241 @@
+'''
+kinematic_morphology - stellar kinematic morphology indicators: per-particle circularities,
+kappa_rot and disc/bulge mass fractions.
+
+Everything is measured relative to the total stellar angular momentum direction (from
+angular_momentum.compute_angular_momentum). v_circ(r) comes from one radial sort and a
+cumulative mass sum over all particle types (as in fractional_radii.mass_enclosed_radii),
+so a galaxy costs O(N log N).
+
+Definitions:
+    circularity : eps = j_z / (r v_circ(r)), with j_z the specific angular momentum along
+                  the stellar spin axis.
+    kappa_rot   : fraction of kinetic energy in ordered rotation,
+                  sum(m (j_z/R)^2) / sum(m v^2), R the cylindrical radius (Sales+2012).
+    disc_fraction  : stellar mass fraction with eps > 0.7.
+    bulge_fraction : twice the stellar mass fraction with eps < 0 (counter-rotating),
+                     capped at 1.
+'''
+
+import numpy as np
+import angular_momentum
+import coordinate_transforms
+import cold_gas_fraction
+import prefetch
+import instrumentation
+import simulation_registry
+import branch_bundle
+from time_conversions import snap_to_z
+
+# gravitational constant in kpc (km/s)^2 / Msol.
+G = 4.30091e-6
+
+# star particle fields needed by galaxy_frame.
+STAR_FIELDS = ['Coordinates', 'Velocities', 'Masses', 'Potential', 'GFM_StellarFormationTime']
+
+
+def circular_velocity(rad, rad_all, masses_all):
+    '''
+    v_circ(r) = sqrt(G M(<r) / r) at each radius in rad, with M(<r) from one sort of the
+    radii of all particles and a cumulative mass sum (mass at r is included).
+
+    Parameters
+    ----------
+    rad : ndarray (n)
+        Radii (kpc) where v_circ is wanted.
+    rad_all : ndarray (m)
+        Radii (kpc) of all particles contributing to the mass.
+    masses_all : ndarray (m)
+        Masses (Msol).
+
+    Returns
+    -------
+    v_circ : ndarray (n)
+        Circular velocity (km/s).
+    '''
+    order = np.argsort(rad_all)
+    cumulative = np.concatenate([[0], np.cumsum(masses_all[order])])
+    enclosed = cumulative[np.searchsorted(rad_all[order], rad, side='right')]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(G * enclosed / rad)
+
+
+def circularities(pos, vel, masses, pos_all=None, masses_all=None):
+    '''
+    Per-particle circularity eps = j_z / (r v_circ(r)) about the total angular momentum
+    axis of the supplied particles.
+
+    Parameters
+    ----------
+    pos, vel : ndarray (n, 3)
+        Positions (kpc) and velocities (km/s) relative to the galaxy centre and motion.
+    masses : ndarray (n)
+        Masses (Msol).
+    pos_all, masses_all : ndarray (m, 3), (m)
+        Every particle (all types) setting v_circ. Defaults to the supplied particles.
+
+    Returns
+    -------
+    eps : ndarray (n)
+    axis : ndarray (3)
+        Unit spin axis.
+    '''
+    if pos_all is None:
+        pos_all, masses_all = pos, masses
+    _, axis = angular_momentum.compute_angular_momentum(pos, vel, masses)
+    rad = np.linalg.norm(pos, axis=1)
+    v_circ = circular_velocity(rad, np.linalg.norm(pos_all, axis=1), masses_all)
+
+    j_z = np.cross(pos, vel) @ axis
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eps = j_z / (rad * v_circ)
+    eps[~np.isfinite(eps)] = 0
+    return eps, axis
+
+
+def kappa_rot(pos, vel, masses, axis):
+    '''
+    Fraction of kinetic energy in ordered rotation about axis (Sales et al. 2012).
+    '''
+    j_z = np.cross(pos, vel) @ axis
+    R_sq = np.einsum('ij,ij->i', pos, pos) - (pos @ axis)**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rot = np.where(R_sq > 0, j_z**2 / R_sq, 0)
+    return np.sum(masses * rot) / np.sum(masses * np.einsum('ij,ij->i', vel, vel))
+
+
+def compute_morphology(star_pos, star_vel, star_masses, other_pos=None, other_masses=None, r_max=30.):
+    '''
+    Kinematic morphology of a galaxy from its stars (within r_max kpc), with gas and DM
+    (other_pos, other_masses) contributing to v_circ.
+
+    Returns
+    -------
+    dict with kappa_rot, disc_fraction, bulge_fraction, mean_circularity and the
+    circularity of every star used (eps).
+    '''
+    if star_pos.shape[0] == 0:
+        return {'kappa_rot': np.nan, 'disc_fraction': np.nan, 'bulge_fraction': np.nan,
+                'mean_circularity': np.nan, 'eps': np.array([])}
+    if other_pos is None:
+        pos_all, masses_all = star_pos, star_masses
+    else:
+        pos_all = np.concatenate([star_pos, other_pos])
+        masses_all = np.concatenate([star_masses, other_masses])
+
+    inner = np.linalg.norm(star_pos, axis=1) <= r_max
+    pos, vel, masses = star_pos[inner], star_vel[inner], star_masses[inner]
+    eps, axis = circularities(pos, vel, masses, pos_all, masses_all)
+    total = np.sum(masses)
+    return {'kappa_rot': kappa_rot(pos, vel, masses, axis),
+            'disc_fraction': np.sum(masses[eps > 0.7]) / total,
+            'bulge_fraction': min(2 * np.sum(masses[eps < 0]) / total, 1.),
+            'mean_circularity': np.average(eps, weights=masses),
+            'eps': eps}
+
+
+def galaxy_frame(stars, others, snapnum, hubble_param, blen=None):
+    '''
+    Puts particles loaded with snapshot.loadSubhalo into the frame of the galaxy: physical
+    units (kpc, km/s, Msol), relative to the stellar potential minimum and the stellar CoM
+    motion, so that all types share one centre. Wind particles are dropped.
+
+    Parameters
+    ----------
+    stars : dict
+        Star particles with Coordinates, Velocities, Masses, Potential and
+        GFM_StellarFormationTime.
+    others : list of dict
+        Other particle types with Coordinates and optionally Velocities and Masses.
+    snapnum : int
+    hubble_param : float
+    blen : float
+        Box side length (ckpc/h). Defaults to that of the current simulation.
+
+    Returns
+    -------
+    star_pos, star_vel, star_masses : ndarray
+        Empty if there are no (non-wind) stars.
+    others : list of (pos, vel, masses)
+        vel / masses are None where the field was not loaded.
+    '''
+    z = snap_to_z(snapnum)
+    if blen is None:
+        blen = simulation_registry.current().boxsize
+    real = stars['GFM_StellarFormationTime'] > 0 if stars['count'] > 0 else np.array([], dtype=bool)
+    if not np.any(real):
+        return np.zeros((0, 3)), np.zeros((0, 3)), np.zeros(0), [(np.zeros((0, 3)), None, None) for other in others]
+    centre = stars['Coordinates'][np.argmin(np.where(real, stars['Potential'], np.inf))]
+
+    def relative(props, mask=None):
+        # box wrapped offsets from the centre in physical units, with the Hubble flow.
+        coords = props['Coordinates'] if mask is None else props['Coordinates'][mask]
+        pos, hubble = coordinate_transforms.code_to_physical(cold_gas_fraction.radial_pos(centre, coords, blen), np.zeros(coords.shape), z)
+        vel = None
+        if 'Velocities' in props:
+            vel = (props['Velocities'] if mask is None else props['Velocities'][mask]) / np.sqrt(1 + z) + hubble
+        masses = None
+        if 'Masses' in props:
+            masses = (props['Masses'] if mask is None else props['Masses'][mask]) * 1e10 / hubble_param
+        return pos, vel, masses
+
+    star_pos, star_vel, star_masses = relative(stars, real)
+    com_vel = np.average(star_vel, axis=0, weights=star_masses)
+    out = []
+    for other in others:
+        if other['count'] == 0:
+            out.append((np.zeros((0, 3)), np.zeros((0, 3)), np.zeros(0)))
+            continue
+        pos, vel, masses = relative(other)
+        out.append((pos, None if vel is None else vel - com_vel, masses))
+    return star_pos, star_vel - com_vel, star_masses, out
+
+
+def load_morphology_particles(subfind_id, snapnum, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', blen=None):
+    '''
+    Loads stars (no wind particles), gas and DM for one subhalo in the frame of the galaxy
+    (see galaxy_frame).
+
+    Returns
+    -------
+    star_pos, star_vel, star_masses, other_pos, other_masses
+    '''
+    # from the root's branch_bundle if one is active, else from the snapshot.
+    header = branch_bundle.load_header(basePath, snapnum, subfind_id)
+    h = header['HubbleParam']
+    dm_mass = header['MassTable'][1]
+
+    stars = branch_bundle.load_subhalo(basePath, snapnum, subfind_id, 'star', fields=STAR_FIELDS)
+    gas = branch_bundle.load_subhalo(basePath, snapnum, subfind_id, 'gas', fields=['Coordinates', 'Masses'])
+    dm = branch_bundle.load_subhalo(basePath, snapnum, subfind_id, 'DM', fields=['Coordinates'])
+    # a single field is returned as an array, or as {'count': 0} if there are none.
+    if isinstance(dm, np.ndarray):
+        dm = {'count': dm.shape[0], 'Coordinates': dm}
+
+    star_pos, star_vel, star_masses, (gas_frame, dm_frame) = galaxy_frame(stars, [gas, dm], snapnum, h, blen)
+    other_pos = np.concatenate([gas_frame[0], dm_frame[0]])
+    other_masses = np.concatenate([gas_frame[2] if gas_frame[2] is not None else np.zeros(0),
+                                   np.full(dm_frame[0].shape[0], dm_mass * 1e10 / h)])
+    return star_pos, star_vel, star_masses, other_pos, other_masses
+
+
+def compute_morphology_set(subs, snaps, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', n_prefetch=0):
+    '''
+    compute_morphology for a set of (subfind_id, snapnum), e.g. the points of a main
+    branch. Reads ahead n_prefetch subhalos in the background (see prefetch).
+
+    Returns
+    -------
+    dict of kappa_rot, disc_fraction, bulge_fraction, mean_circularity arrays.
+    '''
+    keys = ['kappa_rot', 'disc_fraction', 'bulge_fraction', 'mean_circularity']
+    out = {key: [] for key in keys}
+    blocks = prefetch.prefetch(lambda sub, snap: load_morphology_particles(sub, snap, basePath), zip(subs, snaps), n_prefetch=n_prefetch)
+    for (sub, snap), particles, error in blocks:
+        if error is not None:
+            raise error
+        with instrumentation.stage('morphology', snapnum=int(snap)):
+            morph = compute_morphology(*particles)
+        for key in keys:
+            out[key].append(morph[key])
+    return {key: np.array(values) for key, values in out.items()}
@@ -0,0 +1,193 @@
+'''
+merger_events - every merger along the main branch of many roots at once, from the full
+SubLink tree columns.
+
+branch_tabulate follows the main branch only. Here the secondary progenitors are found as
+well, without walking the tree node by node: in the depth-first SubLink ordering every
+main branch is a contiguous block of rows (SubhaloID .. MainLeafProgenitorID), so all
+main branches are gathered as one index array, and the secondary progenitors of all their
+points are followed through NextProgenitorID with one array step per progenitor rank.
+Tree IDs are turned into rows with one sorted-ID lookup (see particle_index).
+
+The mass ratio is taken at the maximum past stellar mass of each progenitor along its own
+main branch (as in illustris_python.sublink.numMergers), so stripping just before the
+merger does not bias it.
+
+    events = merger_events.merger_events(subfind_ids, 99, treepath, basePath)
+'''
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+import h5py
+import groupcat as gc
+import particle_index
+import cosmology
+import time_conversions
+import instrumentation
+
+# tree columns needed to find the events.
+TREE_FIELDS = ['SubhaloID', 'FirstProgenitorID', 'NextProgenitorID', 'MainLeafProgenitorID',
+               'SnapNum', 'SubfindID', 'SubhaloMassType']
+
+
+def tree_files(treepath, name='tree_extended'):
+    '''
+    SubLink tree files in treepath, ordered by chunk number.
+    '''
+    files = glob.glob(os.path.join(treepath, name+'.*.hdf5'))
+    return sorted(files, key=lambda f: int(f.split('.')[-2]))
+
+
+def load_tree_columns(treepath, rows, fields=TREE_FIELDS, name='tree_extended'):
+    '''
+    Loads whole tree columns, but only from the files holding the given (global) rows.
+    A tree never spans two files, so every progenitor of these rows is included.
+
+    Returns
+    -------
+    columns : dict of ndarray
+        The concatenated columns of the files read.
+    rows : ndarray
+        The input rows, as rows of the returned columns.
+    '''
+    files = tree_files(treepath, name)
+    lengths = []
+    for filename in files:
+        with h5py.File(filename, 'r') as f:
+            lengths.append(f['SubhaloID'].shape[0])
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    file_of = np.searchsorted(offsets, rows, side='right') - 1
+    needed = np.unique(file_of)
+
+    columns = {field: [] for field in fields}
+    for i in needed:
+        with h5py.File(files[i], 'r') as f:
+            for field in fields:
+                columns[field].append(f[field][()])
+    columns = {field: np.concatenate(values) for field, values in columns.items()}
+
+    # position of each needed file in the concatenation.
+    start = np.zeros(len(files), dtype=np.int64)
+    start[needed] = np.concatenate([[0], np.cumsum(np.asarray(lengths)[needed])[:-1]])
+    return columns, start[file_of] + (rows - offsets[file_of])
+
+
+def root_rows(basePath, snapnum, subfind_ids):
+    '''
+    Global SubLink rows of subhalos at snapnum (-1 where not in the tree).
+    '''
+    with h5py.File(gc.offsetPath(basePath, snapnum), 'r') as f:
+        return f['Subhalo/SubLink/RowNum'][()][np.asarray(subfind_ids)].astype(np.int64)
+
+
+def branch_slices(columns, rows):
+    '''
+    Main branch rows of every row in rows, as one index array and the offset of each branch
+    in it (branches run from the row back to its main leaf).
+    '''
+    lengths = columns['MainLeafProgenitorID'][rows] - columns['SubhaloID'][rows] + 1
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    index = np.repeat(rows - offsets[:-1], lengths) + np.arange(offsets[-1])
+    return index, offsets
+
+
+def max_past_mass(columns, rows, ptNum=4):
+    '''
+    Maximum mass of particle type ptNum along the main branch of each row, and the row it
+    is reached at.
+    '''
+    index, offsets = branch_slices(columns, rows)
+    masses = columns['SubhaloMassType'][index, ptNum]
+    peak = np.maximum.reduceat(masses, offsets[:-1])
+    # first row of each branch reaching its peak.
+    branch = np.repeat(np.arange(rows.shape[0]), np.diff(offsets))
+    at_peak = np.flatnonzero(masses == peak[branch])
+    first = np.unique(branch[at_peak], return_index=True)[1]
+    return peak, index[at_peak[first]]
+
+
+def merger_events(subfind_ids, snapnum, treepath, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output',
+                  lookback_z=None, min_ratio=0., name='tree_extended'):
+    '''
+    All mergers on the main branch of a set of subhalos (subfind_ids at snapnum).
+
+    Parameters
+    ----------
+    lookback_z : float
+        Only mergers at snapshots up to this redshift. None = the whole branch.
+    min_ratio : float
+        Only mergers with at least this stellar mass ratio.
+
+    Returns a pandas dataframe with one row per merger (secondary progenitor):
+    - root_subfind, root_snap
+    - snapnum, subfind_id, z : the main branch point the secondary merges into
+    - prim_subfind, sec_subfind, prog_snapnum : the two progenitors
+    - prim_mstar_max, sec_mstar_max : maximum past stellar masses (Msol)
+    - mass_ratio : sec_mstar_max / prim_mstar_max (inverted if > 1)
+    - sec_snap_max : snapshot of the secondary's maximum stellar mass
+    - sec_gas_mass_max, sec_gas_fraction_max : secondary gas mass (Msol) and gas fraction
+      (gas / (gas + stars)) at that snapshot
+    - sec_gas_mass, sec_stel_mass : secondary gas and stellar mass (Msol) at prog_snapnum
+    '''
+    subfind_ids = np.atleast_1d(subfind_ids)
+    rows = root_rows(basePath, snapnum, subfind_ids)
+    in_tree = rows >= 0
+    subfind_ids, rows = subfind_ids[in_tree], rows[in_tree]
+    if rows.shape[0] == 0:
+        return pd.DataFrame({})
+
+    with instrumentation.stage('tree_read'):
+        columns, rows = load_tree_columns(treepath, rows, name=name)
+    to_row = particle_index.ParticleIndex(columns['SubhaloID'])
+
+    with instrumentation.stage('merger_events'):
+        # every main branch point, labelled by its root.
+        main, offsets = branch_slices(columns, rows)
+        root = np.repeat(np.arange(rows.shape[0]), np.diff(offsets))
+
+        # walking NextProgenitorID from the first progenitor of every point at once.
+        prim = to_row.locate(columns['FirstProgenitorID'][main])
+        has_prog = np.flatnonzero(prim >= 0)
+        point, current = has_prog, prim[has_prog]
+        sec_point, sec_row = [], []
+        while current.shape[0] > 0:
+            current = to_row.locate(columns['NextProgenitorID'][current])
+            found = current >= 0
+            point, current = point[found], current[found]
+            sec_point.append(point)
+            sec_row.append(current)
+        if len(sec_point) == 0 or sum(p.shape[0] for p in sec_point) == 0:
+            return pd.DataFrame({})
+        sec_point = np.concatenate(sec_point)
+        sec_row = np.concatenate(sec_row)
+        prim_row = prim[sec_point]
+        desc_row = main[sec_point]
+
+        prim_max, _ = max_past_mass(columns, prim_row)
+        sec_max, sec_peak = max_past_mass(columns, sec_row)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = sec_max / prim_max
+        ratio = np.where(ratio > 1, 1 / ratio, ratio)
+
+    h = cosmology.h()
+    snaps = columns['SnapNum'][desc_row]
+    z = np.array([time_conversions.snap_to_z(s) for s in snaps])
+    gas_peak = columns['SubhaloMassType'][sec_peak, 0]
+    stars_peak = columns['SubhaloMassType'][sec_peak, 4]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gas_fraction = gas_peak / (gas_peak + stars_peak)
+    tab = pd.DataFrame({'root_subfind': subfind_ids[root[sec_point]], 'root_snap': snapnum,
+                        'snapnum': snaps, 'subfind_id': columns['SubfindID'][desc_row], 'z': z,
+                        'prim_subfind': columns['SubfindID'][prim_row], 'sec_subfind': columns['SubfindID'][sec_row],
+                        'prog_snapnum': columns['SnapNum'][sec_row],
+                        'prim_mstar_max': prim_max * 10**10 / h, 'sec_mstar_max': sec_max * 10**10 / h,
+                        'mass_ratio': ratio, 'sec_snap_max': columns['SnapNum'][sec_peak],
+                        'sec_gas_mass_max': gas_peak * 10**10 / h, 'sec_gas_fraction_max': gas_fraction,
+                        'sec_gas_mass': columns['SubhaloMassType'][sec_row, 0] * 10**10 / h,
+                        'sec_stel_mass': columns['SubhaloMassType'][sec_row, 4] * 10**10 / h})
+    keep = ~(tab.mass_ratio.values < min_ratio)
+    if lookback_z is not None:
+        keep &= (z <= lookback_z)
+    return tab[keep].sort_values(['root_subfind', 'snapnum'], ascending=[True, False]).reset_index(drop=True)
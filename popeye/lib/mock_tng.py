@@ -0,0 +1,568 @@
+'''
+mock_tng - writes small-to-large mock TNG-like outputs to local disk so that popeye can be
+exercised without /simons/scratch.
+
+The layout follows the public TNG data release, so the usual snapshot/groupcat readers
+work unchanged on it:
+
+    simdir/output/snapdir_099/snap_099.N.hdf5           (particle chunks)
+    simdir/output/groups_099/fof_subhalo_tab_099.N.hdf5 (group catalogue chunks)
+    simdir/postprocessing/offsets/offsets_099.hdf5      (snapshot + SubLink offsets)
+    simdir/postprocessing/trees/SubLink/tree_extended.0.hdf5
+
+Subhaloes are 'lineages' which exist from the first to last mock snapshot, or until they
+merge into another lineage. Each lineage has a Plummer-like DM halo, a stellar disc and a
+gas disc whose spin can be tilted relative to the stars. ParticleIDs are stable along a
+lineage so that cross-snapshot matching can be tested. Everything is random but fixed by
+the seed. Values are only meant to be plausible, not physical.
+
+Usage:
+
+    import mock_tng
+    basePath = mock_tng.make_mock_simulation('/tmp/mock', n_particles=10**5)
+    tree = mock_tng.MockTreeDB('/tmp/mock/postprocessing/trees/SubLink/')
+'''
+
+import os
+import numpy as np
+import h5py
+import time_conversions
+
+# part type index used for each popeye particle type.
+PARTTYPES = {'gas': 0, 'DM': 1, 'star': 4, 'BH': 5}
+
+# typical gas cell / star particle mass (1e10 Msun/h).
+BARYON_MASS = 1e-4
+
+# catalogue fields that are copied into the SubLink tree.
+TREE_FIELDS = ['SubhaloMass', 'SubhaloMassType', 'SubhaloMassInRadType', 'SubhaloBHMass',
+               'SubhaloBHMdot', 'SubhaloGrNr', 'SubhaloSFR', 'SubhaloSFRinRad',
+               'SubhaloGasMetallicity', 'SubhaloPos', 'SubhaloVel', 'SubhaloHalfmassRadType',
+               'SubhaloLenType']
+
+
+def _build_lineages(n_subhalos, snapnums, merger_rate, rng):
+    '''
+    Builds the merger history. Returns a dict of arrays over lineages: the lineage each one
+    merges into (-1 for survivors), the last snapshot it exists at, the top level lineage it
+    belongs to (for group membership) and its relative size.
+    '''
+    merge_into = list(np.full(n_subhalos, -1))
+    end_snap = list(np.full(n_subhalos, snapnums[-1]))
+    # walking back in time, every active lineage may gain a secondary progenitor.
+    for s in snapnums[::-1][1:]:
+        active = [l for l in range(len(merge_into)) if end_snap[l] > s]
+        for l in active:
+            if rng.uniform() < merger_rate:
+                merge_into.append(l)
+                end_snap.append(s)
+    merge_into = np.array(merge_into)
+    end_snap = np.array(end_snap)
+
+    top = np.arange(merge_into.size)
+    for l in range(merge_into.size):
+        while merge_into[top[l]] != -1:
+            top[l] = merge_into[top[l]]
+
+    # survivors span ~2 dex below the largest subhalo (lineage 0). Secondaries are smaller
+    # than the lineage they merge into.
+    size = np.ones(merge_into.size)
+    size[1:n_subhalos] = 10**(-rng.uniform(1, 3, n_subhalos - 1))
+    for l in range(n_subhalos, merge_into.size):
+        size[l] = size[merge_into[l]] * 10**(-rng.uniform(0, 1.5))
+
+    return {'merge_into': merge_into, 'end_snap': end_snap, 'top': top, 'size': size}
+
+
+def _plummer_radii(n, scale, rng):
+    u = rng.uniform(0.01, 0.99, n)
+    return scale / np.sqrt(u**(-2/3) - 1)
+
+
+def _disc_particles(n, scale, normal, vcirc, sigma, rng):
+    '''
+    Positions and velocities for an exponential disc with a flat rotation curve, rotating
+    around the unit vector normal.
+    '''
+    r = rng.exponential(scale, n)
+    phi = rng.uniform(0, 2 * np.pi, n)
+    z = rng.normal(0, 0.1 * scale, n)
+    pos = np.stack([r * np.cos(phi), r * np.sin(phi), z], axis=1)
+    vel = np.stack([-vcirc * np.sin(phi), vcirc * np.cos(phi), np.zeros(n)], axis=1)
+    vel += rng.normal(0, sigma, (n, 3))
+    rot = _rotation_to(normal)
+    return pos @ rot.T, vel @ rot.T
+
+
+def _rotation_to(normal):
+    '''
+    Rotation matrix taking the z axis onto the unit vector normal.
+    '''
+    z = np.array([0., 0., 1.])
+    v = np.cross(z, normal)
+    c = np.dot(z, normal)
+    if np.linalg.norm(v) < 1e-12:
+        return np.eye(3) if c > 0 else np.diag([1., -1., -1.])
+    vx = np.array([[0, -v[2], v[1]], [v[2], 0, -v[0]], [-v[1], v[0], 0]])
+    return np.eye(3) + vx + vx @ vx / (1 + c)
+
+
+def _random_unit(rng):
+    v = rng.normal(size=3)
+    return v / np.linalg.norm(v)
+
+
+def _subhalo_particles(lin, snapnum, n, centre, props, rng, boxsize):
+    '''
+    Generates all particle types for one lineage at one snapshot.
+    Returns dict parttype -> dict of fields.
+    '''
+    scale = props['scale'][lin]
+    vcirc = props['vcirc'][lin]
+    out = {}
+
+    # IDs are id_base + 1e8 * parttype + index, so they are unique and stable along a lineage.
+    # dark matter: isotropic Plummer sphere.
+    ndm = n['DM']
+    r = _plummer_radii(ndm, 4 * scale, rng)
+    dirs = rng.normal(size=(ndm, 3))
+    dirs /= np.linalg.norm(dirs, axis=1)[:, np.newaxis]
+    pos = dirs * r[:, np.newaxis]
+    out['DM'] = {'Coordinates': pos,
+                 'Velocities': rng.normal(0, vcirc / np.sqrt(3), (ndm, 3)),
+                 'Potential': -vcirc**2 / np.sqrt(1 + (r / (4 * scale))**2),
+                 'ParticleIDs': props['id_base'][lin] + np.uint64(10**8 * PARTTYPES['DM']) + np.arange(ndm, dtype=np.uint64)}
+
+    # stars and gas: discs (gas spin optionally misaligned).
+    for ptype, normal, sigma in [('star', props['star_normal'][lin], 0.3 * vcirc),
+                                 ('gas', props['gas_normal'][lin], 0.1 * vcirc)]:
+        npart = n[ptype]
+        pos, vel = _disc_particles(npart, scale, normal, vcirc, sigma, rng)
+        r = np.linalg.norm(pos, axis=1)
+        out[ptype] = {'Coordinates': pos, 'Velocities': vel,
+                      'Masses': np.full(npart, BARYON_MASS) * rng.uniform(0.5, 1.5, npart),
+                      'Potential': -vcirc**2 / np.sqrt(1 + (r / (4 * scale))**2),
+                      'ParticleIDs': props['id_base'][lin] + np.uint64(10**8 * PARTTYPES[ptype]) + np.arange(npart, dtype=np.uint64)}
+    out['star']['GFM_StellarFormationTime'] = rng.uniform(0.05, time_conversions.snap_to_scale_factor(snapnum), n['star'])
+
+    ngas = n['gas']
+    temp = 10**rng.uniform(3.5, 7, ngas)
+    xe = rng.uniform(0, 1.2, ngas)
+    mu = 4 / (1 + 3 * 0.76 + 4 * 0.76 * xe) * 1.6726231e-24
+    out['gas']['InternalEnergy'] = temp * 1.38064852e-16 / ((5/3 - 1) * 1e10 * mu)
+    out['gas']['ElectronAbundance'] = xe
+    sfr = np.where((temp < 10**4) & (rng.uniform(size=ngas) < 0.5), rng.exponential(1e-3, ngas), 0)
+    out['gas']['StarFormationRate'] = sfr
+    out['gas']['GFM_Metallicity'] = rng.uniform(0.001, 0.03, ngas)
+
+    # black holes: cumulative quantities grow with the scale factor.
+    nbh = n['BH']
+    a = time_conversions.snap_to_scale_factor(snapnum)
+    grow = props['bh_scale'][lin] * a**3
+    out['BH'] = {'Coordinates': rng.normal(0, 0.01 * scale, (nbh, 3)),
+                 'Velocities': rng.normal(0, 1, (nbh, 3)),
+                 'Potential': np.full(nbh, -vcirc**2),
+                 'Masses': np.full(nbh, grow * 1e-3),
+                 'BH_Mass': np.full(nbh, grow * 1e-3),
+                 'BH_Mdot': rng.exponential(1e-4 * grow, nbh),
+                 'BH_CumEgyInjection_QM': np.full(nbh, grow * 1e2),
+                 'BH_CumEgyInjection_RM': np.full(nbh, grow * 1e1 * a**4),
+                 'BH_CumMassGrowth_QM': np.full(nbh, grow * 1e-3),
+                 'BH_CumMassGrowth_RM': np.full(nbh, grow * 1e-4 * a**4),
+                 'BH_Density': rng.exponential(1e-5, nbh),
+                 'BH_Progs': np.full(nbh, props['bh_progs'][lin][snapnum], dtype=np.int32),
+                 'ParticleIDs': props['id_base'][lin] + np.uint64(10**8 * 5) + np.arange(nbh, dtype=np.uint64)}
+
+    # shifting to the subhalo centre and wrapping into the box.
+    for ptype in out:
+        out[ptype]['Coordinates'] = np.mod(out[ptype]['Coordinates'] + centre, boxsize)
+    return out
+
+
+def _chunk_bounds(n, n_chunks, layout, rng):
+    '''
+    Start indices of each file chunk for n particles. 'even' splits evenly, 'random' gives
+    chunks of random sizes (some possibly empty), as in real outputs.
+    '''
+    if layout == 'even':
+        bounds = np.linspace(0, n, n_chunks + 1).astype(np.int64)
+    elif layout == 'random':
+        cuts = np.sort(rng.integers(0, n + 1, n_chunks - 1))
+        bounds = np.concatenate([[0], cuts, [n]]).astype(np.int64)
+    else:
+        raise AssertionError('chunk layout must be even/random')
+    return bounds
+
+
+def make_mock_simulation(simdir, n_subhalos=20, n_particles=10**5, snapnums=np.arange(90, 100),
+                         n_chunks=4, n_group_chunks=2, chunk_layout='even', boxsize=75000.,
+                         merger_rate=0.05, misaligned_fraction=0.3, seed=42):
+    '''
+    Writes a mock TNG-like simulation to simdir and returns the basePath (simdir/output).
+
+    Parameters
+    ----------
+    simdir : str
+        Directory to create the mock in.
+    n_subhalos : int
+        Number of subhaloes surviving to the final snapshot (each one the central of its
+        own FoF group). Secondary progenitors which merge are added on top of these.
+    n_particles : int
+        Number of DM particles in the largest subhalo at the final snapshot. Gas uses the
+        same number and stars half. Other subhaloes are 1-3 dex smaller.
+    snapnums : array_like
+        Snapshot numbers to write (0-99, redshifts follow TNG100).
+    n_chunks : int
+        Number of snapshot file chunks.
+    n_group_chunks : int
+        Number of group catalogue file chunks.
+    chunk_layout : str
+        'even' or 'random' particle split across chunks.
+    boxsize : float
+        Box side length (ckpc/h).
+    merger_rate : float
+        Probability per snapshot that a lineage gains a secondary progenitor.
+    misaligned_fraction : float
+        Fraction of lineages whose gas disc is tilted relative to the stars.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    basePath : str
+    '''
+    rng = np.random.default_rng(seed)
+    snapnums = np.sort(np.asarray(snapnums))
+    basePath = os.path.join(simdir, 'output')
+    offsetdir = os.path.join(simdir, 'postprocessing', 'offsets')
+    treedir = os.path.join(simdir, 'postprocessing', 'trees', 'SubLink')
+    for d in [basePath, offsetdir, treedir]:
+        os.makedirs(d, exist_ok=True)
+
+    lin = _build_lineages(n_subhalos, snapnums, merger_rate, rng)
+    n_lin = lin['size'].size
+    # DM has a fixed mass (1e10 Msun/h), baryons scatter around BARYON_MASS.
+    mass_table = np.array([0., 5e-4, 0., 0., 0., 0.])
+
+    # fixed per-lineage properties.
+    props = {'scale': 2 + 8 * lin['size']**(1/3),
+             'vcirc': 50 + 250 * lin['size']**(1/3),
+             'star_normal': [_random_unit(rng) for l in range(n_lin)],
+             'bh_scale': lin['size'] * rng.uniform(0.5, 2, n_lin),
+             'id_base': np.arange(n_lin, dtype=np.uint64) * np.uint64(10**9) + np.uint64(1)}
+    props['gas_normal'] = []
+    for l in range(n_lin):
+        if rng.uniform() < misaligned_fraction:
+            angle = rng.uniform(np.pi / 6, np.pi)
+            perp = np.cross(props['star_normal'][l], _random_unit(rng))
+            perp /= np.linalg.norm(perp)
+            props['gas_normal'].append(np.cos(angle) * props['star_normal'][l] + np.sin(angle) * perp)
+        else:
+            props['gas_normal'].append(props['star_normal'][l])
+    # number of BH progenitors: grows by one each time a secondary with a BH merges in.
+    props['bh_progs'] = [{s: 1 + np.sum((lin['merge_into'] == l) & (lin['end_snap'] < s)) for s in snapnums} for l in range(n_lin)]
+
+    # centres: top level lineages fixed in the box, secondaries spiral in.
+    top_centre = rng.uniform(0, boxsize, (n_lin, 3))
+    offset_dir = np.array([_random_unit(rng) for l in range(n_lin)])
+
+    # (snapnum -> ordered list of lineages) defines the subfind ids at every snapshot.
+    subfind_of = {}
+    order_of = {}
+    for s in snapnums:
+        alive = np.where(lin['end_snap'] >= s)[0]
+        tops = np.unique(lin['top'][alive])
+        tops = tops[np.argsort(-lin['size'][tops])]
+        order = []
+        for t in tops:
+            members = alive[lin['top'][alive] == t]
+            # central (the top lineage) first, then satellites by size.
+            members = sorted(members, key=lambda l: (l != t, -lin['size'][l]))
+            order.append(members)
+        order_of[s] = order
+        subfind_of[s] = {l: i for i, l in enumerate(np.concatenate(order))}
+
+    cats = {}
+    for s in snapnums:
+        cats[s] = _write_snapshot(basePath, offsetdir, s, order_of[s], lin, props, top_centre, offset_dir,
+                                  n_particles, n_chunks, n_group_chunks, chunk_layout, boxsize, mass_table, rng)
+
+    _write_sublink(treedir, offsetdir, snapnums, lin, subfind_of, cats)
+    return basePath
+
+
+def _write_snapshot(basePath, offsetdir, snapnum, order, lin, props, top_centre, offset_dir,
+                    n_particles, n_chunks, n_group_chunks, chunk_layout, boxsize, mass_table, rng):
+    '''
+    Writes particle chunks, group catalogue chunks and the offsets file for one snapshot.
+    Returns the subhalo catalogue.
+    '''
+    z = time_conversions.snap_to_z(snapnum)
+    a = time_conversions.snap_to_scale_factor(snapnum)
+    growth = 0.5 + 0.5 * a
+    lineages = np.concatenate(order).astype(int)
+    group_of = np.concatenate([np.full(len(members), g) for g, members in enumerate(order)])
+    nsub = lineages.size
+    ngroup = len(order)
+
+    parts = {p: {} for p in PARTTYPES}
+    len_type = np.zeros((nsub, 6), dtype=np.int32)
+    sub_cat = {'SubhaloPos': np.zeros((nsub, 3)), 'SubhaloVel': np.zeros((nsub, 3)),
+               'SubhaloMassType': np.zeros((nsub, 6)), 'SubhaloHalfmassRadType': np.zeros((nsub, 6)),
+               'SubhaloMassInRadType': np.zeros((nsub, 6)), 'SubhaloBHMass': np.zeros(nsub),
+               'SubhaloBHMdot': np.zeros(nsub), 'SubhaloSFR': np.zeros(nsub),
+               'SubhaloSFRinRad': np.zeros(nsub), 'SubhaloGasMetallicity': np.zeros(nsub)}
+
+    for i, l in enumerate(lineages):
+        ndm = max(int(n_particles * lin['size'][l] * growth), 32)
+        n = {'DM': ndm, 'gas': ndm, 'star': max(ndm // 2, 16),
+             'BH': 0 if lin['size'][l] < 3e-3 else (2 if props['bh_progs'][l][snapnum] > 2 else 1)}
+        if lin['merge_into'][l] == -1 or lin['top'][l] == l:
+            centre = top_centre[lin['top'][l]]
+        else:
+            # secondaries approach the central as they near their merger snapshot.
+            dist = 50 * (lin['end_snap'][l] - snapnum + 1)
+            centre = np.mod(top_centre[lin['top'][l]] + dist * offset_dir[l], boxsize)
+        p = _subhalo_particles(l, snapnum, n, centre, props, rng, boxsize)
+
+        for ptype in PARTTYPES:
+            t = PARTTYPES[ptype]
+            len_type[i, t] = n[ptype]
+            for field, values in p[ptype].items():
+                parts[ptype].setdefault(field, []).append(values)
+            if ptype == 'DM':
+                masses = np.full(n[ptype], mass_table[1])
+            else:
+                masses = p[ptype]['Masses']
+            sub_cat['SubhaloMassType'][i, t] = np.sum(masses)
+
+        rel = {pt: np.linalg.norm(p[pt]['Coordinates'] - centre, axis=1) for pt in ['DM', 'gas', 'star']}
+        for pt in ['DM', 'gas', 'star']:
+            sub_cat['SubhaloHalfmassRadType'][i, PARTTYPES[pt]] = np.median(rel[pt])
+        rhalf = sub_cat['SubhaloHalfmassRadType'][i, 4]
+        for pt in ['DM', 'gas', 'star']:
+            m = np.full(n[pt], mass_table[1]) if pt == 'DM' else p[pt]['Masses']
+            sub_cat['SubhaloMassInRadType'][i, PARTTYPES[pt]] = np.sum(m[rel[pt] < 2 * rhalf])
+        sub_cat['SubhaloPos'][i] = centre
+        sub_cat['SubhaloBHMass'][i] = np.sum(p['BH']['BH_Mass'])
+        sub_cat['SubhaloBHMdot'][i] = np.sum(p['BH']['BH_Mdot'])
+        sub_cat['SubhaloSFR'][i] = np.sum(p['gas']['StarFormationRate'])
+        sub_cat['SubhaloSFRinRad'][i] = np.sum(p['gas']['StarFormationRate'][rel['gas'] < 2 * rhalf])
+        sub_cat['SubhaloGasMetallicity'][i] = np.mean(p['gas']['GFM_Metallicity'])
+
+    sub_cat['SubhaloLenType'] = len_type
+    sub_cat['SubhaloLen'] = np.sum(len_type, axis=1)
+    sub_cat['SubhaloMass'] = np.sum(sub_cat['SubhaloMassType'], axis=1)
+    sub_cat['SubhaloGrNr'] = group_of.astype(np.int32)
+    sub_cat['SubhaloParent'] = np.zeros(nsub, dtype=np.int32)
+
+    first_sub = np.concatenate([[0], np.cumsum([len(m) for m in order])[:-1]]).astype(np.int32)
+    group_len_type = np.add.reduceat(len_type, first_sub, axis=0)
+    group_mass_type = np.add.reduceat(sub_cat['SubhaloMassType'], first_sub, axis=0)
+    group_cat = {'GroupFirstSub': first_sub,
+                 'GroupNsubs': np.array([len(m) for m in order], dtype=np.int32),
+                 'GroupLenType': group_len_type.astype(np.int32),
+                 'GroupLen': np.sum(group_len_type, axis=1).astype(np.int32),
+                 'GroupMassType': group_mass_type,
+                 'GroupMass': np.sum(group_mass_type, axis=1),
+                 'GroupPos': sub_cat['SubhaloPos'][first_sub],
+                 'Group_M_Crit200': 0.8 * np.sum(group_mass_type, axis=1)}
+
+    # particles are in subhalo order (no fuzz), so offsets are cumulative lengths.
+    sub_offsets = np.zeros((nsub, 6), dtype=np.int64)
+    sub_offsets[1:] = np.cumsum(len_type, axis=0)[:-1]
+    group_offsets = sub_offsets[first_sub]
+
+    # particle chunks.
+    snapdir = os.path.join(basePath, 'snapdir_%03d' % snapnum)
+    os.makedirs(snapdir, exist_ok=True)
+    n_total = np.sum(len_type, axis=0).astype(np.int64)
+    bounds = {t: _chunk_bounds(n_total[t], n_chunks, chunk_layout, rng) for t in range(6)}
+    for c in range(n_chunks):
+        with h5py.File(os.path.join(snapdir, 'snap_%03d.%d.hdf5' % (snapnum, c)), 'w') as f:
+            n_this = np.array([bounds[t][c + 1] - bounds[t][c] for t in range(6)], dtype=np.int64)
+            header = f.create_group('Header')
+            header.attrs['NumPart_ThisFile'] = n_this.astype(np.int32)
+            header.attrs['NumPart_Total'] = (n_total & 0xffffffff).astype(np.uint32)
+            header.attrs['NumPart_Total_HighWord'] = (n_total >> 32).astype(np.uint32)
+            header.attrs['MassTable'] = mass_table
+            header.attrs['Time'] = a
+            header.attrs['Redshift'] = z
+            header.attrs['BoxSize'] = boxsize
+            header.attrs['NumFilesPerSnapshot'] = n_chunks
+            header.attrs['Omega0'] = 0.3089
+            header.attrs['OmegaLambda'] = 0.6911
+            header.attrs['OmegaBaryon'] = 0.0486
+            header.attrs['HubbleParam'] = 0.6774
+            for ptype, t in PARTTYPES.items():
+                if n_this[t] == 0:
+                    continue
+                g = f.create_group('PartType%d' % t)
+                for field, values in parts[ptype].items():
+                    data = np.concatenate(values)[bounds[t][c]:bounds[t][c + 1]]
+                    if data.dtype == np.float64:
+                        data = data.astype(np.float32)
+                    g.create_dataset(field, data=data)
+
+    # group catalogue chunks.
+    gcdir = os.path.join(basePath, 'groups_%03d' % snapnum)
+    os.makedirs(gcdir, exist_ok=True)
+    group_bounds = np.linspace(0, ngroup, n_group_chunks + 1).astype(np.int64)
+    # subhaloes are split with their parent groups.
+    sub_bounds = np.append(first_sub, nsub)[group_bounds]
+    for c in range(n_group_chunks):
+        with h5py.File(os.path.join(gcdir, 'fof_subhalo_tab_%03d.%d.hdf5' % (snapnum, c)), 'w') as f:
+            header = f.create_group('Header')
+            header.attrs['Ngroups_ThisFile'] = group_bounds[c + 1] - group_bounds[c]
+            header.attrs['Ngroups_Total'] = ngroup
+            header.attrs['Nsubgroups_ThisFile'] = sub_bounds[c + 1] - sub_bounds[c]
+            header.attrs['Nsubgroups_Total'] = nsub
+            header.attrs['NumFiles'] = n_group_chunks
+            header.attrs['Redshift'] = z
+            header.attrs['Time'] = a
+            header.attrs['BoxSize'] = boxsize
+            g = f.create_group('Group')
+            for field, values in group_cat.items():
+                g.create_dataset(field, data=values[group_bounds[c]:group_bounds[c + 1]])
+            g = f.create_group('Subhalo')
+            for field, values in sub_cat.items():
+                g.create_dataset(field, data=values[sub_bounds[c]:sub_bounds[c + 1]])
+
+    with h5py.File(os.path.join(offsetdir, 'offsets_%03d.hdf5' % snapnum), 'w') as f:
+        f.create_dataset('FileOffsets/SnapByType', data=np.stack([bounds[t][:-1] for t in range(6)], axis=1))
+        f.create_dataset('FileOffsets/Group', data=group_bounds[:-1])
+        f.create_dataset('FileOffsets/Subhalo', data=sub_bounds[:-1])
+        f.create_dataset('Subhalo/SnapByType', data=sub_offsets)
+        f.create_dataset('Group/SnapByType', data=group_offsets)
+
+    return sub_cat
+
+
+def _write_sublink(treedir, offsetdir, snapnums, lin, subfind_of, cats):
+    '''
+    Writes a single-file SubLink tree (depth-first ordering, as in the real trees) and adds
+    the Subhalo/SubLink offsets to the offsets files. cats holds the subhalo catalogue
+    written at each snapshot.
+    '''
+    first_snap = snapnums[0]
+
+    # progenitors of (lineage, snap): main progenitor first, then secondaries by size.
+    def progenitors(l, s):
+        if s == first_snap:
+            return []
+        prev = snapnums[np.searchsorted(snapnums, s) - 1]
+        secondaries = np.where((lin['merge_into'] == l) & (lin['end_snap'] == prev))[0]
+        secondaries = secondaries[np.argsort(-lin['size'][secondaries])]
+        return [(l, prev)] + [(m, prev) for m in secondaries]
+
+    rows = []
+    roots = np.where(lin['merge_into'] == -1)[0]
+    for tree_id, r in enumerate(roots):
+        # iterative depth-first walk.
+        stack = [((r, snapnums[-1]), -1)]
+        tree_rows = []
+        while stack:
+            (l, s), desc_row = stack.pop()
+            tree_rows.append({'lineage': l, 'snap': s, 'desc_row': desc_row, 'tree': tree_id})
+            row = len(tree_rows) - 1
+            for node in progenitors(l, s)[::-1]:
+                stack.append((node, row))
+        offset = len(rows)
+        for i, tr in enumerate(tree_rows):
+            tr['row'] = offset + i
+            tr['desc_row'] = offset + tr['desc_row'] if tr['desc_row'] >= 0 else -1
+        rows.extend(tree_rows)
+
+    nrow = len(rows)
+    desc = np.array([r['desc_row'] for r in rows])
+    snap = np.array([r['snap'] for r in rows])
+    subfind = np.array([subfind_of[r['snap']][r['lineage']] for r in rows])
+    tree = np.array([r['tree'] for r in rows])
+
+    first_prog = np.full(nrow, -1)
+    next_prog = np.full(nrow, -1)
+    last_child = {}
+    for i in range(nrow):
+        d = desc[i]
+        if d < 0:
+            continue
+        if first_prog[d] == -1:
+            first_prog[d] = i
+        else:
+            next_prog[last_child[d]] = i
+        last_child[d] = i
+
+    # main leaf: follow first progenitors. last progenitor: end of depth-first subtree.
+    main_leaf = np.arange(nrow)
+    for i in range(nrow - 1, -1, -1):
+        if first_prog[i] != -1:
+            main_leaf[i] = main_leaf[first_prog[i]]
+    last_prog = np.arange(nrow)
+    for i in range(nrow - 1, -1, -1):
+        if next_prog[i] != -1:
+            last_prog[i] = last_prog[next_prog[i]]
+        elif first_prog[i] != -1:
+            last_prog[i] = last_prog[first_prog[i]]
+    root_desc = np.arange(nrow)
+    for i in range(nrow):
+        if desc[i] != -1:
+            root_desc[i] = root_desc[desc[i]]
+
+    ids = np.arange(nrow, dtype=np.int64)
+    with h5py.File(os.path.join(treedir, 'tree_extended.0.hdf5'), 'w') as f:
+        f.create_dataset('SubhaloID', data=ids)
+        f.create_dataset('SubhaloIDRaw', data=snap.astype(np.int64) * 10**12 + subfind)
+        f.create_dataset('DescendantID', data=np.where(desc >= 0, desc, -1).astype(np.int64))
+        f.create_dataset('FirstProgenitorID', data=first_prog.astype(np.int64))
+        f.create_dataset('NextProgenitorID', data=next_prog.astype(np.int64))
+        f.create_dataset('MainLeafProgenitorID', data=main_leaf.astype(np.int64))
+        f.create_dataset('LastProgenitorID', data=last_prog.astype(np.int64))
+        f.create_dataset('RootDescendantID', data=root_desc.astype(np.int64))
+        f.create_dataset('TreeID', data=tree.astype(np.int64))
+        f.create_dataset('SnapNum', data=snap.astype(np.int16))
+        f.create_dataset('SubfindID', data=subfind.astype(np.int32))
+        for field in TREE_FIELDS:
+            f.create_dataset(field, data=np.array([cats[s][field][i] for s, i in zip(snap, subfind)]))
+
+    for s in snapnums:
+        nsub = len(subfind_of[s])
+        rownum = np.full(nsub, -1, dtype=np.int64)
+        sel = snap == s
+        rownum[subfind[sel]] = np.where(sel)[0]
+        with h5py.File(os.path.join(offsetdir, 'offsets_%03d.hdf5' % s), 'a') as f:
+            f.create_dataset('FileOffsets/SubLink', data=np.array([0], dtype=np.int64))
+            f.create_dataset('Subhalo/SubLink/RowNum', data=rownum)
+            f.create_dataset('Subhalo/SubLink/SubhaloID', data=np.where(rownum >= 0, ids[rownum], -1))
+            f.create_dataset('Subhalo/SubLink/LastProgenitorID', data=np.where(rownum >= 0, last_prog[rownum], -1))
+
+
+class MockBranch(object):
+    '''
+    Main branch returned by MockTreeDB.get_main_branch. One attribute per requested field,
+    ordered from the root backwards in time (as readtreeHDF5).
+    '''
+    def __init__(self, fields):
+        for key, values in fields.items():
+            setattr(self, key, values)
+
+
+class MockTreeDB(object):
+    '''
+    Minimal stand-in for readtreeHDF5.TreeDB reading a SubLink tree in the public format.
+    Only get_main_branch is provided.
+    '''
+    def __init__(self, treedir, name='tree_extended'):
+        self.treedir = treedir
+        self.offsetdir = os.path.join(treedir, '..', '..', 'offsets')
+        self.filename = os.path.join(treedir, name + '.0.hdf5')
+
+    def get_main_branch(self, snapnum, subfind_id, keysel=None):
+        with h5py.File(os.path.join(self.offsetdir, 'offsets_%03d.hdf5' % snapnum), 'r') as f:
+            row = f['Subhalo/SubLink/RowNum'][subfind_id]
+        if row < 0:
+            return None
+        with h5py.File(self.filename, 'r') as f:
+            end = row + f['MainLeafProgenitorID'][row] - f['SubhaloID'][row] + 1
+            if keysel is None:
+                keysel = list(f.keys())
+            return MockBranch({key: f[key][row:end] for key in keysel})
@@ -0,0 +1,135 @@
+'''
+particle_index - sorted ParticleIDs indexes for matching particles between snapshots.
+
+A ParticleIndex holds the IDs of one particle type at one snapshot in sorted order, with
+each ID's position in snapshot order. Looking up any set of IDs is then one
+np.searchsorted (O(M log N)) instead of a per-particle search. Indexes are cached on disk
+as compact .npz files (uint64 IDs, int32 positions where they fit), so they are built
+once per snapshot and type, under a directory per simulation
+(cache_dir/<simulation_key>/ids_<type>_NNN.npz).
+
+    index = particle_index.load_index(basePath, 99, 'BH', cache_dir)
+    pos = index.locate(other_ids)    # snapshot-order position, -1 where missing
+'''
+
+import os
+import numpy as np
+import h5py
+import snapshot as ss
+import groupcat as gc
+import simulation_registry
+import atomic_write
+
+
+class ParticleIndex(object):
+    '''
+    Sorted ID index of one particle type at one snapshot.
+
+    Parameters
+    ----------
+    ids : ndarray (n)
+        ParticleIDs in snapshot order.
+    '''
+    def __init__(self, ids=None, sorted_ids=None, order=None):
+        if ids is not None:
+            ids = np.asarray(ids)
+            order = np.argsort(ids, kind='stable')
+            sorted_ids = ids[order]
+            # positions fit in int32 for anything below 2^31 particles.
+            order = order.astype(np.int32 if ids.shape[0] < 2**31 else np.int64)
+        self.sorted_ids = sorted_ids
+        self.order = order
+
+    def __len__(self):
+        return self.sorted_ids.shape[0]
+
+    def locate(self, ids):
+        '''
+        Returns the snapshot-order position of every ID in ids, -1 where it is not present.
+        '''
+        ids = np.asarray(ids, dtype=self.sorted_ids.dtype)
+        if len(self) == 0:
+            return np.full(ids.shape[0], -1, dtype=np.int64)
+        where = np.searchsorted(self.sorted_ids, ids)
+        where = np.minimum(where, len(self) - 1)
+        found = self.sorted_ids[where] == ids
+        return np.where(found, self.order[where], -1).astype(np.int64)
+
+    def contains(self, ids):
+        return self.locate(ids) >= 0
+
+    def save(self, path):
+        np.savez(path, sorted_ids=self.sorted_ids, order=self.order)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(sorted_ids=f['sorted_ids'], order=f['order'])
+
+
+def load_ids(basePath, snapnum, partType):
+    '''
+    ParticleIDs of every particle of partType in the snapshot (empty if there are none).
+    '''
+    ids = ss.loadSubset(basePath, snapnum, partType, fields=['ParticleIDs'])
+    # a single field comes back as an array, or {'count': 0} if there are no particles.
+    if isinstance(ids, dict):
+        return np.array([], dtype=np.uint64)
+    return ids
+
+
+def load_index(basePath, snapnum, partType, cache_dir=None, ids=None):
+    '''
+    Returns the ParticleIndex of partType at snapnum, from cache_dir if it has been built
+    before, else built (from ids if given, otherwise read from the snapshot) and saved.
+    '''
+    path = None
+    if cache_dir is not None:
+        directory = os.path.join(cache_dir, simulation_registry.simulation_key(basePath))
+        path = os.path.join(directory, 'ids_'+str(partType)+'_'+'%03d' % int(snapnum)+'.npz')
+        if os.path.exists(path):
+            return ParticleIndex.load(path)
+    if ids is None:
+        ids = load_ids(basePath, snapnum, partType)
+    index = ParticleIndex(ids)
+    if path is not None:
+        os.makedirs(directory, exist_ok=True)
+        # np.savez adds .npz to names without it.
+        with atomic_write.temporary_path(path, suffix='.npz') as tmp:
+            index.save(tmp)
+    return index
+
+
+def match(ids_a, ids_b):
+    '''
+    Joins two ID arrays: returns (ia, ib) such that ids_a[ia] == ids_b[ib] for every ID
+    present in both (in the order of ids_a).
+    '''
+    ib = ParticleIndex(ids_b).locate(ids_a)
+    ia = np.flatnonzero(ib >= 0)
+    return ia, ib[ia]
+
+
+def host_subhalos(basePath, snapnum, partType, positions):
+    '''
+    Subfind ID of the subhalo holding each particle, from its position in snapshot order
+    (as from ParticleIndex.locate), using the subhalo offsets and lengths. -1 for particles
+    outside any subhalo (fuzz, or not found).
+    '''
+    ptNum = ss.partTypeNum(partType)
+    positions = np.asarray(positions, dtype=np.int64)
+    lengths = gc.loadSubhalos(basePath, snapnum, fields=['SubhaloLenType'])
+    # a single field comes back as an array, or {'count': 0} if there are no subhalos.
+    if isinstance(lengths, dict):
+        return np.full(positions.shape, -1, dtype=np.int64)
+    lengths = lengths[:, ptNum].astype(np.int64)
+    with h5py.File(gc.offsetPath(basePath, snapnum), 'r') as f:
+        offsets = f['Subhalo/SnapByType'][:, ptNum].astype(np.int64)
+
+    # only subhalos holding particles of this type (in increasing offset) can be hosts.
+    occupied = np.flatnonzero(lengths > 0)
+    if occupied.shape[0] == 0:
+        return np.full(positions.shape, -1, dtype=np.int64)
+    k = np.maximum(np.searchsorted(offsets[occupied], positions, side='right') - 1, 0)
+    inside = (positions >= offsets[occupied][k]) & (positions < offsets[occupied][k] + lengths[occupied][k])
+    return np.where(inside, occupied[k], -1)
@@ -0,0 +1,95 @@
+'''
+prefetch - overlaps particle reads with computation using a bounded background queue.
+
+prefetch() wraps a loading function and a list of items (e.g. (subfind_id, snapnum)
+pairs). Up to n_prefetch items are read ahead by a small thread pool while the caller works
+on the current one. Loaded-but-unused data is capped at max_bytes: no new read is started
+while the blocks waiting in the queue exceed it (one read is always allowed so the pipeline
+cannot stall).
+
+h5py serialises calls into the HDF5 library, so extra threads do not read in parallel;
+the gain comes from the filesystem latency of the next read being hidden behind the
+numpy work on the current block. On latency-bound network filesystems this is roughly a
+factor of two when read and compute times are similar.
+'''
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+def nbytes(obj):
+    '''
+    Approximate memory held by a loaded block: sums ndarray sizes in (nested) dicts,
+    tuples and lists.
+    '''
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(nbytes(v) for v in obj.values())
+    if isinstance(obj, (tuple, list)):
+        return sum(nbytes(v) for v in obj)
+    return 0
+
+
+def _load_wrapped(load, item):
+    # unpacking tuples so that load can take (subfind_id, snapnum) as two arguments.
+    try:
+        if isinstance(item, tuple):
+            return load(*item), None
+        return load(item), None
+    except Exception as e:
+        return None, e
+
+
+def prefetch(load, items, n_prefetch=4, n_threads=1, max_bytes=4*1024**3):
+    '''
+    Generator yielding (item, data, error) in the order of items, where data = load(item)
+    has been read in the background. If load raised, data is None and error holds the
+    exception, so the caller can decide to skip (as the scripts do) or re-raise.
+
+    Parameters
+    ----------
+    load : callable
+        Function reading one block. Tuple items are unpacked into its arguments.
+    items : iterable
+        Items to load, e.g. zip(subfind_ids, snapnums).
+    n_prefetch : int
+        Maximum number of blocks loaded (or loading) ahead of the consumer. 0 disables
+        the background reads and loads in turn.
+    n_threads : int
+        Reader threads.
+    max_bytes : float
+        Memory budget for blocks waiting in the queue.
+
+    Returns
+    -------
+    generator of (item, data, error)
+    '''
+    items = iter(items)
+
+    if n_prefetch <= 0:
+        for item in items:
+            data, error = _load_wrapped(load, item)
+            yield item, data, error
+        return
+
+    queue = collections.deque()
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        while True:
+            # bytes held by blocks which have finished loading and are waiting to be used.
+            waiting = sum(nbytes(f.result()[0]) for _, f in queue if f.done())
+            while not exhausted and len(queue) < n_prefetch and (len(queue) == 0 or waiting < max_bytes):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                queue.append((item, pool.submit(_load_wrapped, load, item)))
+
+            if not queue:
+                return
+            item, future = queue.popleft()
+            data, error = future.result()
+            yield item, data, error
@@ -6,12 +6,12 @@ Chris Duckworth cduckastro@gmail.com
 '''
 
 import numpy as np
-from astropy.cosmology import Planck15
 from time_conversions import snap_to_z
-import snapshot as ss
 import coordinate_transforms 
+import simulation_registry
+import branch_bundle
 
-def load_particles_transform_relative(subfind_id, snapnum, parttype, com=False, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', blen=75000):
+def load_particles_transform_relative(subfind_id, snapnum, parttype, com=False, basePath='/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output', blen=None):
     '''Given a suhhalo ID and snapshot, this function returns all of the particles of 
        a certain type. The coordinates returned are box wrapped in code units and then 
        transformed into physical units. Finally the positions and velocities are then      
@@ -28,6 +28,8 @@ def load_particles_transform_relative(subfind_id, snapnum, parttype, com=False,
            DM/star/gas particle type
        com : bool
            True/False as to whether to define centre using particle's centre of mass.
+       blen : float
+           Box side length (ckpc/h). Defaults to that of the current simulation.
            
        Returns
        -------
@@ -42,10 +44,12 @@ def load_particles_transform_relative(subfind_id, snapnum, parttype, com=False,
     
     # Finding redshift for a given snapshot.
     z = snap_to_z(snapnum)
+    if blen is None:
+        blen = simulation_registry.current().boxsize
     
     # Loading particles of given type.
     if parttype == 'DM':
-        props = ss.loadSubhalo(basePath=basePath, snapNum=snapnum, id=subfind_id, partType=parttype, fields = ['Coordinates', 'Velocities', 'Potential'])
+        props = branch_bundle.load_subhalo(basePath=basePath, snapNum=snapnum, id=subfind_id, partType=parttype, fields = ['Coordinates', 'Velocities', 'Potential'])
         # wrapping particle coordinates.
         pos_code = coordinate_transforms.box_wrap(props['Coordinates'], blen)
         # transforming to physical coordinates.
@@ -60,7 +64,7 @@ def load_particles_transform_relative(subfind_id, snapnum, parttype, com=False,
             raise AssertionError ('com param must be boolean float')
     
     elif (parttype == 'star') | (parttype == 'gas'):
-        props = ss.loadSubhalo(basePath=basePath, snapNum=snapnum, id=subfind_id, partType=parttype, fields = ['Coordinates', 'Velocities', 'Potential', 'Masses'])
+        props = branch_bundle.load_subhalo(basePath=basePath, snapNum=snapnum, id=subfind_id, partType=parttype, fields = ['Coordinates', 'Velocities', 'Potential', 'Masses'])
         # wrapping particle coordinates.
         pos_code = coordinate_transforms.box_wrap(props['Coordinates'], blen)
         # transforming to physical coordinates.
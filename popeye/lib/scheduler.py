@@ -0,0 +1,271 @@
+'''
+scheduler - cost-model and memory-aware scheduling of roots.
+
+Subhalo sizes span orders of magnitude, so running roots in catalogue order across a pool
+leaves workers idle behind one cluster-mass halo, or runs out of memory when two giants
+run together. This module:
+
+- estimates each root's cost (seconds) and peak memory (bytes) from SubhaloLenType along
+  its main branch (CostModel.features / estimate),
+- runs roots longest-first in a process pool, only starting a task while the summed
+  memory estimate of running tasks (and of the shared blocks they use, see
+  shared_blocks.RollingBlocks) fits the budget (run_scheduled),
+- records the measured wall time and peak allocation of every task, so CostModel.fit()
+  can refine the coefficients for later runs (CostModel.save / load).
+'''
+
+import os
+import json
+import time
+import tracemalloc
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# particle types in SubhaloLenType used as features: gas, DM, stars, BH.
+FEATURE_TYPES = [0, 1, 4, 5]
+FEATURE_NAMES = ['n_snaps', 'n_gas', 'n_DM', 'n_star', 'n_BH']
+
+# starting coefficients before any run has been recorded.
+# cost: seconds per branch point and per particle of each type read along the branch.
+# memory: bytes per particle at the largest branch point (loaded fields + temporaries).
+DEFAULT_COEFFS = {
+    'bh': {'cost': [0.05, 2e-7, 0., 0., 1e-5], 'memory': [0., 120., 0., 0., 200.]},
+    'gas': {'cost': [0.03, 2e-7, 0., 0., 0.], 'memory': [0., 120., 0., 0., 0.]},
+    'anisotropy': {'cost': [0.05, 0., 5e-7, 5e-7, 0.], 'memory': [0., 0., 250., 250., 0.]},
+    'morphology': {'cost': [0.05, 2e-7, 2e-7, 5e-7, 0.], 'memory': [0., 80., 80., 250., 0.]},
+    'kinematics': {'cost': [0.05, 2e-7, 0., 3e-7, 0.], 'memory': [0., 150., 0., 250., 0.]},
+    'flows': {'cost': [0.05, 4e-7, 0., 3e-7, 0.], 'memory': [0., 300., 0., 260., 0.]},
+}
+
+
+class CostModel(object):
+    '''
+    Linear model of cost and peak memory for a task (a key of DEFAULT_COEFFS) in terms
+    of the branch features [n_snaps, n_gas, n_DM, n_star, n_BH]. Cost uses the features
+    summed along the branch, memory the features of the largest branch point.
+    '''
+    def __init__(self, task='bh', base_memory=200e6):
+        self.task = task
+        self.cost_coeffs = np.array(DEFAULT_COEFFS[task]['cost'], dtype=float)
+        self.memory_coeffs = np.array(DEFAULT_COEFFS[task]['memory'], dtype=float)
+        # memory held by every task regardless of size (imports, tree, catalogues).
+        self.base_memory = base_memory
+        self.records = []
+
+    @staticmethod
+    def features(len_type, snapnums=None):
+        '''
+        Features of one root from the SubhaloLenType of its main branch.
+
+        Parameters
+        ----------
+        len_type : ndarray (n_branch, 6)
+            SubhaloLenType of the branch points that will be processed.
+
+        Returns
+        -------
+        summed : ndarray (5)
+            [n_snaps, total gas, DM, star, BH particles along the branch]
+        largest : ndarray (5)
+            The same for the single largest branch point.
+        '''
+        len_type = np.atleast_2d(len_type).astype(float)
+        summed = np.concatenate([[len_type.shape[0]], np.sum(len_type[:, FEATURE_TYPES], axis=0)])
+        if len_type.shape[0] == 0:
+            return summed, np.zeros(len(FEATURE_NAMES))
+        biggest = np.argmax(np.sum(len_type, axis=1))
+        largest = np.concatenate([[1], len_type[biggest, FEATURE_TYPES]])
+        return summed, largest
+
+    def estimate(self, summed, largest):
+        '''
+        Returns (cost in seconds, peak memory in bytes) for a root's features.
+        '''
+        return float(np.dot(self.cost_coeffs, summed)), float(self.base_memory + np.dot(self.memory_coeffs, largest))
+
+    def record(self, root, summed, largest, wall, peak_memory):
+        '''
+        Stores the measured cost of a root for refitting.
+        '''
+        self.records.append({'root': [int(r) for r in root], 'summed': list(map(float, summed)),
+                             'largest': list(map(float, largest)), 'wall': float(wall),
+                             'peak_memory': float(peak_memory)})
+
+    def fit(self, min_records=10):
+        '''
+        Refits the coefficients to the recorded costs with non-negative least squares.
+        Keeps the current coefficients if there are fewer than min_records records.
+        '''
+        if len(self.records) < min_records:
+            return
+        from scipy.optimize import nnls
+        summed = np.array([r['summed'] for r in self.records])
+        largest = np.array([r['largest'] for r in self.records])
+        wall = np.array([r['wall'] for r in self.records])
+        peak = np.array([r['peak_memory'] for r in self.records])
+        # scaling columns so that the solver is not dominated by the particle counts.
+        scale = np.maximum(np.max(summed, axis=0), 1)
+        self.cost_coeffs = nnls(summed / scale, wall)[0] / scale
+        scale = np.maximum(np.max(largest, axis=0), 1)
+        memory_coeffs = nnls(largest / scale, np.maximum(peak - self.base_memory, 0))[0] / scale
+        # keeping the memory estimate conservative: never below what was observed.
+        ratio = np.max(peak / (self.base_memory + largest @ memory_coeffs))
+        self.memory_coeffs = memory_coeffs * max(ratio, 1.)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'task': self.task, 'cost_coeffs': list(self.cost_coeffs),
+                       'memory_coeffs': list(self.memory_coeffs), 'base_memory': self.base_memory,
+                       'records': self.records}, f)
+
+    @classmethod
+    def load(cls, path, task='bh'):
+        '''
+        Loads a saved model, or returns a default one for task if path does not exist.
+        '''
+        if not os.path.exists(path):
+            return cls(task)
+        with open(path) as f:
+            saved = json.load(f)
+        model = cls(saved['task'], saved['base_memory'])
+        model.cost_coeffs = np.array(saved['cost_coeffs'])
+        model.memory_coeffs = np.array(saved['memory_coeffs'])
+        model.records = saved['records']
+        return model
+
+
+def branch_features(tree, roots, lookback_z=1, return_points=False):
+    '''
+    Reads SubhaloLenType along the main branch of every root (back to lookback_z) and
+    returns the (summed, largest) features for each. Roots with no branch get zeros.
+    With return_points, also returns the (SubfindID, SnapNum, SubhaloLenType) arrays of
+    each branch (as used by shared_blocks.RollingBlocks).
+    '''
+    import time_conversions
+    out = []
+    points = []
+    for sub, snap in roots:
+        branch = tree.get_main_branch(snap, sub, keysel=['SubhaloLenType', 'SubfindID', 'SnapNum'])
+        if branch is None:
+            out.append((np.zeros(len(FEATURE_NAMES)), np.zeros(len(FEATURE_NAMES))))
+            points.append((np.array([], dtype=int), np.array([], dtype=int), np.zeros((0, 6), dtype=int)))
+            continue
+        branch_z = np.array([time_conversions.snap_to_z(i) for i in branch.SnapNum])
+        mask = branch_z <= lookback_z
+        out.append(CostModel.features(branch.SubhaloLenType[mask]))
+        points.append((branch.SubfindID[mask], branch.SnapNum[mask], branch.SubhaloLenType[mask]))
+    if return_points:
+        return out, points
+    return out
+
+
+def _run_measured(func, root, args, environ={}):
+    # runs in the worker: wall time and peak python/numpy allocation of one task, with
+    # environ set for its duration (e.g. the prefix of its shared blocks).
+    previous = {key: os.environ.get(key) for key in environ}
+    os.environ.update(environ)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result, error = func(*root, *args), None
+    except Exception as e:
+        result, error = None, e
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    for key, value in previous.items():
+        if value is None:
+            os.environ.pop(key, None)
+        else:
+            os.environ[key] = value
+    if environ:
+        # the task's shared blocks are unmapped now, so an idle worker does not keep the
+        # memory of a finished wave alive.
+        import shared_blocks
+        shared_blocks.detach_all()
+    return result, error, wall, peak
+
+
+def run_scheduled(func, roots, features, model, n_workers=4, memory_budget=32e9, args=(),
+                  initializer=None, initargs=(), on_done=None, blocks=None, verbose=True):
+    '''
+    Runs func(subfind, snapnum, *args) for every root in a process pool, longest estimated
+    cost first, starting a task only while the estimated memory of running tasks plus the
+    new one (plus the shared blocks held, and those it would load) fits memory_budget. A
+    task bigger than the whole budget runs on its own. Measured wall time and peak memory
+    of the tasks which succeed are recorded into model.
+
+    Parameters
+    ----------
+    func : callable
+        Module level (picklable) function.
+    roots : list of (subfind_id, snapnum)
+    features : list of (summed, largest)
+        From branch_features, one per root.
+    model : CostModel
+    n_workers : int
+    memory_budget : float
+        Bytes available to the tasks on this node.
+    args : tuple
+        Extra arguments for func.
+    initializer, initargs :
+        Passed to the pool, e.g. to open the tree once per worker.
+    on_done : callable
+        Called with the index of each root as it finishes, in this process.
+    blocks : shared_blocks.RollingBlocks
+        Shared blocks loaded as roots start and freed as they finish, their size counted
+        in the memory in use.
+
+    Returns
+    -------
+    results : list
+        func output per root in the order of roots (None where it raised).
+    errors : list
+        Exception per root (None where it worked).
+    '''
+    estimates = [model.estimate(*f) for f in features]
+    order = list(np.argsort([-e[0] for e in estimates], kind='stable'))
+    results = [None] * len(roots)
+    errors = [None] * len(roots)
+    running = {}
+    resident = 0.
+    if blocks is not None:
+        blocks.plan(order)
+    held = (lambda: blocks.nbytes()) if blocks is not None else (lambda: 0)
+    needs = (lambda i: blocks.estimate(i)) if blocks is not None else (lambda i: 0)
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=initializer, initargs=initargs) as pool:
+        while order or running:
+            # admitting the longest remaining task that fits; if nothing is running the
+            # next task is always admitted, whatever its size.
+            while order and len(running) < n_workers:
+                admit = None
+                for k, i in enumerate(order):
+                    if not running or resident + held() + needs(i) + estimates[i][1] <= memory_budget:
+                        admit = k
+                        break
+                if admit is None:
+                    break
+                i = order.pop(admit)
+                environ = blocks.start(i) if blocks is not None else {}
+                future = pool.submit(_run_measured, func, tuple(roots[i]), args, environ)
+                running[future] = i
+                resident += estimates[i][1]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                resident -= estimates[i][1]
+                results[i], errors[i], wall, peak = future.result()
+                # a task which failed (often early, e.g. on a missing file) says nothing
+                # about its cost.
+                if errors[i] is None:
+                    model.record(roots[i], features[i][0], features[i][1], wall, peak)
+                if blocks is not None:
+                    blocks.done(i)
+                if on_done is not None:
+                    on_done(i)
+                if verbose:
+                    print(str(tuple(roots[i]))+': '+str(round(wall, 2))+' s (est. '+str(round(estimates[i][0], 2))
+                          +' s), peak '+str(round(peak / 1e6, 1))+' MB (est. '+str(round(estimates[i][1] / 1e6, 1))+' MB)')
+    return results, errors
@@ -0,0 +1,518 @@
+'''
+shared_blocks - snapshot particle blocks shared between worker processes.
+
+When several workers process subhalos from the same snapshot, each would otherwise read
+and hold its own copy of the same gas/BH arrays. A SnapshotBroker in the parent process
+reads the particles of every requested subhalo at a snapshot once, straight into
+multiprocessing.shared_memory. Workers attach by name and get zero-copy numpy views, so
+node memory and read volume scale with the number of snapshots, not snapshots x workers.
+
+    # parent
+    broker = shared_blocks.SnapshotBroker(basePath, 'gas', fields)
+    broker.acquire(snapnum, subfind_ids, n_users=len(roots))   # loads once
+    ... start the worker pool ...
+    broker.release(snapnum)            # per user; freed when the count reaches zero
+    broker.close()
+
+    # parent running scheduled roots: blocks are read as each wave of roots starts and
+    # freed as its branches finish, charged against the memory budget.
+    blocks = shared_blocks.RollingBlocks(basePath, [('gas', fields)], points, wave_size=n_workers)
+    scheduler.run_scheduled(..., blocks=blocks)
+    blocks.close()
+
+    # worker (cold_gas_fraction.load_gas and bh_params_subhalo.load_params do this)
+    props = shared_blocks.lookup(snapnum, subfind_id, 'gas', fields)
+    if props is None:
+        props = ss.loadSubhalo(...)
+
+Blocks are found through segment names derived from a prefix the broker puts in the
+environment (inherited by pool workers), so nothing needs to be passed to the tasks.
+lookup returns None when no broker is active or the subhalo is not covered, and callers
+then fall back to reading from disk. Views are read-only.
+
+/dev/shm is usually limited to half of the node memory.
+'''
+
+import os
+import sys
+import json
+import uuid
+import numpy as np
+from multiprocessing import shared_memory
+import snapshot as ss
+
+# environment variable holding the segment name prefix of the active broker.
+ENV_PREFIX = 'POPEYE_SHARED_BLOCKS'
+
+PARTTYPES = {'gas': 0, 'dm': 1, 'tracers': 3, 'stars': 4, 'star': 4, 'bh': 5,
+             'blackhole': 5, 'blackholes': 5}
+
+
+def part_type_num(partType):
+    if isinstance(partType, (int, np.integer)):
+        return int(partType)
+    return PARTTYPES[str(partType).lower()]
+
+
+def _segment_name(prefix, ptNum, snapnum, key):
+    return prefix+'_'+str(ptNum)+'_'+str(int(snapnum))+'_'+str(key)
+
+
+def _create(name, size):
+    return shared_memory.SharedMemory(name=name, create=True, size=max(int(size), 1))
+
+
+def _attach(name):
+    # only the broker should unlink a segment. pool workers share their parent's resource
+    # tracker, where the segment is already registered, so attaching adds nothing to it.
+    # python >= 3.13 can skip the tracker altogether.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
+
+
+class SnapshotBroker(object):
+    '''
+    Loads particle blocks into shared memory and reference-counts them.
+
+    Parameters
+    ----------
+    basePath : str
+        Base directory for output of TNG simulation.
+    partType : str
+        Particle type, e.g. 'gas' or 'BH'.
+    fields : list of str
+        Fields held for every particle.
+    max_gap : int
+        Subhalo ranges less than max_gap particles apart are read as one span (fewer,
+        larger reads at the cost of holding the particles in between).
+    prefix : str
+        Segment name prefix. Defaults to the one of a broker already active in this
+        process, else a unique name. Set into the environment so that processes started
+        afterwards find the blocks. Brokers sharing a prefix must hold different
+        particle types.
+    publish : bool
+        If False, the blocks are only read through subhalo() in this process (used as a
+        snapshot-ordered batch loader): the prefix is unique and not put in the
+        environment.
+    '''
+    def __init__(self, basePath, partType, fields, max_gap=100000, prefix=None, publish=True):
+        self.basePath = basePath
+        self.partType = partType
+        self.ptNum = part_type_num(partType)
+        self.fields = list(fields)
+        self.max_gap = max_gap
+        self.publish = publish
+        if publish:
+            self.prefix = prefix or os.environ.get(ENV_PREFIX) or 'pop'+uuid.uuid4().hex[:10]
+            os.environ[ENV_PREFIX] = self.prefix
+        else:
+            self.prefix = prefix or 'pop'+uuid.uuid4().hex[:10]
+        self.blocks = {}
+        self.refcount = {}
+        self.local = {}
+
+    def acquire(self, snapnum, subfind_ids, n_users=1):
+        '''
+        Makes sure a block for snapnum is loaded and adds n_users to its reference count.
+        The block covers subfind_ids; a block already loaded for snapnum is kept as is.
+
+        Returns
+        -------
+        nbytes : int
+            Size of the block in shared memory.
+        '''
+        snapnum = int(snapnum)
+        if snapnum not in self.blocks:
+            self.blocks[snapnum] = self._load(snapnum, np.unique(np.asarray(subfind_ids, dtype=np.int64)))
+            self.refcount[snapnum] = 0
+        self.refcount[snapnum] += n_users
+        return sum(shm.size for shm in self.blocks[snapnum])
+
+    def release(self, snapnum, n_users=1):
+        '''
+        Removes n_users from the count of a block and frees it when none are left. Workers
+        still holding views keep their mapping until they let go of it.
+        '''
+        snapnum = int(snapnum)
+        if snapnum not in self.refcount:
+            return
+        self.refcount[snapnum] -= n_users
+        if self.refcount[snapnum] <= 0:
+            self._free(snapnum)
+
+    def nbytes(self):
+        '''
+        Shared memory held by the blocks of this broker.
+        '''
+        return sum(shm.size for segments in self.blocks.values() for shm in segments)
+
+    def bytes_per_particle(self, snapnum):
+        '''
+        Bytes a block holds per particle (all fields), from the datasets at snapnum.
+        '''
+        return sum(np.dtype(dtype).itemsize * int(np.prod(tail)) for dtype, tail in self._field_shapes(snapnum).values())
+
+    def subhalo(self, snapnum, subfind_id):
+        '''
+        Particles of a subhalo from a block acquired by this broker, as
+        snapshot.loadSubhalo returns them ({'count': n, field: read-only view}), or None
+        if the block does not cover it.
+        '''
+        snapnum = int(snapnum)
+        if snapnum not in self.blocks:
+            return None
+        if snapnum not in self.local:
+            self.local[snapnum] = _AttachedBlock(self.prefix, self.ptNum, snapnum)
+        block = self.local[snapnum]
+        if int(subfind_id) not in block.position:
+            return None
+        start, length = block.position[int(subfind_id)]
+        props = {'count': length}
+        if length > 0:
+            for field in self.fields:
+                props[field] = block.arrays[field][start:start + length]
+        return props
+
+    def close(self):
+        '''
+        Frees every block.
+        '''
+        for snapnum in list(self.blocks):
+            self._free(snapnum)
+        if self.publish and os.environ.get(ENV_PREFIX) == self.prefix:
+            del os.environ[ENV_PREFIX]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _free(self, snapnum):
+        if snapnum in self.local:
+            _closing.append(self.local.pop(snapnum))
+            _closing[:] = [block for block in _closing if not block.close()]
+        for shm in self.blocks.pop(snapnum):
+            shm.close()
+            shm.unlink()
+        del self.refcount[snapnum]
+
+    def _load(self, snapnum, subfind_ids):
+        # particle ranges of every subhalo in the snapshot.
+        offsets = [ss.getSnapOffsets(self.basePath, snapnum, sub, 'Subhalo') for sub in subfind_ids]
+        starts = np.array([o['offsetType'][self.ptNum] for o in offsets], dtype=np.int64)
+        lengths = np.array([o['lenType'][self.ptNum] for o in offsets], dtype=np.int64)
+        snapOffsets = offsets[0]['snapOffsets'] if len(offsets) else None
+
+        # merging ranges into spans read in one go.
+        order = np.argsort(starts, kind='stable')
+        spans = []
+        for i in order:
+            if lengths[i] == 0:
+                continue
+            if spans and starts[i] <= spans[-1][1] + self.max_gap:
+                spans[-1][1] = max(spans[-1][1], starts[i] + lengths[i])
+            else:
+                spans.append([starts[i], starts[i] + lengths[i]])
+        n_total = int(sum(end - start for start, end in spans))
+
+        # position of every subhalo within the block.
+        block_starts = np.zeros(len(subfind_ids), dtype=np.int64)
+        span_write = np.cumsum([0] + [end - start for start, end in spans])
+        span_starts = np.array([start for start, end in spans], dtype=np.int64)
+        if len(spans):
+            span_of = np.searchsorted(span_starts, starts, side='right') - 1
+            block_starts = span_write[np.maximum(span_of, 0)] + starts - span_starts[np.maximum(span_of, 0)]
+        block_starts[lengths == 0] = 0
+
+        segments = []
+        try:
+            # allocating the field arrays in shared memory from the dataset shapes/dtypes.
+            result = {}
+            spec = {'n': n_total, 'fields': {}}
+            shapes = self._field_shapes(snapnum) if n_total else {}
+            for k, field in enumerate(self.fields if n_total else []):
+                dtype, tail = shapes[field]
+                shape = tuple([n_total] + tail)
+                shm = _create(_segment_name(self.prefix, self.ptNum, snapnum, k), np.dtype(dtype).itemsize * np.prod(shape))
+                segments.append(shm)
+                result[field] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+                spec['fields'][field] = [k, dtype, tail]
+
+            # reading each span directly into the shared arrays.
+            for (start, end), write in zip(spans, span_write[:-1]):
+                subset = {'offsetType': np.zeros(6, dtype=np.int64), 'lenType': np.zeros(6, dtype=np.int64),
+                          'snapOffsets': snapOffsets}
+                subset['offsetType'][self.ptNum] = start
+                subset['lenType'][self.ptNum] = end - start
+                # views into the span (loadSubset's own write offsets fail its length check).
+                span = {field: result[field][write:write + end - start] for field in self.fields}
+                ss.loadSubset(self.basePath, snapnum, self.ptNum, fields=self.fields, subset=subset, result=span)
+
+            index = np.vstack([subfind_ids, block_starts, lengths])
+            shm = _create(_segment_name(self.prefix, self.ptNum, snapnum, 'i'), index.nbytes)
+            segments.append(shm)
+            np.ndarray(index.shape, dtype=np.int64, buffer=shm.buf)[:] = index
+            spec['n_subhalos'] = len(subfind_ids)
+
+            # the spec is written last: workers treat its existence as the block being ready.
+            encoded = json.dumps(spec).encode()
+            shm = _create(_segment_name(self.prefix, self.ptNum, snapnum, 's'), len(encoded) + 8)
+            segments.append(shm)
+            shm.buf[8:8 + len(encoded)] = encoded
+            shm.buf[:8] = np.int64(len(encoded)).tobytes()
+        except BaseException:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+            raise
+        return segments
+
+    def _field_shapes(self, snapnum):
+        # dtype and trailing dimensions of every field, from the first chunk holding the type.
+        import h5py
+        gName = 'PartType'+str(self.ptNum)
+        chunk = 0
+        while True:
+            with h5py.File(ss.snapPath(self.basePath, snapnum, chunk), 'r') as f:
+                if gName in f:
+                    return {field: (f[gName][field].dtype.str, list(f[gName][field].shape[1:])) for field in self.fields}
+            chunk += 1
+
+
+class _AttachedBlock(object):
+    # a block as seen from a worker: segments, field views and the subhalo index.
+    def __init__(self, prefix, ptNum, snapnum):
+        self.segments = []
+        spec_shm = _attach(_segment_name(prefix, ptNum, snapnum, 's'))
+        self.segments.append(spec_shm)
+        size = int(np.frombuffer(spec_shm.buf[:8], dtype=np.int64)[0])
+        spec = json.loads(bytes(spec_shm.buf[8:8 + size]).decode())
+
+        index_shm = _attach(_segment_name(prefix, ptNum, snapnum, 'i'))
+        self.segments.append(index_shm)
+        index = np.ndarray((3, spec['n_subhalos']), dtype=np.int64, buffer=index_shm.buf)
+        self.position = {int(sub): (int(start), int(length)) for sub, start, length in index.T}
+
+        self.arrays = {}
+        for field, (k, dtype, tail) in spec['fields'].items():
+            shm = _attach(_segment_name(prefix, ptNum, snapnum, k))
+            self.segments.append(shm)
+            array = np.ndarray(tuple([spec['n']] + tail), dtype=dtype, buffer=shm.buf)
+            array.flags.writeable = False
+            self.arrays[field] = array
+
+    def close(self):
+        # views handed out keep the buffers exported; closing is retried later if so.
+        self.arrays = {}
+        for shm in list(self.segments):
+            try:
+                shm.close()
+                self.segments.remove(shm)
+            except BufferError:
+                pass
+        return not self.segments
+
+
+# worker side: blocks attached in this process, most recently used last.
+_attached = {}
+_closing = []
+max_attached = 4
+
+
+def lookup(snapnum, subfind_id, partType, fields):
+    '''
+    Returns the particles of a subhalo from a shared block, in the form of
+    snapshot.loadSubhalo ({'count': n, field: array}), or None if no active broker holds
+    this snapshot, subhalo and all of fields.
+    '''
+    prefix = os.environ.get(ENV_PREFIX)
+    if prefix is None:
+        return None
+    ptNum = part_type_num(partType)
+    key = (prefix, ptNum, int(snapnum))
+    # blocks of another prefix (an earlier wave of RollingBlocks) are not used again.
+    for other in [k for k in _attached if k[0] != prefix]:
+        _closing.append(_attached.pop(other))
+    block = _attached.pop(key, None)
+    if block is not None and int(subfind_id) not in block.position:
+        # the broker may have freed and reloaded this snapshot for other subhalos.
+        _closing.append(block)
+        block = None
+    if block is None:
+        try:
+            block = _AttachedBlock(prefix, ptNum, snapnum)
+        except FileNotFoundError:
+            return None
+    _attached[key] = block
+    _evict()
+
+    if int(subfind_id) not in block.position or any(field not in block.arrays for field in fields):
+        return None
+    start, length = block.position[int(subfind_id)]
+    props = {'count': length}
+    if length == 0:
+        return props
+    for field in fields:
+        props[field] = block.arrays[field][start:start + length]
+    return props
+
+
+def _evict():
+    while len(_attached) > max_attached:
+        _closing.append(_attached.pop(next(iter(_attached))))
+    _closing[:] = [block for block in _closing if not block.close()]
+
+
+def acquire_branches(broker, branches):
+    '''
+    Acquires the blocks for a set of branches, with one user per branch at each of its
+    snapshots, so a block is freed once every branch passing through it has been released.
+
+    Parameters
+    ----------
+    broker : SnapshotBroker
+    branches : list of (subfind_ids, snapnums, ...)
+        Branch points of each root.
+
+    Returns
+    -------
+    snapshots : list of ndarray
+        Snapshots used by each branch, to hand to release_branch when it is done.
+    '''
+    snapshots = [np.unique(np.asarray(b[1], dtype=int)) for b in branches]
+    if len(branches) == 0:
+        return snapshots
+    subs = np.concatenate([np.asarray(b[0], dtype=np.int64) for b in branches])
+    snaps = np.concatenate([np.asarray(b[1], dtype=int) for b in branches])
+    for snapnum in np.unique(snaps):
+        n_users = sum(snapnum in s for s in snapshots)
+        broker.acquire(snapnum, subs[snaps == snapnum], n_users=n_users)
+    return snapshots
+
+
+def release_branch(broker, snapshots):
+    '''
+    Releases one user of every snapshot returned for a branch by acquire_branches.
+    '''
+    for snapnum in snapshots:
+        broker.release(snapnum)
+
+
+class RollingBlocks(object):
+    '''
+    Shared blocks for the roots of scheduler.run_scheduled, held only while their roots
+    run. Roots are grouped, in run order, into waves of wave_size. When the first root of
+    a wave starts, the blocks of the wave (every snapshot its branches pass through, read
+    one snapshot at a time, covering only its subhalos) are loaded under a prefix of its
+    own, which is handed to the tasks of the wave. A snapshot is freed once every branch
+    of the wave through it has finished. nbytes (held) and estimate (what starting a root
+    would load) let the scheduler charge the blocks against its memory budget, so memory
+    holds the blocks of the running waves rather than those of the whole sample.
+
+    Parameters
+    ----------
+    basePath : str
+        Base directory for output of TNG simulation.
+    parts : list of (partType, fields)
+        Particle types and fields held, e.g. [('gas', GAS_FIELDS), ('BH', BH_FIELDS)].
+    points : list of (subfind_ids, snapnums, len_type)
+        Branch points of every root, from scheduler.branch_features(return_points=True).
+    wave_size : int
+        Roots per wave. Larger waves merge more reads, smaller ones hold less memory.
+    max_gap : int
+        See SnapshotBroker. 0 reads touching subhalos together but nothing in between.
+    '''
+    def __init__(self, basePath, parts, points, wave_size=4, max_gap=0):
+        self.basePath = basePath
+        self.parts = [(partType, list(fields)) for partType, fields in parts]
+        self.points = points
+        self.wave_size = max(int(wave_size), 1)
+        self.max_gap = max_gap
+        self.wave_of = np.arange(len(points)) // self.wave_size
+        self.brokers = {}
+        self.users = {}
+        self.remaining = {}
+        self._bytes_per_particle = None
+
+    def plan(self, order):
+        '''
+        Groups the roots into waves in the order they are expected to start.
+        '''
+        self.wave_of = np.empty(len(self.points), dtype=int)
+        self.wave_of[np.asarray(order, dtype=int)] = np.arange(len(order)) // self.wave_size
+
+    def _members(self, wave):
+        return np.flatnonzero(self.wave_of == wave)
+
+    def nbytes(self):
+        return sum(broker.nbytes() for brokers in self.brokers.values() for broker in brokers)
+
+    def estimate(self, i):
+        '''
+        Shared memory (particle data) starting root i would load, 0 if its wave is loaded.
+        '''
+        wave = self.wave_of[i]
+        if wave in self.remaining:
+            return 0.
+        members = [m for m in self._members(wave) if len(self.points[m][1]) > 0]
+        if len(members) == 0:
+            return 0.
+        if self._bytes_per_particle is None:
+            snapnum = int(self.points[members[0]][1][0])
+            self._bytes_per_particle = [SnapshotBroker(self.basePath, partType, fields, publish=False).bytes_per_particle(snapnum)
+                                        for partType, fields in self.parts]
+        len_type = np.concatenate([np.atleast_2d(self.points[m][2]) for m in members])
+        return float(sum(np.sum(len_type[:, part_type_num(partType)]) * nbytes
+                         for (partType, fields), nbytes in zip(self.parts, self._bytes_per_particle)))
+
+    def start(self, i):
+        '''
+        Loads the blocks of root i's wave if it is the first to start. Returns the
+        environment the task needs to find them.
+        '''
+        wave = self.wave_of[i]
+        if wave not in self.remaining:
+            members = self._members(wave)
+            self.remaining[wave] = len(members)
+            prefix = 'pop'+uuid.uuid4().hex[:10]
+            self.brokers[wave] = [SnapshotBroker(self.basePath, partType, fields, max_gap=self.max_gap, prefix=prefix, publish=False)
+                                  for partType, fields in self.parts]
+            branches = [self.points[m] for m in members]
+            users = [acquire_branches(broker, branches) for broker in self.brokers[wave]]
+            for k, m in enumerate(members):
+                self.users[m] = [u[k] for u in users]
+        return {ENV_PREFIX: self.brokers[wave][0].prefix}
+
+    def done(self, i):
+        '''
+        Releases root i's snapshots; the wave's brokers are closed with its last root.
+        '''
+        wave = self.wave_of[i]
+        if wave not in self.brokers:
+            return
+        for broker, snapshots in zip(self.brokers[wave], self.users.pop(i)):
+            release_branch(broker, snapshots)
+        self.remaining[wave] -= 1
+        if self.remaining[wave] == 0:
+            for broker in self.brokers.pop(wave):
+                broker.close()
+
+    def close(self):
+        '''
+        Frees every block still held.
+        '''
+        for wave in list(self.brokers):
+            for broker in self.brokers.pop(wave):
+                broker.close()
+
+
+def detach_all():
+    '''
+    Drops every block attached by this process (views still in use stay valid).
+    '''
+    while _attached:
+        _closing.append(_attached.popitem()[1])
+    _closing[:] = [block for block in _closing if not block.close()]
@@ -0,0 +1,230 @@
+'''
+simulation_registry - per simulation metadata (snapshot redshifts and scale factors, box
+size, cosmology and particle mass table) read from the snapshot headers once and cached.
+
+The first time a simulation is used, the header of every snapshot is read in parallel and
+the result is written to a small JSON file in the cache directory ($POPEYE_CACHE_DIR, or
+~/.cache/popeye). Later uses (in any process) read that file instead, as long as the
+snapshots on disk still match it (same snapshot numbers, no header file modified since),
+and within a process each simulation is read at most once.
+
+    import simulation_registry
+    simulation_registry.use('/path/to/L35n2160TNG/output')   # e.g. TNG50-1 or a mock
+    simulation_registry.current().redshift[99]
+
+time_conversions, coordinate_transforms and the box size defaults (blen) follow the
+current simulation. use() also sets it in the environment, so worker processes started
+afterwards pick the same simulation. Without use() the current simulation is TNG100-1,
+from the built-in table below (no file access).
+'''
+
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+import h5py
+from concurrent.futures import ThreadPoolExecutor
+import snapshot as ss
+import atomic_write
+
+# environment variable holding the basePath of the current simulation.
+ENV_SIMULATION = 'POPEYE_SIMULATION'
+# environment variable overriding the metadata cache directory.
+ENV_CACHE_DIR = 'POPEYE_CACHE_DIR'
+
+TNG100_BASEPATH = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output'
+
+# TNG100-1 snapshot redshifts (snapshot headers), used when no simulation has been set.
+TNG100_REDSHIFTS = [20.046490988807516, 14.989173240042412, 11.980213315300293, 10.975643294137885,
+                    9.996590466186333, 9.388771271940549, 9.00233985416247, 8.449476294368743,
+                    8.012172948865935, 7.5951071498715965, 7.23627606616736, 7.005417045544533,
+                    6.491597745667503, 6.0107573988449, 5.846613747881867, 5.5297658079491026,
+                    5.227580973127337, 4.995933468164624, 4.664517702470927, 4.428033736605549,
+                    4.176834914726472, 4.0079451114652676, 3.7087742646422353, 3.4908613692606485,
+                    3.2830330579565246, 3.008131071630377, 2.8957850057274284, 2.7331426173187188,
+                    2.5772902716018935, 2.4442257045541464, 2.3161107439568918, 2.207925472383703,
+                    2.1032696525957713, 2.0020281392528516, 1.9040895435327672, 1.822689252620354,
+                    1.7435705743308647, 1.6666695561144653, 1.6042345220731056, 1.5312390291576135,
+                    1.4955121664955557, 1.4140982203725216, 1.3575766674029972, 1.3023784599059653,
+                    1.2484726142451428, 1.2062580807810006, 1.1546027123602154, 1.1141505637653806,
+                    1.074457894547674, 1.035510445664141, 0.9972942257819404, 0.9505313515850327,
+                    0.9230008161779089, 0.8868969375752482, 0.8514709006246495, 0.8167099790118506,
+                    0.7910682489463392, 0.7574413726158526, 0.7326361820223115, 0.7001063537185233,
+                    0.6761104112134777, 0.6446418406845371, 0.6214287452425136, 0.5985432881875667,
+                    0.5759808451078874, 0.5463921831410221, 0.524565820433923, 0.5030475232448832,
+                    0.4818329434209512, 0.4609177941806475, 0.4402978492477432, 0.41996894199726653,
+                    0.3999269646135635, 0.38016786726023866, 0.36068765726181673, 0.3478538418581776,
+                    0.32882972420595435, 0.31007412012783386, 0.2977176845174465, 0.2733533465784399,
+                    0.2613432561610123, 0.24354018155467028, 0.22598838626019768, 0.21442503551449454,
+                    0.19728418237600986, 0.1803852617057493, 0.1692520332436107, 0.15274876890238098,
+                    0.14187620396956202, 0.12575933241126092, 0.10986994045882548, 0.09940180263022191,
+                    0.08388443079747931, 0.07366138465643868, 0.058507322794512984, 0.04852362998180593,
+                    0.0337243718735154, 0.023974428382762536, 0.009521666967944764, 2.220446049250313e-16]
+
+
+class Simulation(object):
+    '''
+    Metadata of one simulation. Per snapshot quantities are dicts keyed by snapnum.
+
+    Attributes
+    ----------
+    basePath : str
+    redshift, scale_factor : dict of float
+    mass_table : dict of ndarray (6)
+        Header MassTable (1e10 Msol/h), e.g. the DM particle mass.
+    boxsize : float
+        ckpc/h.
+    hubble_param, omega0, omega_lambda, omega_baryon : float
+    '''
+    def __init__(self, basePath, snapnums, redshift, mass_table, boxsize, hubble_param, omega0, omega_lambda, omega_baryon):
+        self.basePath = basePath
+        self.snapnums = np.asarray(snapnums, dtype=int)
+        self.redshift = {int(s): float(z) for s, z in zip(snapnums, redshift)}
+        # as in the headers (Time), a = 1 / (1 + z).
+        self.scale_factor = {s: 1 / (1 + z) for s, z in self.redshift.items()}
+        self.mass_table = {int(s): np.asarray(m, dtype=float) for s, m in zip(snapnums, mass_table)}
+        self.boxsize = float(boxsize)
+        self.hubble_param = float(hubble_param)
+        self.omega0 = float(omega0)
+        self.omega_lambda = float(omega_lambda)
+        self.omega_baryon = float(omega_baryon)
+
+    def to_dict(self):
+        return {'basePath': self.basePath, 'snapnums': self.snapnums.tolist(),
+                'redshift': [self.redshift[s] for s in self.snapnums],
+                'mass_table': [self.mass_table[s].tolist() for s in self.snapnums],
+                'boxsize': self.boxsize, 'hubble_param': self.hubble_param, 'omega0': self.omega0,
+                'omega_lambda': self.omega_lambda, 'omega_baryon': self.omega_baryon}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+
+def tng100():
+    '''
+    TNG100-1 from the built-in table.
+    '''
+    return Simulation(TNG100_BASEPATH, np.arange(100), TNG100_REDSHIFTS, [[0., 0.000505574296436975, 0., 0., 0., 0.]] * 100,
+                      75000., 0.6774, 0.3089, 0.6911, 0.0486)
+
+
+def _read_header(basePath, snapnum):
+    with h5py.File(ss.snapPath(basePath, snapnum), 'r') as f:
+        header = dict(f['Header'].attrs.items())
+    return header
+
+
+def snapshot_numbers(basePath):
+    '''
+    Snapshot numbers present in basePath (snapdir_NNN directories).
+    '''
+    dirs = glob.glob(os.path.join(basePath, 'snapdir_*'))
+    return np.sort([int(os.path.basename(d).split('_')[-1]) for d in dirs])
+
+
+def read_simulation(basePath, n_threads=16):
+    '''
+    Simulation metadata from every snapshot header in basePath, read in parallel.
+    '''
+    snapnums = snapshot_numbers(basePath)
+    if snapnums.shape[0] == 0:
+        raise ValueError('No snapshots found in '+str(basePath))
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        headers = list(pool.map(lambda snap: _read_header(basePath, snap), snapnums))
+    last = headers[-1]
+    return Simulation(basePath, snapnums, [h['Redshift'] for h in headers], [h['MassTable'] for h in headers],
+                      last['BoxSize'], last['HubbleParam'], last['Omega0'], last['OmegaLambda'],
+                      last.get('OmegaBaryon', np.nan))
+
+
+def fingerprint(basePath, snapnums=None):
+    '''
+    What the cached metadata of a simulation depends on: its snapshot numbers and the
+    latest modification time of their first chunk files (which hold the headers).
+    '''
+    snapnums = snapshot_numbers(basePath) if snapnums is None else snapnums
+    mtime = max([os.stat(ss.snapPath(basePath, snap)).st_mtime for snap in snapnums] + [0.])
+    return {'snapnums': [int(s) for s in snapnums], 'mtime': mtime}
+
+
+def cache_dir():
+    return os.environ.get(ENV_CACHE_DIR, os.path.join(os.path.expanduser('~'), '.cache', 'popeye'))
+
+
+def simulation_key(basePath):
+    '''
+    Name identifying a simulation in cache files: its directory name plus a hash of the
+    full path.
+    '''
+    basePath = os.path.abspath(basePath).rstrip('/')
+    name = os.path.basename(os.path.dirname(basePath)) if os.path.basename(basePath) == 'output' else os.path.basename(basePath)
+    return name+'_'+hashlib.sha1(basePath.encode()).hexdigest()[:10]
+
+
+def cache_path(basePath, directory=None):
+    '''
+    Metadata file of a simulation (see simulation_key).
+    '''
+    return os.path.join(directory or cache_dir(), 'simulation_'+simulation_key(basePath)+'.json')
+
+
+# simulations already read in this process, by basePath.
+_loaded = {}
+_current = None
+
+
+def get(basePath, directory=None):
+    '''
+    Metadata of the simulation at basePath, from memory, the cache file, or (first use)
+    the snapshot headers.
+    '''
+    key = os.path.abspath(basePath).rstrip('/')
+    if key in _loaded:
+        return _loaded[key]
+    if key == TNG100_BASEPATH and not os.path.exists(key):
+        # away from the cluster TNG100-1 comes from the built-in table.
+        _loaded[key] = tng100()
+        return _loaded[key]
+
+    path = cache_path(basePath, directory)
+    current = fingerprint(basePath)
+    sim = None
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            saved = json.load(f)
+        # a simulation rewritten at the same path (e.g. a regenerated mock) is read again.
+        if saved.pop('fingerprint', None) == current:
+            sim = Simulation.from_dict(saved)
+    if sim is None:
+        sim = read_simulation(basePath)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with atomic_write.temporary_path(path) as tmp, open(tmp, 'w') as f:
+                json.dump(dict(sim.to_dict(), fingerprint=current), f)
+        except OSError:
+            pass
+    _loaded[key] = sim
+    return sim
+
+
+def use(basePath, directory=None):
+    '''
+    Makes the simulation at basePath the current one, here and in processes started later.
+    '''
+    global _current
+    _current = get(basePath, directory)
+    os.environ[ENV_SIMULATION] = os.path.abspath(basePath).rstrip('/')
+    return _current
+
+
+def current():
+    '''
+    The current simulation: set by use(), else the one in the environment, else TNG100-1.
+    '''
+    global _current
+    if _current is None:
+        basePath = os.environ.get(ENV_SIMULATION)
+        _current = get(basePath) if basePath else get(TNG100_BASEPATH)
+    return _current
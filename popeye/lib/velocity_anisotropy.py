@@ -79,3 +79,65 @@ def compute_anisotropy(radial, velocity, weights=None):
     return beta_vel_av, beta_vel_err, beta_disp_av
 
 
+
+def subsample_bins(bin_index, max_per_bin, seed=42):
+    '''
+    Returns the indices of a random subsample of at most max_per_bin particles from every
+    bin (bins with fewer particles are kept whole), sorted by bin, plus the number kept
+    per bin. The same seed always gives the same subsample.
+
+       Inputs:
+           - bin_index: bin of every particle (e.g. from np.digitize). dim: N, >= 0.
+           - max_per_bin: cap on particles per bin.
+           - seed: random seed.
+
+       Output:
+           - indices into the particle arrays. dim: sum(n_used)
+           - n_used per bin. dim: max(bin_index) + 1
+    '''
+    rng = np.random.default_rng(seed)
+    # one (radix) sort of the small integer bin numbers groups the particles by bin.
+    order = np.argsort(bin_index.astype(np.int16), kind='stable')
+    counts = np.bincount(bin_index)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    keep = []
+    for start, count in zip(starts, counts):
+        if count <= max_per_bin:
+            keep.append(order[start:start + count])
+        else:
+            keep.append(order[start + rng.choice(count, max_per_bin, replace=False)])
+    return np.concatenate(keep) if keep else np.array([], dtype=int), np.minimum(counts, max_per_bin)
+
+
+def bootstrap_anisotropy(radial, velocity, weights=None, n_bootstrap=100, seed=42):
+    '''Bootstrap uncertainty (standard deviation over resamples) of beta_vel from
+       compute_anisotropy. The radial/tangential components are found once and only the
+       averages are repeated for each resample.
+
+       Inputs:
+           - radial, velocity, weights: as compute_anisotropy.
+           - n_bootstrap: number of resamples.
+           - seed: random seed.
+
+       Output:
+           - beta_vel_boot_err
+    '''
+    if weights is None:
+        weights = np.ones(radial.shape[0])
+    mask = np.linalg.norm(radial, axis=1) != 0
+    radial = radial[mask]
+    velocity = velocity[mask]
+    weights = weights[mask]
+
+    v_rad = np.vstack(np.einsum('ij,ij->i', velocity, radial) / np.einsum('ij,ij->i', radial, radial))*radial
+    v_rad_sq = np.einsum('ij,ij->i', v_rad, v_rad)
+    v_tan_sq = np.einsum('ij,ij->i', velocity - v_rad, velocity - v_rad)
+
+    rng = np.random.default_rng(seed)
+    beta = np.zeros(n_bootstrap)
+    for i in np.arange(n_bootstrap):
+        resample = rng.integers(0, radial.shape[0], size=radial.shape[0])
+        vsm_rad = np.average(v_rad_sq[resample], weights=weights[resample])
+        vsm_tan = np.average(v_tan_sq[resample], weights=weights[resample])
+        beta[i] = 1 - vsm_tan / (2 * vsm_rad)
+    return np.std(beta)
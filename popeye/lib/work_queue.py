@@ -0,0 +1,284 @@
+'''
+work_queue - a SQLite ledger on a shared filesystem that hands out leases on batches of
+roots to any number of worker processes on any number of nodes.
+
+One process populates the ledger with batches of (subfind_id, snapnum) roots. When
+every worker starts against an empty ledger, populate_from leases the population step to
+one of them (the others wait for the batches), so the roots are only worked out once. Workers
+claim the oldest available batch, which gives them a lease for lease_seconds. While a
+batch is being processed a heartbeat thread keeps renewing the lease. If a worker dies
+the lease is not renewed, it expires and the batch is handed out again. Batches that fail
+max_attempts times are marked as failed and left alone.
+
+No external service is needed. Every change is a short BEGIN IMMEDIATE transaction, which
+takes SQLite's file lock. This is fine on Lustre/GPFS and NFS with working POSIX locks.
+The rollback journal is used rather than WAL because WAL does not work over network
+filesystems.
+
+Usage (see run_queue_worker.py):
+
+    queue = work_queue.WorkQueue('/shared/ledger.sqlite')
+    queue.populate_from(lambda: zip(subfind_ids, snapnums), batch_size=20)
+    for batch_id, roots in queue.iter_batches():
+        ... process roots, write output for batch_id ...
+'''
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+
+# batch states.
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def default_worker_name():
+    '''
+    hostname:pid, so leases can be traced back to a process.
+    '''
+    return socket.gethostname()+':'+str(os.getpid())
+
+
+class WorkQueue(object):
+    '''
+    Lease-based work queue stored in a SQLite file.
+
+    Parameters
+    ----------
+    path : str
+        Ledger file. Must be on a filesystem visible to every worker.
+    lease_seconds : float
+        How long a claim is valid without renewal.
+    max_attempts : int
+        Claims after which a batch that never completes is marked failed.
+    timeout : float
+        Seconds to wait for the database lock.
+    '''
+    def __init__(self, path, lease_seconds=600, max_attempts=3, timeout=120):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS batches (
+                                id INTEGER PRIMARY KEY,
+                                roots TEXT NOT NULL,
+                                status TEXT NOT NULL,
+                                worker TEXT,
+                                lease_expires REAL,
+                                attempts INTEGER NOT NULL DEFAULT 0,
+                                error TEXT)''')
+            # single row lease on populating the ledger (see populate_from).
+            conn.execute('''CREATE TABLE IF NOT EXISTS population (
+                                id INTEGER PRIMARY KEY CHECK (id = 0),
+                                status TEXT NOT NULL,
+                                worker TEXT,
+                                lease_expires REAL)''')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=DELETE')
+        return _Transaction(conn)
+
+    def populate(self, roots, batch_size=10):
+        '''
+        Splits roots (iterable of (subfind_id, snapnum)) into batches and adds them.
+        Does nothing if the ledger already holds batches, so every worker can safely call
+        it at start up.
+
+        Returns
+        -------
+        n_batches : int
+            Number of batches in the ledger.
+        '''
+        with self._connect() as conn:
+            return self._insert_batches(conn, roots, batch_size)
+
+    def _insert_batches(self, conn, roots, batch_size):
+        n = conn.execute('SELECT COUNT(*) FROM batches').fetchone()[0]
+        if n > 0:
+            return n
+        roots = [[int(sub), int(snap)] for sub, snap in roots]
+        batches = [roots[i:i + batch_size] for i in range(0, len(roots), batch_size)]
+        conn.executemany('INSERT INTO batches (roots, status) VALUES (?, ?)',
+                         [(json.dumps(b), PENDING) for b in batches])
+        conn.execute('INSERT OR REPLACE INTO population (id, status, worker, lease_expires) VALUES (0, ?, NULL, NULL)', (DONE,))
+        return len(batches)
+
+    def populate_from(self, make_roots, batch_size=10, worker=None, poll=5.):
+        '''
+        populate with the roots returned by make_roots(), which only one worker calls. The
+        first worker to find the ledger empty takes a lease on populating it (renewed while
+        make_roots runs); the others wait until it has finished. If that worker dies, its
+        lease expires and another one populates the ledger instead.
+
+        Returns
+        -------
+        n_batches : int
+            Number of batches in the ledger.
+        '''
+        worker = worker or default_worker_name()
+        while True:
+            now = time.time()
+            with self._connect() as conn:
+                n = conn.execute('SELECT COUNT(*) FROM batches').fetchone()[0]
+                row = conn.execute('SELECT status, lease_expires FROM population').fetchone()
+                if n > 0 or (row is not None and row[0] == DONE):
+                    return n
+                claimed = row is None or row[1] < now
+                if claimed:
+                    conn.execute('INSERT OR REPLACE INTO population (id, status, worker, lease_expires) VALUES (0, ?, ?, ?)',
+                                 (LEASED, worker, now + self.lease_seconds))
+            if not claimed:
+                time.sleep(min(poll, self.lease_seconds / 4.))
+                continue
+            stop = threading.Event()
+            beat = threading.Thread(target=self._heartbeat, args=(self._renew_population, worker, stop), daemon=True)
+            beat.start()
+            try:
+                roots = list(make_roots())
+            finally:
+                stop.set()
+            with self._connect() as conn:
+                held = conn.execute('SELECT COUNT(*) FROM population WHERE worker=? AND status=?', (worker, LEASED)).fetchone()[0]
+                if held:
+                    return self._insert_batches(conn, roots, batch_size)
+            # the lease was lost and another worker populates the ledger.
+
+    def _renew_population(self, worker):
+        with self._connect() as conn:
+            cur = conn.execute('UPDATE population SET lease_expires=? WHERE worker=? AND status=?',
+                               (time.time() + self.lease_seconds, worker, LEASED))
+            return cur.rowcount == 1
+
+    def claim(self, worker=None):
+        '''
+        Leases the oldest pending batch (or one whose lease has expired).
+
+        Returns
+        -------
+        (batch_id, roots) or None if there is nothing left to hand out. roots is a list of
+        (subfind_id, snapnum) tuples.
+        '''
+        worker = worker or default_worker_name()
+        now = time.time()
+        with self._connect() as conn:
+            # expired leases that have used all their attempts are given up on.
+            conn.execute('UPDATE batches SET status=?, error=? WHERE status=? AND lease_expires<? AND attempts>=?',
+                         (FAILED, 'lease expired', LEASED, now, self.max_attempts))
+            row = conn.execute('SELECT id, roots FROM batches WHERE status=? OR (status=? AND lease_expires<?) ORDER BY id LIMIT 1',
+                               (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE batches SET status=?, worker=?, lease_expires=?, attempts=attempts+1 WHERE id=?',
+                         (LEASED, worker, now + self.lease_seconds, row[0]))
+        return row[0], [tuple(r) for r in json.loads(row[1])]
+
+    def renew(self, batch_id, worker=None):
+        '''
+        Extends the lease on a batch. Returns False if the lease has been lost (expired and
+        handed to another worker), in which case the result should be discarded.
+        '''
+        worker = worker or default_worker_name()
+        with self._connect() as conn:
+            cur = conn.execute('UPDATE batches SET lease_expires=? WHERE id=? AND worker=? AND status=?',
+                               (time.time() + self.lease_seconds, batch_id, worker, LEASED))
+            return cur.rowcount == 1
+
+    def complete(self, batch_id, worker=None):
+        '''
+        Marks a batch as done. Returns False if this worker no longer held the lease.
+        '''
+        worker = worker or default_worker_name()
+        with self._connect() as conn:
+            cur = conn.execute('UPDATE batches SET status=?, lease_expires=NULL WHERE id=? AND worker=? AND status=?',
+                               (DONE, batch_id, worker, LEASED))
+            return cur.rowcount == 1
+
+    def fail(self, batch_id, error, worker=None):
+        '''
+        Releases a batch after an error. It is put back as pending unless it has used up
+        max_attempts, in which case it is marked failed.
+        '''
+        worker = worker or default_worker_name()
+        with self._connect() as conn:
+            conn.execute('UPDATE batches SET status=CASE WHEN attempts>=? THEN ? ELSE ? END, error=?, lease_expires=NULL '
+                         'WHERE id=? AND worker=? AND status=?',
+                         (self.max_attempts, FAILED, PENDING, str(error), batch_id, worker, LEASED))
+
+    def progress(self):
+        '''
+        Returns a dict of batch status -> count.
+        '''
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) FROM batches GROUP BY status').fetchall()
+        return {status: n for status, n in rows}
+
+    def iter_batches(self, worker=None, heartbeat=True, wait_for_leases=True):
+        '''
+        Generator claiming batches until none are left. If wait_for_leases, a worker with
+        nothing to claim keeps polling while other workers hold leases, so batches from
+        workers that die are still picked up. While the caller processes a batch
+        its lease is renewed every lease_seconds / 3 by a background thread. The batch is
+        marked done when the caller asks for the next one. If the loop stops early (break
+        or an exception) the batch is released for another worker when the generator is
+        closed.
+
+        Yields
+        ------
+        (batch_id, roots)
+        '''
+        worker = worker or default_worker_name()
+        while True:
+            claimed = self.claim(worker)
+            if claimed is None:
+                if wait_for_leases and self.progress().get(LEASED, 0) > 0:
+                    time.sleep(min(60., self.lease_seconds / 4.))
+                    continue
+                return
+            batch_id, roots = claimed
+            stop = threading.Event()
+            if heartbeat:
+                beat = threading.Thread(target=self._heartbeat, args=(lambda w: self.renew(batch_id, w), worker, stop), daemon=True)
+                beat.start()
+            try:
+                yield batch_id, roots
+            except BaseException as e:
+                stop.set()
+                self.fail(batch_id, repr(e), worker)
+                raise
+            stop.set()
+            self.complete(batch_id, worker)
+
+    def _heartbeat(self, renew, worker, stop):
+        while not stop.wait(self.lease_seconds / 3.):
+            if not renew(worker):
+                return
+
+
+class _Transaction(object):
+    '''
+    Context manager running the enclosed statements in one BEGIN IMMEDIATE transaction, so
+    the ledger is locked from the first read.
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.execute('COMMIT')
+            else:
+                self.conn.execute('ROLLBACK')
+        finally:
+            self.conn.close()
+        return False
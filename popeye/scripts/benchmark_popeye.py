@@ -0,0 +1,139 @@
+'''
+benchmark_popeye - times the public popeye functions on mock TNG outputs (mock_tng) of
+increasing size and reports how each one scales with particle number.
+
+Sizes are the number of DM particles in the largest subhalo (gas matches, stars are half).
+Each function is timed on that subhalo (or its main branch) and the best of n_repeat runs
+is kept. Results are written to a csv, a scaling plot and printed as power-law slopes.
+'''
+
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import snapshot as ss
+import mock_tng
+import process_subhalo
+import bh_params_subhalo
+import cold_gas_fraction
+import branch_properties
+import velocity_anisotropy
+import fractional_radii
+
+# ---------------------------------------------------------------------------------------
+# Benchmark configuration.
+
+sizes = [10**3, 10**4, 10**5, 10**6, 10**7]
+n_repeat = 3
+n_subhalos = 5
+snapnums = np.arange(97, 100)
+n_chunks = 4
+outpath = './benchmark/'
+# mocks are written here (one per size) and removed afterwards unless keep_mocks.
+mockpath = tempfile.gettempdir()
+keep_mocks = False
+
+# ---------------------------------------------------------------------------------------
+
+def best_time(func, n_repeat):
+    '''
+    Returns the minimum wall time over n_repeat calls of func() and its last output.
+    '''
+    best = np.inf
+    for i in range(n_repeat):
+        start = time.perf_counter()
+        out = func()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+def benchmark_size(n_particles):
+    '''
+    Builds a mock with n_particles in the largest subhalo and times every function on it.
+    Returns a dict of function name -> seconds.
+    '''
+    simdir = os.path.join(mockpath, 'popeye_mock_'+str(n_particles))
+    start = time.perf_counter()
+    basepath = mock_tng.make_mock_simulation(simdir, n_subhalos=n_subhalos, n_particles=n_particles,
+                                             snapnums=snapnums, n_chunks=n_chunks)
+    print('  mock written in '+str(round(time.perf_counter() - start, 1))+' s')
+    tree = mock_tng.MockTreeDB(os.path.join(simdir, 'postprocessing', 'trees', 'SubLink'))
+    snapnum = snapnums[-1]
+    sub = 0
+
+    timings = {}
+    timings['load_particles_transform_relative'], (DM_pos, DM_vel) = best_time(
+        lambda: process_subhalo.load_particles_transform_relative(sub, snapnum, 'DM', basePath=basepath), n_repeat)
+    star_pos, star_vel = process_subhalo.load_particles_transform_relative(sub, snapnum, 'star', basePath=basepath)
+    star_mass = ss.loadSubhalo(basepath, snapnum, id=sub, partType='star', fields=['Masses'])
+
+    branch = tree.get_main_branch(snapnum, sub, keysel=['SubfindID', 'SnapNum', 'SubhaloHalfmassRadType', 'SubhaloPos'])
+    timings['compute_params_branch'], _ = best_time(
+        lambda: bh_params_subhalo.compute_params_branch(branch.SubfindID, branch.SnapNum, basepath), n_repeat)
+    timings['compute_fraction_set'], _ = best_time(
+        lambda: cold_gas_fraction.compute_fraction_set(branch.SubfindID, branch.SnapNum, branch.SubhaloHalfmassRadType[:,4],
+                                                       branch.SubhaloPos, basePath=basepath), n_repeat)
+    timings['branch_tabulate'], _ = best_time(
+        lambda: branch_properties.branch_tabulate(sub, snapnum, tree, 1, basepath), n_repeat)
+    timings['compute_anisotropy'], _ = best_time(
+        lambda: velocity_anisotropy.compute_anisotropy(DM_pos, DM_vel), n_repeat)
+    timings['mass_enclosed_radii'], _ = best_time(
+        lambda: fractional_radii.mass_enclosed_radii(star_pos, [50], weights=star_mass), n_repeat)
+
+    if not keep_mocks:
+        shutil.rmtree(simdir)
+    return timings
+
+
+def scaling_slopes(results):
+    '''
+    Fits log10(t) = slope * log10(N) + c for every function, using sizes where the timing
+    is above 1 ms (below this the fixed overheads dominate).
+    '''
+    slopes = {}
+    for func in results.columns.drop('n_particles'):
+        keep = results[func].values > 1e-3
+        if np.sum(keep) < 2:
+            slopes[func] = np.nan
+            continue
+        slopes[func] = np.polyfit(np.log10(results.n_particles.values[keep]), np.log10(results[func].values[keep]), 1)[0]
+    return slopes
+
+# ---------------------------------------------------------------------------------------
+# Running benchmarks.
+
+os.makedirs(outpath, exist_ok=True)
+rows = []
+for n in sizes:
+    print('N = '+str(n))
+    timings = benchmark_size(n)
+    timings['n_particles'] = n
+    rows.append(timings)
+    for func, t in timings.items():
+        if func != 'n_particles':
+            print('  {:<36}{:>10.4f} s'.format(func, t))
+
+results = pd.DataFrame(rows)
+results.to_csv(outpath+'popeye_scaling.csv', index=None)
+
+print('Power-law slopes (t ~ N^slope):')
+for func, slope in scaling_slopes(results).items():
+    print('  {:<36}{:>6.2f}'.format(func, slope))
+
+# ---------------------------------------------------------------------------------------
+# Scaling curves.
+
+fig, ax = plt.subplots(figsize=(7, 5))
+for func in results.columns.drop('n_particles'):
+    ax.loglog(results.n_particles.values, results[func].values, marker='o', label=func)
+ax.set_xlabel(r'$N_{\rm particles}$ (largest subhalo)')
+ax.set_ylabel('wall time [s]')
+ax.legend(fontsize=8)
+fig.savefig(outpath+'popeye_scaling.pdf', bbox_inches='tight')
+
+# ---------------------------------------------------------------------------------------
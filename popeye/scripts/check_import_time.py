@@ -0,0 +1,74 @@
+'''
+check_import_time - measures how long a fresh worker process takes to import popeye and
+the modules it runs, and fails (exit status 1) if any is over its budget, pulls in
+astropy or cannot be imported at all. The budgets are also checked by
+tests/test_import_time.py. Run before submitting jobs that start many short-lived workers.
+
+    python3 check_import_time.py
+'''
+
+import os
+import sys
+import subprocess
+import numpy as np
+
+# ---------------------------------------------------------------------------------------
+# Configuration.
+
+# seconds for a fresh interpreter to import each module (median of n_repeat runs,
+# interpreter start-up excluded), with some headroom over what they take now.
+budgets = {'popeye': 0.05, 'branch_properties': 0.7, 'kinematic_morphology': 0.35, 'gas_flows': 0.75,
+           'shared_blocks': 0.35, 'scheduler': 0.3}
+# modules which must not be imported on the way.
+forbidden = ['astropy']
+n_repeat = 5
+
+package_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ---------------------------------------------------------------------------------------
+
+snippet = '''
+import sys, time
+t = time.perf_counter()
+import popeye
+name = sys.argv[1]
+if name != 'popeye':
+    getattr(popeye, name)
+print(time.perf_counter() - t)
+print(','.join(sorted(set(m.split('.')[0] for m in sys.modules) & set(sys.argv[2].split(',')))))
+'''
+
+
+def measure(name, n_repeat=n_repeat):
+    '''
+    Median time (s) to import one module in n_repeat fresh interpreters, and the forbidden
+    modules it pulled in (comma separated). Raises ImportError if the import fails.
+    '''
+    env = dict(os.environ, PYTHONPATH=package_dir+os.pathsep+os.environ.get('PYTHONPATH', ''))
+    times = []
+    for i in range(n_repeat):
+        run = subprocess.run([sys.executable, '-c', snippet, name, ','.join(forbidden)], env=env,
+                             capture_output=True, text=True)
+        if run.returncode != 0:
+            raise ImportError(run.stderr.strip().split('\n')[-1])
+        out = run.stdout.split('\n')
+        times.append(float(out[0]))
+        found = out[1]
+    return np.median(times), found
+
+
+if __name__ == '__main__':
+    failed = False
+    for name, budget in budgets.items():
+        try:
+            t, found = measure(name)
+        except ImportError as error:
+            # an import error fails this module only; the others are still timed.
+            failed = True
+            print('%-22s import failed: %s FAIL' % (name, error))
+            continue
+        ok = (t <= budget) and (found == '')
+        failed |= not ok
+        print('%-22s %6.3f s  (budget %.2f s)%s %s' % (name, t, budget, '' if found == '' else '  imports '+found, 'ok' if ok else 'FAIL'))
+
+    sys.exit(1 if failed else 0)
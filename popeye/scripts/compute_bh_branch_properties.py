@@ -4,15 +4,38 @@ compute_bh_branch_properties - finds the bh and mass property history.
 
 import numpy as np
 import branch_properties
+import cold_gas_fraction
+import bh_params_subhalo
 import pandas as pd 
 import readtreeHDF5
+import instrumentation
+import simulation_registry
 
 # ---------------------------------------------------------------------------------------
 # Loading in z=0 objects to run script for.
 
 filepath = '/home/cduckworth/bh_star_gas_misalignment/popeye/catalogues/'
 basepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output/'
+# redshifts, box size and cosmology are read from this simulation (cached, see
+# simulation_registry).
+simulation_registry.use(basepath)
 treepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/postprocessing/trees/SubLink/'
+# set to a file path to write per-stage timing/IO records (JSON lines). None = off.
+timing_log = None
+# number of particle blocks read ahead in the background (0 = read and compute in turn).
+n_prefetch = 4
+# worker processes. > 1 runs roots longest-first under a memory budget (see scheduler).
+n_workers = 1
+memory_budget = 64e9
+# with n_workers > 1, read the particles of each wave of wave_size roots into shared memory
+# snapshot by snapshot, once for all workers (counted in memory_budget).
+share_blocks = False
+wave_size = 8
+# directory of the per-snapshot gas phase stores (see gas_field_cache), built on first use
+# (ideally local or node storage). None = temperatures are computed for every subhalo.
+field_dir = None
+# measured costs are stored here and used to refine the cost model on the next run.
+cost_model_path = filepath+'cost_model_bh.json'
 
 # loading in tree
 tree = readtreeHDF5.TreeDB(treepath)
@@ -27,11 +50,20 @@ snapnum = 99
 # ---------------------------------------------------------------------------------------
 # tetsting for the first 10 subuhalos.
 
-pout = pd.DataFrame({})
+if timing_log is not None:
+    instrumentation.enable(timing_log)
 
-for sub in tab.subfind_id.values:
-    print(sub)
-    pout = pout.append(branch_properties.branch_tabulate(sub, snapnum, tree, 1, basepath))
+# gas cell fields read per subhalo.
+gas_fields = cold_gas_fraction.GAS_FIELDS if field_dir is None else cold_gas_fraction.CACHED_GAS_FIELDS
+
+pout = branch_properties.tabulate_roots(tab.subfind_id.values, snapnum, tree, 1, basepath, task='bh', n_prefetch=n_prefetch,
+                                       n_workers=n_workers, treepath=treepath, memory_budget=memory_budget,
+                                       share_parts=[('gas', gas_fields), ('BH', bh_params_subhalo.BH_FIELDS)] if share_blocks else None,
+                                       wave_size=wave_size, cost_model_path=cost_model_path, field_dir=field_dir)
+
+if timing_log is not None:
+    instrumentation.disable()
+    instrumentation.print_summary(timing_log)
 
 pout.to_csv(filepath+'tng100_bh_history.csv', index=None)
 
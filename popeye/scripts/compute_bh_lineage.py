@@ -0,0 +1,29 @@
+'''
+compute_bh_lineage - per black hole time series (energy injection, mass growth, mass,
+Mdot, host subhalo, mergers) for every BH in the box.
+'''
+
+import numpy as np
+import bh_lineage
+import simulation_registry
+
+# ---------------------------------------------------------------------------------------
+# Configuration.
+
+filepath = '/home/cduckworth/bh_star_gas_misalignment/popeye/catalogues/'
+basepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output/'
+# redshifts, box size and cosmology are read from this simulation (cached, see
+# simulation_registry).
+simulation_registry.use(basepath)
+# sorted ParticleIDs indexes are kept here and reused by later runs.
+index_dir = filepath+'particle_index/'
+# snapshots back to z=1.
+snapnums = np.arange(50, 100)
+
+# ---------------------------------------------------------------------------------------
+
+lineage = bh_lineage.compute_bh_lineage(snapnums, basepath, cache_dir=index_dir)
+print(str(lineage['ParticleIDs'].shape[0])+' BHs, '+str(np.sum(lineage['merger']))+' mergers')
+bh_lineage.write_lineage_hdf5(lineage, filepath+'tng100_bh_lineage.hdf5')
+
+# ---------------------------------------------------------------------------------------
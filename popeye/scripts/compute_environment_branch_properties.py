@@ -0,0 +1,55 @@
+'''
+compute_environment_branch_properties - finds the environment history (N-th nearest
+neighbour distance, neighbour counts, distance to the nearest more massive subhalo) along
+the main branch.
+'''
+
+import pandas as pd
+import readtreeHDF5
+import environment
+import instrumentation
+import simulation_registry
+
+# ---------------------------------------------------------------------------------------
+# Loading in z=0 objects to run script for.
+
+filepath = '/home/cduckworth/bh_star_gas_misalignment/popeye/catalogues/'
+basepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output/'
+# redshifts, box size and cosmology are read from this simulation (cached, see
+# simulation_registry).
+simulation_registry.use(basepath)
+treepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/postprocessing/trees/SubLink/'
+# per snapshot KD-trees are kept here and reused by later runs.
+kdtree_dir = filepath+'kdtree/'
+# set to a file path to write per-stage timing/IO records (JSON lines). None = off.
+timing_log = None
+# neighbours: N-th nearest, counts within radii (physical kpc), above this stellar mass (Msol).
+n_neighbour = 5
+radii = [500., 1000., 2000.]
+min_mass = 1e9
+
+# loading in tree
+tree = readtreeHDF5.TreeDB(treepath)
+# loading in subfind_ids to consider
+tab = pd.read_csv(filepath+'tng100_mpl8_pa_info_v0.1.csv')
+
+# ---------------------------------------------------------------------------------------
+# exporting subfind_ids and snapnums.
+
+snapnum = 99
+
+# ---------------------------------------------------------------------------------------
+
+if timing_log is not None:
+    instrumentation.enable(timing_log)
+
+pout = environment.branch_environment(tab.subfind_id.values, snapnum, tree, 1, basepath, cache_dir=kdtree_dir,
+                                      n_neighbour=n_neighbour, radii=radii, min_mass=min_mass)
+
+if timing_log is not None:
+    instrumentation.disable()
+    instrumentation.print_summary(timing_log)
+
+pout.to_csv(filepath+'tng100_environment_history.csv', index=None)
+
+# ---------------------------------------------------------------------------------------
@@ -0,0 +1,59 @@
+'''
+compute_gas_flows_branch_properties - finds the gas inflow, outflow and retained mass (and
+their angular momentum) between consecutive main branch points.
+'''
+
+import numpy as np
+import gas_flows
+import pandas as pd
+import readtreeHDF5
+import instrumentation
+import simulation_registry
+
+# ---------------------------------------------------------------------------------------
+# Loading in z=0 objects to run script for.
+
+filepath = '/home/cduckworth/bh_star_gas_misalignment/popeye/catalogues/'
+basepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output/'
+# redshifts, box size and cosmology are read from this simulation (cached, see
+# simulation_registry).
+simulation_registry.use(basepath)
+treepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/postprocessing/trees/SubLink/'
+# set to a file path to write per-stage timing/IO records (JSON lines). None = off.
+timing_log = None
+# match Monte Carlo tracers instead of gas cell IDs (see gas_flows).
+tracers = False
+# roots walked together snapshot by snapshot. Each pass holds the stars and gas of its
+# progenitors at two snapshots in memory; None = every root in one pass.
+roots_per_pass = 500
+
+# loading in tree
+tree = readtreeHDF5.TreeDB(treepath)
+# loading in subfind_ids to consider
+tab = pd.read_csv(filepath+'tng100_mpl8_pa_info_v0.1.csv')
+
+# ---------------------------------------------------------------------------------------
+# exporting subfind_ids and snapnums.
+
+snapnum = 99
+
+# ---------------------------------------------------------------------------------------
+
+if timing_log is not None:
+    instrumentation.enable(timing_log)
+
+subfind_ids = tab.subfind_id.values
+step = roots_per_pass or subfind_ids.shape[0]
+pout = []
+for i in np.arange(0, subfind_ids.shape[0], step):
+    print(str(i)+' / '+str(subfind_ids.shape[0]))
+    pout.append(gas_flows.branch_gas_flows(subfind_ids[i:i + step], snapnum, tree, 1, basepath, tracers=tracers))
+pout = pd.concat(pout)
+
+if timing_log is not None:
+    instrumentation.disable()
+    instrumentation.print_summary(timing_log)
+
+pout.to_csv(filepath+'tng100_gas_flows_history.csv', index=None)
+
+# ---------------------------------------------------------------------------------------
@@ -0,0 +1,30 @@
+'''
+compute_merger_events - every merger (snapshot, stellar mass ratio, secondary gas content)
+along the main branch of the catalogue subhalos.
+'''
+
+import pandas as pd
+import merger_events
+import simulation_registry
+
+# ---------------------------------------------------------------------------------------
+# Configuration.
+
+filepath = '/home/cduckworth/bh_star_gas_misalignment/popeye/catalogues/'
+basepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output/'
+# redshifts, box size and cosmology are read from this simulation (cached, see
+# simulation_registry).
+simulation_registry.use(basepath)
+treepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/postprocessing/trees/SubLink/'
+# loading in subfind_ids to consider
+tab = pd.read_csv(filepath+'tng100_mpl8_pa_info_v0.1.csv')
+
+snapnum = 99
+
+# ---------------------------------------------------------------------------------------
+
+events = merger_events.merger_events(tab.subfind_id.values, snapnum, treepath, basepath)
+print(str(len(events))+' mergers, '+str(sum(events.mass_ratio > 0.25))+' major')
+events.to_csv(filepath+'tng100_merger_events.csv', index=None)
+
+# ---------------------------------------------------------------------------------------
@@ -0,0 +1,56 @@
+'''
+compute_morphology_branch_properties - finds the stellar kinematic morphology history
+(kappa_rot, disc/bulge fractions, mean circularity).
+'''
+
+import branch_properties
+import pandas as pd
+import readtreeHDF5
+import instrumentation
+import simulation_registry
+
+# ---------------------------------------------------------------------------------------
+# Loading in z=0 objects to run script for.
+
+filepath = '/home/cduckworth/bh_star_gas_misalignment/popeye/catalogues/'
+basepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output/'
+# redshifts, box size and cosmology are read from this simulation (cached, see
+# simulation_registry).
+simulation_registry.use(basepath)
+treepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/postprocessing/trees/SubLink/'
+# set to a file path to write per-stage timing/IO records (JSON lines). None = off.
+timing_log = None
+# number of particle blocks read ahead in the background (0 = read and compute in turn).
+n_prefetch = 4
+# worker processes. > 1 runs roots longest-first under a memory budget (see scheduler).
+n_workers = 1
+memory_budget = 64e9
+# measured costs are stored here and used to refine the cost model on the next run.
+cost_model_path = filepath+'cost_model_morphology.json'
+
+# loading in tree
+tree = readtreeHDF5.TreeDB(treepath)
+# loading in subfind_ids to consider
+tab = pd.read_csv(filepath+'tng100_mpl8_pa_info_v0.1.csv')
+
+# ---------------------------------------------------------------------------------------
+# exporting subfind_ids and snapnums.
+
+snapnum = 99
+
+# ---------------------------------------------------------------------------------------
+
+if timing_log is not None:
+    instrumentation.enable(timing_log)
+
+pout = branch_properties.tabulate_roots(tab.subfind_id.values, snapnum, tree, 1, basepath, task='morphology', n_prefetch=n_prefetch,
+                                       n_workers=n_workers, treepath=treepath, memory_budget=memory_budget,
+                                       cost_model_path=cost_model_path)
+
+if timing_log is not None:
+    instrumentation.disable()
+    instrumentation.print_summary(timing_log)
+
+pout.to_csv(filepath+'tng100_morphology_history.csv', index=None)
+
+# ---------------------------------------------------------------------------------------
@@ -0,0 +1,60 @@
+'''
+export_branch_bundles - writes one compressed HDF5 bundle per root (see branch_bundle):
+the particles of every main branch progenitor back to lookback_z, with the catalogue rows
+and centres of the branch. Later runs can then read a galaxy's history from its bundle by
+calling branch_bundle.use(bundle_dir) before they start.
+'''
+
+import pandas as pd
+import readtreeHDF5
+import branch_bundle
+import instrumentation
+import simulation_registry
+
+# ---------------------------------------------------------------------------------------
+# Loading in z=0 objects to run script for.
+
+filepath = '/home/cduckworth/bh_star_gas_misalignment/popeye/catalogues/'
+basepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output/'
+# redshifts, box size and cosmology are read from this simulation (cached, see
+# simulation_registry).
+simulation_registry.use(basepath)
+treepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/postprocessing/trees/SubLink/'
+# bundles are written here (ideally local or node storage), one file per root.
+bundle_dir = filepath+'bundles/'
+# set to a file path to write per-stage timing/IO records (JSON lines). None = off.
+timing_log = None
+# particle types and fields to keep for every progenitor.
+parts = branch_bundle.PARTICLE_FIELDS
+lookback_z = 1
+# existing bundles are kept unless this is set.
+overwrite = False
+
+# loading in tree
+tree = readtreeHDF5.TreeDB(treepath)
+# loading in subfind_ids to consider
+tab = pd.read_csv(filepath+'tng100_mpl8_pa_info_v0.1.csv')
+
+# ---------------------------------------------------------------------------------------
+# exporting subfind_ids and snapnums.
+
+snapnum = 99
+
+# ---------------------------------------------------------------------------------------
+
+if timing_log is not None:
+    instrumentation.enable(timing_log)
+
+for sub in tab.subfind_id.values:
+    print(sub)
+    with instrumentation.root(sub, snapnum):
+        branch_bundle.export_bundle(sub, snapnum, tree, lookback_z, basepath, bundle_dir, parts=parts, overwrite=overwrite)
+
+# indexing the bundles once here, so readers do not have to open them all.
+branch_bundle.update_manifest(bundle_dir)
+
+if timing_log is not None:
+    instrumentation.disable()
+    instrumentation.print_summary(timing_log)
+
+# ---------------------------------------------------------------------------------------
@@ -0,0 +1,147 @@
+'''
+run_queue_worker - work queue mode for the branch and anisotropy computations. Any number
+of copies of this script (on any number of nodes) take batches of roots from a shared
+SQLite ledger (see work_queue) and write one output file per batch. Batches held by dead
+workers are handed out again once their lease expires.
+
+    python3 run_queue_worker.py          # work until the ledger is empty
+    python3 run_queue_worker.py merge    # combine the batch outputs into one catalogue
+'''
+
+import os
+import sys
+import numpy as np
+import pandas as pd 
+import work_queue
+import atomic_write
+import prefetch
+import scheduler
+import simulation_registry
+
+# ---------------------------------------------------------------------------------------
+# Configuration.
+
+# 'bh' (branch_tabulate), 'gas' (branch_tabulate_gas_only), 'morphology'
+# (branch_tabulate_morphology), 'kinematics' (branch_tabulate_kinematics), 'flows'
+# (gas_flows.branch_gas_flows) or 'anisotropy'.
+task = 'bh'
+
+filepath = '/home/cduckworth/bh_star_gas_misalignment/popeye/catalogues/'
+basepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/output/'
+# redshifts, box size and cosmology are read from this simulation (cached, see
+# simulation_registry).
+simulation_registry.use(basepath)
+treepath = '/simons/scratch/sgenel/IllustrisTNG/L75n1820TNG/postprocessing/trees/SubLink/'
+# ledger and batch outputs must be on the shared filesystem.
+ledger = filepath+'queue/'+task+'_ledger.sqlite'
+outdir = filepath+'queue/'+task+'/'
+batch_size = 20
+lease_seconds = 1800
+n_prefetch = 4
+# directory of the per-snapshot gas phase stores of the 'bh' and 'gas' tasks (see
+# gas_field_cache), shared by all workers. None = temperatures computed per subhalo.
+field_dir = None
+# approximate DM anisotropy (see anisotropy_radii.compute_anisotropy_radii). None = all.
+max_DM_per_bin = None
+# batches are populated longest estimated cost first (see scheduler), refined by this model.
+cost_model_path = filepath+'cost_model_'+task+'.json'
+
+output_names = {'bh': 'tng100_bh_history.csv', 'gas': 'tng100_gas_history.csv',
+                'morphology': 'tng100_morphology_history.csv', 'kinematics': 'tng100_kinematics_history.csv',
+                'flows': 'tng100_gas_flows_history.csv',
+                'anisotropy': 'tng100_mpl8_velocity_anisotropy.hdf5'}
+extension = '.hdf5' if task == 'anisotropy' else '.csv'
+
+# ---------------------------------------------------------------------------------------
+
+def run_batch_branch(roots, tree):
+    import branch_properties
+    import gas_flows
+    if task in ('kinematics', 'flows'):
+        # the whole batch is walked snapshot by snapshot, one read per snapshot.
+        tabulate = branch_properties.branch_tabulate_kinematics if task == 'kinematics' else gas_flows.branch_gas_flows
+        return pd.concat([tabulate([sub for sub, s in roots if s == snap], snap, tree, 1, basepath)
+                          for snap in sorted(set(snap for sub, snap in roots))])
+    tabulate = branch_properties.TABULATE[task]
+    options = branch_properties.tabulate_options(task, n_prefetch, field_dir)
+    return pd.concat([tabulate(sub, snap, tree, 1, basepath, **options) for sub, snap in roots])
+
+
+def run_batch_anisotropy(roots):
+    import anisotropy_radii
+    output = []
+    blocks = prefetch.prefetch(lambda sub, snap: anisotropy_radii.load_anisotropy_particles(sub, snap, basepath),
+                               roots, n_prefetch=n_prefetch)
+    for (sub, snap), particles, error in blocks:
+        if error is not None:
+            continue
+        try:
+            output.append(anisotropy_radii.compute_anisotropy_radii(sub, snap, particles, max_DM_per_bin=max_DM_per_bin))
+        except Exception:
+            continue
+    return output
+
+
+def write_batch(batch_id, result):
+    # renamed into place once written, so a half written file is never merged.
+    filename = outdir+'batch_%06d' % batch_id + extension
+    with atomic_write.temporary_path(filename) as tmpname:
+        if task == 'anisotropy':
+            import anisotropy_radii
+            anisotropy_radii.write_anisotropy_hdf5(result, tmpname)
+        else:
+            result.to_csv(tmpname, index=None)
+
+
+def merge():
+    batch_files = sorted(f for f in os.listdir(outdir) if f.startswith('batch_') and f.endswith(extension))
+    print('Merging '+str(len(batch_files))+' batches. Ledger: '+str(queue.progress()))
+    if task == 'anisotropy':
+        import anisotropy_radii
+        output = []
+        for f in batch_files:
+            output.extend(anisotropy_radii.read_anisotropy_hdf5(outdir+f))
+        anisotropy_radii.write_anisotropy_hdf5(output, filepath+output_names[task])
+    else:
+        pout = pd.concat([pd.read_csv(outdir+f) for f in batch_files])
+        pout.to_csv(filepath+output_names[task], index=None)
+
+# ---------------------------------------------------------------------------------------
+# Populating (one worker only, the others wait for it) and working through the ledger.
+
+os.makedirs(outdir, exist_ok=True)
+queue = work_queue.WorkQueue(ledger, lease_seconds=lease_seconds)
+
+if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+    merge()
+    sys.exit()
+
+# loading in subfind_ids to consider
+tab = pd.read_csv(filepath+'tng100_mpl8_pa_info_v0.1.csv')
+snapnum = 99
+
+import readtreeHDF5
+tree = readtreeHDF5.TreeDB(treepath)
+
+def ordered_roots():
+    # big roots first, so the longest batches do not start last and leave workers idle.
+    # anisotropy only uses the root snapshot (lookback to z=0).
+    roots = [(sub, snapnum) for sub in tab.subfind_id.values]
+    model = scheduler.CostModel.load(cost_model_path, task)
+    model.fit()
+    features = scheduler.branch_features(tree, roots, 0 if task == 'anisotropy' else 1)
+    cost = [model.estimate(*f)[0] for f in features]
+    return [roots[i] for i in np.argsort(cost, kind='stable')[::-1]]
+
+queue.populate_from(ordered_roots, batch_size=batch_size)
+
+for batch_id, roots in queue.iter_batches():
+    print('batch '+str(batch_id)+': '+str(len(roots))+' roots')
+    if task == 'anisotropy':
+        write_batch(batch_id, run_batch_anisotropy(roots))
+    else:
+        write_batch(batch_id, run_batch_branch(roots, tree))
+
+print('Ledger empty: '+str(queue.progress()))
+
+# ---------------------------------------------------------------------------------------
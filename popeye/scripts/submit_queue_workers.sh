@@ -0,0 +1,18 @@
+#!/bin/bash
+# Standard output and error:
+#SBATCH -o ./queue_out.%A_%a
+#SBATCH -e ./queue_err.%A_%a
+# Initial working directory
+#SBATCH -D /home/cduckworth/bh_star_gas_misalignment/popeye/scripts
+# Job name:
+#SBATCH -J "queue workers"
+# One worker per array task. Add or cancel tasks at any time; the ledger hands out work.
+#SBATCH --array=0-15
+#SBATCH -N1 -n1
+#
+# Wall clock limit.
+#SBATCH --time=24:00:00
+
+# Run the program.
+module load slurm python3 gcc
+python3 ./run_queue_worker.py
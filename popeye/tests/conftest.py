@@ -0,0 +1,32 @@
+'''
+Shared fixtures for the popeye tests: a small mock TNG simulation (see mock_tng) built
+once per session, so the pipeline runs without /simons/scratch.
+
+Tests using it need the snapshot and groupcat readers (illustris_python); their modules
+call pytest.importorskip on both before importing from lib, so they are skipped rather
+than failing at collection when the readers are missing.
+'''
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+
+@pytest.fixture(scope='session')
+def mock_sim(tmp_path_factory):
+    '''
+    (basePath, tree) of a mock with 4 surviving subhaloes over snapshots 96-99.
+    '''
+    pytest.importorskip('snapshot')
+    pytest.importorskip('groupcat')
+    import mock_tng
+    import simulation_registry
+    simdir = str(tmp_path_factory.mktemp('mock'))
+    basePath = mock_tng.make_mock_simulation(simdir, n_subhalos=4, n_particles=2000, snapnums=np.arange(96, 100),
+                                             n_chunks=2, merger_rate=0.1, seed=1)
+    simulation_registry.use(basePath)
+    tree = mock_tng.MockTreeDB(os.path.join(simdir, 'postprocessing', 'trees', 'SubLink'))
+    return basePath, tree
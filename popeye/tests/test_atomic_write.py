@@ -0,0 +1,33 @@
+'''
+Tests of atomic_write.temporary_path.
+'''
+
+import os
+import pytest
+import atomic_write
+
+
+def test_replaced_only_when_complete(tmp_path):
+    path = str(tmp_path / 'out.txt')
+    with atomic_write.temporary_path(path) as tmp:
+        with open(tmp, 'w') as f:
+            f.write('first')
+    with pytest.raises(RuntimeError):
+        with atomic_write.temporary_path(path) as tmp:
+            with open(tmp, 'w') as f:
+                f.write('partial')
+            raise RuntimeError
+    with open(path) as f:
+        assert f.read() == 'first'
+    assert os.listdir(str(tmp_path)) == ['out.txt']
+
+
+def test_existing_directory_kept(tmp_path):
+    directory = str(tmp_path / 'store')
+    os.makedirs(os.path.join(directory, 'a'))
+    # a directory built by another process first is not replaced, and the copy is removed.
+    with pytest.raises(OSError):
+        with atomic_write.temporary_path(directory) as tmp:
+            os.makedirs(os.path.join(tmp, 'b'))
+    assert os.listdir(str(tmp_path)) == ['store']
+    assert os.listdir(directory) == ['a']
@@ -0,0 +1,30 @@
+'''
+Tests of bh_lineage on the mock.
+'''
+
+import numpy as np
+import pytest
+
+pytest.importorskip('snapshot')
+pytest.importorskip('groupcat')
+
+import bh_lineage
+
+
+def test_cached_index_matches(mock_sim, tmp_path):
+    basePath, tree = mock_sim
+    snapnums = np.arange(96, 100)
+    direct = bh_lineage.compute_bh_lineage(snapnums, basePath)
+    assert direct['ParticleIDs'].shape[0] > 0
+    first = bh_lineage.compute_bh_lineage(snapnums, basePath, cache_dir=str(tmp_path))
+    cached = bh_lineage.compute_bh_lineage(snapnums, basePath, cache_dir=str(tmp_path))
+    for key in direct:
+        assert np.array_equal(direct[key], first[key], equal_nan=True)
+        assert np.array_equal(direct[key], cached[key], equal_nan=True)
+
+    # every BH's series holds its own values at each snapshot.
+    for k, snap in enumerate(snapnums):
+        props = bh_lineage.load_bh_snapshot(basePath, snap)
+        rows = np.searchsorted(direct['ParticleIDs'], props['ParticleIDs'])
+        assert np.array_equal(direct['BH_Mass'][rows, k], props['BH_Mass'])
+        assert np.sum(direct['BH_Progs'][:, k] >= 0) == props['count']
@@ -0,0 +1,39 @@
+'''
+Tests of reading subhalos through branch_bundle on the mock simulation.
+'''
+
+import os
+import numpy as np
+import pytest
+
+ss = pytest.importorskip('snapshot')
+pytest.importorskip('groupcat')
+
+import branch_bundle
+
+FIELDS = ['Coordinates', 'Masses']
+
+
+def test_bundles_read_through_manifest(mock_sim, tmp_path, monkeypatch):
+    basePath, tree = mock_sim
+    bundle_dir = str(tmp_path / 'bundles')
+    for sub in [0, 1]:
+        branch_bundle.export_bundle(sub, 99, tree, 1, basePath, bundle_dir, parts={'gas': FIELDS})
+    monkeypatch.setenv(branch_bundle.ENV_BUNDLE_DIR, bundle_dir)
+    catalogue = branch_bundle.catalogue(1, 99, bundle_dir)
+    for snapnum, subfind_id in zip(catalogue['SnapNum'], catalogue['SubfindID']):
+        props = branch_bundle.lookup(basePath, snapnum, subfind_id, 'gas', FIELDS)
+        direct = ss.loadSubhalo(basePath, snapnum, subfind_id, 'gas', fields=FIELDS)
+        assert props['count'] == direct['count']
+        assert np.array_equal(props['Masses'], direct['Masses'])
+    # not the simulation the bundles were exported from.
+    assert branch_bundle.lookup(basePath+'_other', 99, 1, 'gas', FIELDS) is None
+    assert np.array_equal(branch_bundle.load_subhalo(basePath, 99, 1, 'gas', ['Masses']),
+                          ss.loadSubhalo(basePath, 99, 1, 'gas', fields=['Masses']))
+
+    # a new reader takes the branch points from the manifest, without opening the bundles.
+    assert sorted(branch_bundle.read_manifest(bundle_dir)) == ['bundle_099_0.hdf5', 'bundle_099_1.hdf5']
+    monkeypatch.setattr(branch_bundle, '_manifest_entry', None)
+    index = branch_bundle.BundleIndex(bundle_dir)
+    assert index.files[(99, 1)] == os.path.join(bundle_dir, 'bundle_099_1.hdf5')
+    index.close()
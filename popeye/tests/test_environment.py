@@ -0,0 +1,24 @@
+'''
+Tests of the cached environment KD-trees on the mock.
+'''
+
+import numpy as np
+import pytest
+
+pytest.importorskip('snapshot')
+pytest.importorskip('groupcat')
+
+import environment
+
+
+def test_cache_per_simulation(mock_sim, tmp_path):
+    # two simulations sharing one cache_dir each get the tree of their own subhalos.
+    import mock_tng
+    cache_dir = str(tmp_path / 'cache')
+    other = mock_tng.make_mock_simulation(str(tmp_path / 'other'), n_subhalos=2, n_particles=500,
+                                          snapnums=np.arange(98, 100), n_chunks=1, seed=3)
+    for basePath in [mock_sim[0], other, mock_sim[0]]:
+        built = environment.build_environment(basePath, 99)
+        cached = environment.load_environment(basePath, 99, cache_dir)
+        assert np.array_equal(cached.mass, built.mass)
+        assert np.array_equal(cached.tree.data, built.tree.data)
@@ -0,0 +1,24 @@
+'''
+Import-time budgets of popeye and the modules its workers run, checked in fresh
+interpreters with the budget table of scripts/check_import_time.py.
+'''
+
+import os
+import importlib.util
+import pytest
+
+pytest.importorskip('snapshot')
+pytest.importorskip('groupcat')
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'check_import_time.py')
+spec = importlib.util.spec_from_file_location('check_import_time', SCRIPT)
+check_import_time = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(check_import_time)
+
+
+@pytest.mark.parametrize('name', sorted(check_import_time.budgets))
+def test_import_time(name):
+    t, found = check_import_time.measure(name)
+    # no astropy (or other forbidden module) on the way.
+    assert found == ''
+    assert t <= check_import_time.budgets[name]
@@ -0,0 +1,25 @@
+'''
+Tests of the HDF5 read counters of instrumentation on the mock simulation.
+'''
+
+import pytest
+
+ss = pytest.importorskip('snapshot')
+
+import instrumentation
+
+
+def test_bytes_read_counts_particle_loads(mock_sim, tmp_path):
+    basePath, tree = mock_sim
+    fields = ['Coordinates', 'Masses']
+    instrumentation.enable(str(tmp_path / 'timing.jsonl'), mode='w')
+    try:
+        start = instrumentation.io_counters()
+        props = ss.loadSubhalo(basePath, 99, 0, 'gas', fields=fields)
+        end = instrumentation.io_counters()
+    finally:
+        instrumentation.disable()
+    nbytes = sum(props[field].nbytes for field in fields)
+    assert nbytes > 10000
+    # the particle data, plus the few offsets and lengths read from the group catalogue.
+    assert nbytes <= end['bytes_read'] - start['bytes_read'] < nbytes + 1024
@@ -0,0 +1,114 @@
+'''
+Smoke tests running the branch stages on the mock simulation.
+'''
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('snapshot')
+gc = pytest.importorskip('groupcat')
+
+import branch_properties
+import cold_gas_fraction
+import simulation_registry
+
+
+def test_branch_tabulate(mock_sim):
+    basePath, tree = mock_sim
+    tab = branch_properties.branch_tabulate(0, 99, tree, 1, basePath)
+    assert tab.shape[0] == 4
+    assert np.all(tab.root_subfind.values == 0)
+    assert np.all(np.diff(tab.branch_snapnum.values) < 0)
+    fraction = tab.cold_gas_fraction.values
+    assert np.all((fraction >= 0) & (fraction <= 1))
+
+
+def test_branch_tabulate_gas_only(mock_sim):
+    basePath, tree = mock_sim
+    tab = branch_properties.branch_tabulate_gas_only(1, 99, tree, 1, basePath, n_prefetch=2)
+    assert tab.shape[0] == 4
+    assert np.all(np.isfinite(tab.gas_frac_2re.values))
+
+
+def test_compute_fraction_set(mock_sim):
+    basePath, tree = mock_sim
+    subs = gc.loadSubhalos(basePath, 99, fields=['SubhaloPos', 'SubhaloHalfmassRadType'])
+    ids = np.arange(subs['count'])
+    radii = 2 * subs['SubhaloHalfmassRadType'][:, 4]
+    cold, total = cold_gas_fraction.compute_fraction_set(ids, np.full(ids.shape[0], 99), radii, subs['SubhaloPos'],
+                                                         basePath=basePath, return_total=True)
+    assert np.all(total > 0)
+    assert np.all(cold <= total)
+    # the cold mass alone, and one subhalo at a time, agree.
+    assert np.array_equal(cold, cold_gas_fraction.compute_fraction_set(ids, np.full(ids.shape[0], 99), radii, subs['SubhaloPos'],
+                                                                      basePath=basePath))
+    assert cold[0] == cold_gas_fraction.compute_fraction_2re(0, 99, radii[0], subs['SubhaloPos'][0], basePath)
+
+
+def test_tabulate_roots(mock_sim):
+    basePath, tree = mock_sim
+    tab = branch_properties.tabulate_roots([0, 1], 99, tree, 1, basePath, task='morphology')
+    assert tab.shape[0] == 8
+    assert sorted(set(tab.root_subfind.values)) == [0, 1]
+    assert np.array_equal(tab.index.values, np.arange(8))
+
+
+def test_registry_cache_follows_simulation(tmp_path, monkeypatch):
+    import mock_tng
+    simdir, cache = str(tmp_path / 'sim'), str(tmp_path / 'cache')
+    basePath = mock_tng.make_mock_simulation(simdir, n_subhalos=2, n_particles=200, snapnums=np.arange(98, 100),
+                                             n_chunks=1, seed=2)
+    key = os.path.abspath(basePath)
+    assert list(simulation_registry.get(basePath, cache).snapnums) == [98, 99]
+    # regenerated at the same path: more snapshots, then a different box.
+    mock_tng.make_mock_simulation(simdir, n_subhalos=2, n_particles=200, snapnums=np.arange(97, 100), n_chunks=1, seed=2)
+    simulation_registry._loaded.pop(key)
+    assert list(simulation_registry.get(basePath, cache).snapnums) == [97, 98, 99]
+    mock_tng.make_mock_simulation(simdir, n_subhalos=2, n_particles=200, snapnums=np.arange(97, 100), n_chunks=1,
+                                  boxsize=50000., seed=2)
+    simulation_registry._loaded.pop(key)
+    assert simulation_registry.get(basePath, cache).boxsize == 50000.
+    # unchanged: served from the cache file.
+    simulation_registry._loaded.pop(key)
+    monkeypatch.setattr(simulation_registry, 'read_simulation', None)
+    assert simulation_registry.get(basePath, cache).boxsize == 50000.
+
+
+def test_cold_mass_from_field_store(mock_sim, tmp_path):
+    basePath, tree = mock_sim
+    field_dir = str(tmp_path / 'fields')
+    subs = gc.loadSubhalos(basePath, 99, fields=['SubhaloPos', 'SubhaloHalfmassRadType'])
+    ids = np.arange(subs['count'])
+    radii = 2 * subs['SubhaloHalfmassRadType'][:, 4]
+    snaps = np.full(ids.shape[0], 99)
+    cold = cold_gas_fraction.compute_fraction_set(ids, snaps, radii, subs['SubhaloPos'], basePath=basePath)
+    cached = cold_gas_fraction.compute_fraction_set(ids, snaps, radii, subs['SubhaloPos'], basePath=basePath, field_dir=field_dir)
+    assert np.any(cold > 0)
+    assert np.array_equal(cached, cold)
+    assert cold_gas_fraction.compute_fraction_2re(0, 99, radii[0], subs['SubhaloPos'][0], basePath, field_dir=field_dir) == cold[0]
+    # and through the branch tables.
+    for task in ['bh', 'gas']:
+        tab = branch_properties.tabulate_roots([0, 1], 99, tree, 1, basePath, task=task)
+        cached = branch_properties.tabulate_roots([0, 1], 99, tree, 1, basePath, task=task, field_dir=field_dir)
+        assert cached.equals(tab)
+    directory = os.path.join(field_dir, simulation_registry.simulation_key(basePath))
+    assert sorted(os.listdir(directory)) == ['gas_fields_0'+str(snap) for snap in range(96, 100)]
+
+
+def test_field_store_per_simulation(mock_sim, tmp_path):
+    # two simulations sharing one field_dir each get the cold masses of their own cells.
+    import mock_tng
+    field_dir = str(tmp_path / 'fields')
+    other = mock_tng.make_mock_simulation(str(tmp_path / 'other'), n_subhalos=2, n_particles=500,
+                                          snapnums=np.arange(98, 100), n_chunks=1, seed=3)
+    for basePath in [mock_sim[0], other, mock_sim[0]]:
+        subs = gc.loadSubhalos(basePath, 99, fields=['SubhaloPos', 'SubhaloHalfmassRadType'])
+        ids = np.arange(subs['count'])
+        radii = 2 * subs['SubhaloHalfmassRadType'][:, 4]
+        snaps = np.full(ids.shape[0], 99)
+        cold = cold_gas_fraction.compute_fraction_set(ids, snaps, radii, subs['SubhaloPos'], basePath=basePath)
+        cached = cold_gas_fraction.compute_fraction_set(ids, snaps, radii, subs['SubhaloPos'], basePath=basePath,
+                                                        field_dir=field_dir)
+        assert np.array_equal(cached, cold)
+    assert len(os.listdir(field_dir)) == 2
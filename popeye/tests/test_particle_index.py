@@ -0,0 +1,24 @@
+'''
+Tests of the cached particle_index indexes on the mock.
+'''
+
+import numpy as np
+import pytest
+
+pytest.importorskip('snapshot')
+pytest.importorskip('groupcat')
+
+import particle_index
+
+
+def test_cache_per_simulation(mock_sim, tmp_path):
+    # two simulations sharing one cache_dir each get the index of their own particles.
+    import mock_tng
+    cache_dir = str(tmp_path / 'cache')
+    other = mock_tng.make_mock_simulation(str(tmp_path / 'other'), n_subhalos=2, n_particles=500,
+                                          snapnums=np.arange(98, 100), n_chunks=1, seed=3)
+    for basePath in [mock_sim[0], other, mock_sim[0]]:
+        ids = particle_index.load_ids(basePath, 99, 'gas')
+        index = particle_index.load_index(basePath, 99, 'gas', cache_dir)
+        assert np.array_equal(index.sorted_ids, np.sort(ids))
+        assert np.array_equal(index.locate(ids), np.arange(ids.shape[0]))
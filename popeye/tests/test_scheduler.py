@@ -0,0 +1,29 @@
+'''
+Tests of scheduler.run_scheduled.
+'''
+
+import numpy as np
+import pytest
+
+pytest.importorskip('snapshot')
+pytest.importorskip('groupcat')
+
+import scheduler
+
+
+def _task(sub, snap):
+    # pool task failing on odd subhalos.
+    if sub % 2:
+        raise IOError('missing file')
+    return sub
+
+
+def test_failed_tasks_not_recorded():
+    roots = [(sub, 99) for sub in range(6)]
+    features = [scheduler.CostModel.features(np.full((3, 6), 100 * (sub + 1))) for sub, snap in roots]
+    model = scheduler.CostModel('gas')
+    results, errors = scheduler.run_scheduled(_task, roots, features, model, n_workers=2, memory_budget=1e12,
+                                              verbose=False)
+    assert results == [0, None, 2, None, 4, None]
+    assert [e is None for e in errors] == [True, False] * 3
+    assert sorted(record['root'][0] for record in model.records) == [0, 2, 4]
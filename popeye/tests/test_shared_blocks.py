@@ -0,0 +1,82 @@
+'''
+Tests of shared_blocks.RollingBlocks under scheduler.run_scheduled on the mock.
+'''
+
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('snapshot')
+pytest.importorskip('groupcat')
+
+import shared_blocks
+import scheduler
+import cold_gas_fraction
+import mock_tng
+
+
+def _branch_gas(sub, snap, basePath):
+    # pool task: gas mass of every branch point, and whether it came from a shared block.
+    tree = mock_tng.MockTreeDB(os.path.join(os.path.dirname(basePath), 'postprocessing', 'trees', 'SubLink'))
+    branch = tree.get_main_branch(snap, sub, keysel=['SubfindID', 'SnapNum'])
+    shared, masses = [], []
+    for b, s in zip(branch.SubfindID, branch.SnapNum):
+        shared.append(shared_blocks.lookup(s, b, 'gas', cold_gas_fraction.GAS_FIELDS) is not None)
+        masses.append(np.sum(cold_gas_fraction.load_gas(b, s, basePath)['Masses']))
+    return shared, masses
+
+
+def test_rolling_blocks(mock_sim):
+    basePath, tree = mock_sim
+    roots = [(sub, 99) for sub in range(4)]
+    features, points = scheduler.branch_features(tree, roots, 1, return_points=True)
+    expected = [_branch_gas(sub, snap, basePath)[1] for sub, snap in roots]
+
+    blocks = shared_blocks.RollingBlocks(basePath, [('gas', cold_gas_fraction.GAS_FIELDS)], points, wave_size=2)
+    results, errors = scheduler.run_scheduled(_branch_gas, roots, features, scheduler.CostModel('gas'), n_workers=2,
+                                              memory_budget=1e12, args=(basePath,), blocks=blocks, verbose=False)
+    assert errors == [None] * 4
+    for (shared, masses), reference in zip(results, expected):
+        assert all(shared)
+        assert np.allclose(masses, reference)
+    # every block was freed as its wave finished.
+    assert blocks.nbytes() == 0
+    blocks.close()
+
+
+def test_rolling_blocks_estimate(mock_sim):
+    basePath, tree = mock_sim
+    roots = [(sub, 99) for sub in range(4)]
+    features, points = scheduler.branch_features(tree, roots, 1, return_points=True)
+    blocks = shared_blocks.RollingBlocks(basePath, [('gas', cold_gas_fraction.GAS_FIELDS)], points, wave_size=2)
+    blocks.plan([3, 2, 1, 0])
+    try:
+        estimate = blocks.estimate(2)
+        assert blocks.start(2)[shared_blocks.ENV_PREFIX].startswith('pop')
+        # only the wave of roots 3 and 2 is loaded, and the estimate is its particle data
+        # (the index and spec of each snapshot's block come on top).
+        assert estimate <= blocks.nbytes() < estimate + 1024 * 4
+        assert blocks.estimate(3) == 0
+        assert blocks.estimate(0) > 0
+        blocks.start(3)
+        blocks.done(2)
+        assert blocks.nbytes() > 0
+        blocks.done(3)
+        assert blocks.nbytes() == 0
+    finally:
+        blocks.close()
+
+
+def test_blocks_detached_after_task(mock_sim):
+    basePath, tree = mock_sim
+    roots = [(0, 99)]
+    features, points = scheduler.branch_features(tree, roots, 1, return_points=True)
+    blocks = shared_blocks.RollingBlocks(basePath, [('gas', cold_gas_fraction.GAS_FIELDS)], points)
+    blocks.plan([0])
+    result, error, wall, peak = scheduler._run_measured(_branch_gas, roots[0], (basePath,), blocks.start(0))
+    assert error is None and all(result[0])
+    # the task's attachments are dropped when it ends, before the wave is freed.
+    assert len(shared_blocks._attached) == 0
+    blocks.done(0)
+    assert blocks.nbytes() == 0
+    blocks.close()
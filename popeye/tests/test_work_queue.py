@@ -0,0 +1,120 @@
+'''
+Tests of the work_queue ledger with several worker processes sharing one SQLite file.
+'''
+
+import os
+import sys
+import time
+import sqlite3
+import subprocess
+import work_queue
+
+LIB = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib')
+
+# a worker: records every batch it finishes in log. With hang, it stops after claiming its
+# first batch and waits to be killed (the lease stays held until it expires).
+WORKER = '''
+import sys, time
+sys.path.insert(0, sys.argv[1])
+import work_queue
+ledger, name, log, hang = sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5] == '1'
+queue = work_queue.WorkQueue(ledger, lease_seconds=1.)
+for batch_id, roots in queue.iter_batches(worker=name):
+    if hang:
+        open(log, 'w').write(str(batch_id))
+        time.sleep(3600)
+    time.sleep(0.05)
+    with open(log, 'a') as f:
+        f.write(str(batch_id)+'\\n')
+'''
+
+
+def _start(ledger, name, log, hang=False):
+    return subprocess.Popen([sys.executable, '-c', WORKER, LIB, ledger, name, log, '1' if hang else '0'])
+
+
+def _wait_for(path, timeout=30.):
+    start = time.time()
+    while not os.path.exists(path) or os.path.getsize(path) == 0:
+        assert time.time() - start < timeout
+        time.sleep(0.02)
+
+
+def test_dead_worker_batch_done_once(tmp_path):
+    ledger = str(tmp_path / 'ledger.sqlite')
+    queue = work_queue.WorkQueue(ledger, lease_seconds=1.)
+    n_batches = queue.populate([(sub, 99) for sub in range(40)], batch_size=2)
+
+    # the first worker claims the oldest batch and is killed while holding it.
+    victim_log = str(tmp_path / 'victim.log')
+    victim = _start(ledger, 'victim', victim_log, hang=True)
+    _wait_for(victim_log)
+    victim.kill()
+    victim.wait()
+    with open(victim_log) as f:
+        lost = int(f.read())
+
+    logs = [str(tmp_path / ('worker_'+str(i)+'.log')) for i in range(3)]
+    workers = [_start(ledger, 'worker_'+str(i), log) for i, log in enumerate(logs)]
+    for worker in workers:
+        assert worker.wait(timeout=60) == 0
+
+    done = []
+    for log in logs:
+        if os.path.exists(log):
+            with open(log) as f:
+                done += [int(line) for line in f.read().split()]
+    assert sorted(done) == list(range(1, n_batches + 1))
+    assert queue.progress() == {work_queue.DONE: n_batches}
+    conn = sqlite3.connect(ledger)
+    worker, attempts = conn.execute('SELECT worker, attempts FROM batches WHERE id=?', (lost,)).fetchone()
+    conn.close()
+    # handed out again once the victim's lease expired.
+    assert worker != 'victim' and attempts == 2
+
+
+def test_claim_and_expiry(tmp_path):
+    queue = work_queue.WorkQueue(str(tmp_path / 'ledger.sqlite'), lease_seconds=0.2, max_attempts=2)
+    queue.populate([(0, 99), (1, 99)], batch_size=1)
+    assert queue.claim('a') == (1, [(0, 99)])
+    assert queue.claim('b') == (2, [(1, 99)])
+    assert queue.claim('c') is None
+    time.sleep(0.3)
+    # a's lease has expired: the batch goes to c, and a can no longer complete it.
+    assert queue.claim('c') == (1, [(0, 99)])
+    assert not queue.complete(1, 'a')
+    assert queue.complete(1, 'c')
+    time.sleep(0.3)
+    assert queue.claim('d') == (2, [(1, 99)])
+    time.sleep(0.3)
+    # out of attempts.
+    assert queue.claim('e') is None
+    assert queue.progress() == {work_queue.DONE: 1, work_queue.FAILED: 1}
+
+
+# a worker populating the ledger: records in log each time it works out the roots.
+POPULATOR = '''
+import sys, time
+sys.path.insert(0, sys.argv[1])
+import work_queue
+ledger, log = sys.argv[2], sys.argv[3]
+def roots():
+    with open(log, 'a') as f:
+        f.write('populated\\n')
+    time.sleep(1.)
+    return [(sub, 99) for sub in range(10)]
+queue = work_queue.WorkQueue(ledger, lease_seconds=2.)
+print(queue.populate_from(roots, batch_size=3, poll=0.1))
+'''
+
+
+def test_populated_once(tmp_path):
+    ledger = str(tmp_path / 'ledger.sqlite')
+    log = str(tmp_path / 'populate.log')
+    work_queue.WorkQueue(ledger)
+    workers = [subprocess.Popen([sys.executable, '-c', POPULATOR, LIB, ledger, log], stdout=subprocess.PIPE)
+               for i in range(4)]
+    n = [int(worker.communicate(timeout=60)[0]) for worker in workers]
+    assert n == [4] * 4
+    with open(log) as f:
+        assert f.read().split() == ['populated']